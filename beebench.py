@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+import sys
+import time
+import threading
+import argparse
+import logging
+from beedriver import connection
+from beedriver import simulator
+
+# Logger configuration
+logger = logging.getLogger('beebench')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+
+logger.addHandler(ch)
+
+# Queries sent by the polling threads
+POLL_COMMANDS = ['M625\n', 'M105\n', 'M32\n', 'M1029\n']
+
+
+class EmergencyLatencyBench:
+
+    r"""
+    Emergency command latency benchmark
+
+    Measures the time from a pausePrint() call until the M640 command reaches a
+    simulated printer while several threads poll the printer telemetry, with and
+    without the priority scheduling of the connection.
+
+    Usage:
+        python beebench.py [--pollers N] [--samples N] [--latency SECONDS]
+    """
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, pollers=8, samples=20, latency=0.02):
+
+        self.pollers = pollers
+        self.samples = samples
+        self.latency = latency
+
+        return
+
+    # *************************************************************************
+    #                        run Method
+    # *************************************************************************
+    def run(self, priorityScheduling):
+        r"""
+        Runs the benchmark and returns the sorted list of latencies in seconds
+        """
+        sim = simulator.PrinterSimulator(latency=self.latency, timeScale=20.0, linesPerSecond=5)
+        sim.sdFiles['BENCH'] = bytearray('G1 X1\n' * 100000)
+
+        # Record when the emergency commands reach the printer
+        received = {}
+        receive = sim.receive
+
+        def recordReceive(data):
+            if bytes(data[:4]) == b'M640':
+                received.setdefault('M640', time.time())
+            return receive(data)
+        sim.receive = recordReceive
+
+        conn = connection.Conn(dummyPlug=True, printerSimulator=sim)
+        conn.connectToFirstPrinter()
+        conn.setPriorityScheduling(priorityScheduling)
+        beeCmd = conn.getCommandIntf()
+        beeCmd.startSDPrint('BENCH')
+
+        running = [True]
+
+        def poll(n):
+            i = n
+            while running[0]:
+                conn.sendCmd(POLL_COMMANDS[i % len(POLL_COMMANDS)])
+                i += 1
+
+        threads = [threading.Thread(target=poll, args=(i,)) for i in range(self.pollers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        latencies = []
+        try:
+            for i in range(self.samples):
+                time.sleep(0.2)
+                received.clear()
+                start = time.time()
+                beeCmd.pausePrint()
+                if 'M640' in received:
+                    latencies.append(received['M640'] - start)
+                beeCmd.resumePrint()
+        finally:
+            running[0] = False
+            for t in threads:
+                t.join(2)
+            conn.close()
+
+        return sorted(latencies)
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return float('nan')
+
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emergency command latency benchmark (simulated printer)')
+    parser.add_argument('--pollers', type=int, default=8, help='threads polling the printer telemetry')
+    parser.add_argument('--samples', type=int, default=20, help='pause commands measured per mode')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated reply latency in seconds')
+    args = parser.parse_args()
+
+    logging.getLogger('beecom').setLevel(logging.WARNING)
+
+    bench = EmergencyLatencyBench(args.pollers, args.samples, args.latency)
+
+    logger.info("%d polling threads, %.3f s reply latency, %d samples", args.pollers, args.latency, args.samples)
+    logger.info("%-10s %10s %10s %10s", "mode", "median ms", "p95 ms", "max ms")
+    for mode, enabled in (("fifo", False), ("priority", True)):
+        latencies = bench.run(enabled)
+        logger.info("%-10s %10.1f %10.1f %10.1f", mode, 1000 * percentile(latencies, 0.5),
+                    1000 * percentile(latencies, 0.95), 1000 * percentile(latencies, 1.0))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -463,7 +463,8 @@ def main(findAll = False):
                 else:
                     logger.info("Printer is in Bootloader mode")
 
-                console.beeCmd.flashFirmware(fwFile)         # Flash New Firmware
+                # Flash New Firmware, skipped if the image in the printer is the same
+                console.beeCmd.flashFirmware(fwFile, newestFirmwareVersion, skipIfCurrent=True)
                 #newFwCmd = 'M114 A' + newestFirmwareVersion  # prepare command string to set Firmware String
                 #console.beeCmd.sendCmd(newFwCmd, printReply=False)  # Record New FW String in Bootloader
             # console.FlashFirmware(var)
@@ -13,7 +13,11 @@
 """
 import logging
 
-__all__ = ["commands", "connection", "transferThread", "printStatusThread", "logThread","parsers"]
+__all__ = ["commands", "connection", "transferThread", "printStatusThread", "logThread", "parsers",
+           "readerThread", "asyncCommands", "simulator", "printerStore",
+           "gcodeMinifier", "blockReader", "telemetryThread",
+           "queryCache", "commandScheduler", "jogThread", "streamThread",
+           "jobQueueThread"]
 
 # Logger configuration
 logger = logging.getLogger('beecom')
@@ -0,0 +1,799 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import heapq
+from collections import deque
+from beedriver import logger
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+# Use the standard future when available (python 3 or the "futures" backport) so the
+# returned objects can be awaited with asyncio.wrap_future
+try:
+    from concurrent.futures import Future as CommandFuture
+    from concurrent.futures import CancelledError, TimeoutError
+except ImportError:
+
+    class CancelledError(Exception):
+        pass
+
+    class TimeoutError(Exception):
+        pass
+
+    class CommandFuture(object):
+        r"""
+            CommandFuture Class
+
+            Minimal implementation of the concurrent.futures.Future interface
+        """
+
+        _PENDING = 'PENDING'
+        _RUNNING = 'RUNNING'
+        _CANCELLED = 'CANCELLED'
+        _FINISHED = 'FINISHED'
+
+        def __init__(self):
+            self._cond = threading.Condition()
+            self._state = CommandFuture._PENDING
+            self._result = None
+            self._exception = None
+            self._callbacks = []
+
+        def cancel(self):
+            with self._cond:
+                if self._state in (CommandFuture._RUNNING, CommandFuture._FINISHED):
+                    return False
+                if self._state != CommandFuture._CANCELLED:
+                    self._state = CommandFuture._CANCELLED
+                    self._cond.notify_all()
+            self._invokeCallbacks()
+            return True
+
+        def cancelled(self):
+            return self._state == CommandFuture._CANCELLED
+
+        def running(self):
+            return self._state == CommandFuture._RUNNING
+
+        def done(self):
+            return self._state in (CommandFuture._CANCELLED, CommandFuture._FINISHED)
+
+        def add_done_callback(self, fn):
+            with self._cond:
+                if not self.done():
+                    self._callbacks.append(fn)
+                    return
+            fn(self)
+
+        def result(self, timeout=None):
+            self._wait(timeout)
+            if self._exception is not None:
+                raise self._exception
+            return self._result
+
+        def exception(self, timeout=None):
+            self._wait(timeout)
+            return self._exception
+
+        def set_running_or_notify_cancel(self):
+            with self._cond:
+                if self._state == CommandFuture._CANCELLED:
+                    return False
+                self._state = CommandFuture._RUNNING
+                return True
+
+        def set_result(self, result):
+            with self._cond:
+                self._result = result
+                self._state = CommandFuture._FINISHED
+                self._cond.notify_all()
+            self._invokeCallbacks()
+
+        def set_exception(self, exception):
+            with self._cond:
+                self._exception = exception
+                self._state = CommandFuture._FINISHED
+                self._cond.notify_all()
+            self._invokeCallbacks()
+
+        def _wait(self, timeout):
+            deadline = None if timeout is None else time.time() + timeout
+            with self._cond:
+                while not self.done():
+                    remaining = 1 if deadline is None else deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError()
+                    self._cond.wait(remaining)
+                if self._state == CommandFuture._CANCELLED:
+                    raise CancelledError()
+
+        def _invokeCallbacks(self):
+            for fn in self._callbacks:
+                try:
+                    fn(self)
+                except Exception as ex:
+                    logger.error("Exception in future callback: %s", str(ex))
+            self._callbacks = []
+
+
+class IOExecutor:
+    r"""
+        IOExecutor Class
+
+        Runs blocking printer operations on a bounded pool of worker threads, shared by
+        all printers or owned by one printer (Conn.getExecutor). Operations submitted with
+        the same key (the printer connection) run one at a time in submission order,
+        different printers run in parallel.
+
+        __init__(maxWorkers)                                    Initializes current class
+        submit(key, fn, *args, **kwargs)                        Queues fn and returns a future with its result
+        submitExpiring(key, timeout, fn, *args, **kwargs)       Queues fn, cancelled if it does not start within timeout
+        submitLater(key, delay, fn, *args, **kwargs)            Queues fn after delay seconds
+        cancelPending(key)                                      Cancels the operations that did not start yet
+        shutdown(wait, cancelPending)                           Stops the worker threads
+    """
+
+    DEFAULT_WORKERS = 4
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, maxWorkers=DEFAULT_WORKERS):
+        r"""
+        __init__ Method
+
+        arguments:
+            maxWorkers - maximum number of worker threads
+        """
+        self._maxWorkers = maxWorkers
+        self._cond = threading.Condition()
+        self._queues = {}           # key -> deque with the pending operations
+        self._ready = deque()       # keys with pending operations and no running operation
+        self._busy = set()          # keys with a running operation
+        self._timers = []           # heap with the delayed operations
+        self._timerSeq = 0
+        self._workers = []
+        self._idleWorkers = 0
+        self._shutdown = False
+
+        return
+
+    # *************************************************************************
+    #                        submit Method
+    # *************************************************************************
+    def submit(self, key, fn, *args, **kwargs):
+        r"""
+        submit method
+
+        Queues an operation
+
+        arguments:
+            key - printer identifier, operations with the same key are serialized
+            fn - callable to run
+
+        returns:
+            future with the value returned by fn
+        """
+        return self.submitExpiring(key, None, fn, *args, **kwargs)
+
+    # *************************************************************************
+    #                        submitExpiring Method
+    # *************************************************************************
+    def submitExpiring(self, key, timeout, fn, *args, **kwargs):
+        r"""
+        submitExpiring method
+
+        Queues an operation that is cancelled instead of executed if it could not start
+        within timeout seconds, e.g. because a long operation of the same printer was
+        still running
+
+        arguments:
+            key - printer identifier, operations with the same key are serialized
+            timeout - seconds the operation may wait to start (None waits forever)
+            fn - callable to run
+
+        returns:
+            future with the value returned by fn
+        """
+        future = CommandFuture()
+        expiry = None if timeout is None else time.time() + timeout
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('IOExecutor is shut down')
+            self._enqueue(key, (future, fn, args, kwargs, expiry))
+
+        return future
+
+    # *************************************************************************
+    #                        submitLater Method
+    # *************************************************************************
+    def submitLater(self, key, delay, fn, *args, **kwargs):
+        r"""
+        submitLater method
+
+        Queues an operation after delay seconds without holding a thread while waiting
+
+        returns:
+            future with the value returned by fn
+        """
+        future = CommandFuture()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('IOExecutor is shut down')
+            self._timerSeq += 1
+            heapq.heappush(self._timers, (time.time() + delay, self._timerSeq, key, (future, fn, args, kwargs, None)))
+            self._startWorker()
+            self._cond.notify_all()
+
+        return future
+
+    # *************************************************************************
+    #                        cancelPending Method
+    # *************************************************************************
+    def cancelPending(self, key=None):
+        r"""
+        cancelPending method
+
+        Cancels the queued and delayed operations of key (all keys if None). The running
+        operations are not interrupted
+
+        returns:
+            number of operations cancelled
+        """
+        cancelled = []
+        with self._cond:
+            for k in list(self._queues.keys()):
+                if key is None or k == key:
+                    cancelled.extend(item[0] for item in self._queues[k])
+                    if k in self._busy:
+                        # The worker removes the queue when the running operation ends
+                        self._queues[k].clear()
+                    else:
+                        del self._queues[k]
+                        self._ready.remove(k)
+            timers = [t for t in self._timers if key is None or t[2] == key]
+            if len(timers) > 0:
+                cancelled.extend(t[3][0] for t in timers)
+                self._timers = [t for t in self._timers if not (key is None or t[2] == key)]
+                heapq.heapify(self._timers)
+
+        # Futures run their callbacks when cancelled, outside the executor lock
+        return len([f for f in cancelled if f.cancel()])
+
+    # *************************************************************************
+    #                        shutdown Method
+    # *************************************************************************
+    def shutdown(self, wait=True, cancelPending=False):
+        r"""
+        shutdown method
+
+        Stops accepting operations. Delayed operations are cancelled, queued operations
+        are still executed unless cancelPending is True
+        """
+        if cancelPending:
+            self.cancelPending()
+
+        with self._cond:
+            self._shutdown = True
+            for t in self._timers:
+                t[3][0].cancel()
+            self._timers = []
+            self._cond.notify_all()
+
+        if wait:
+            for w in list(self._workers):
+                if w is not threading.current_thread():
+                    w.join()
+
+        return
+
+    # *************************************************************************
+    #                        _enqueue Method
+    # *************************************************************************
+    def _enqueue(self, key, item):
+        r"""
+        Adds an operation to the key queue. Must be called with the condition acquired
+        """
+        q = self._queues.setdefault(key, deque())
+        q.append(item)
+        if len(q) == 1 and key not in self._busy:
+            self._ready.append(key)
+
+        self._startWorker()
+        self._cond.notify()
+
+    # *************************************************************************
+    #                        _startWorker Method
+    # *************************************************************************
+    def _startWorker(self):
+        r"""
+        Starts a new worker if all workers are busy and the limit was not reached
+        """
+        if self._idleWorkers == 0 and len(self._workers) < self._maxWorkers:
+            w = threading.Thread(target=self._worker, name="bee_io_executor_%d" % len(self._workers))
+            w.daemon = True
+            self._workers.append(w)
+            w.start()
+
+    # *************************************************************************
+    #                        _nextItem Method
+    # *************************************************************************
+    def _nextItem(self):
+        r"""
+        Blocks until an operation is ready to run. Returns (key, item) or None when
+        the executor is shut down
+        """
+        with self._cond:
+            while True:
+                now = time.time()
+                while len(self._timers) > 0 and self._timers[0][0] <= now:
+                    t = heapq.heappop(self._timers)
+                    self._enqueue(t[2], t[3])
+
+                if len(self._ready) > 0:
+                    key = self._ready.popleft()
+                    self._busy.add(key)
+                    return key, self._queues[key].popleft()
+
+                if self._shutdown:
+                    return None
+
+                timeout = None
+                if len(self._timers) > 0:
+                    timeout = self._timers[0][0] - now
+
+                self._idleWorkers += 1
+                self._cond.wait(timeout)
+                self._idleWorkers -= 1
+
+    # *************************************************************************
+    #                        _worker Method
+    # *************************************************************************
+    def _worker(self):
+
+        while True:
+            nxt = self._nextItem()
+            if nxt is None:
+                return
+
+            key, (future, fn, args, kwargs, expiry) = nxt
+
+            if expiry is not None and time.time() > expiry:
+                # Too late, the printer state may have changed since it was requested
+                future.cancel()
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as ex:
+                    future.set_exception(ex)
+                else:
+                    future.set_result(result)
+
+            with self._cond:
+                self._busy.discard(key)
+                if len(self._queues[key]) > 0:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._queues[key]
+
+
+_defaultExecutor = None
+_defaultExecutorLock = threading.Lock()
+
+
+# *************************************************************************
+#                        getDefaultExecutor Method
+# *************************************************************************
+def getDefaultExecutor():
+    r"""
+    Returns the IOExecutor shared by all the asynchronous interfaces
+    """
+    global _defaultExecutor
+    with _defaultExecutorLock:
+        if _defaultExecutor is None:
+            _defaultExecutor = IOExecutor()
+
+    return _defaultExecutor
+
+
+# *************************************************************************
+#                        _copyOutcome Method
+# *************************************************************************
+def _copyOutcome(source, target):
+    r"""
+    Completes the future target with the outcome of the finished future source
+    """
+    if source.cancelled():
+        target.set_exception(CancelledError())
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class AsyncConn:
+    r"""
+        AsyncConn Class
+
+        Non blocking interface to a Conn object. Every method returns a future and the
+        operation runs on the IOExecutor, by default the single worker executor of the
+        printer. With a timeout, operations that could not start within timeout seconds
+        are cancelled
+
+        __init__(conn, executor, timeout)                       Initializes current class
+        sendCmd(cmd, wait, timeout)                             Sends a command to the 3D printer
+        dispatch(message)                                       Writes data to the buffer and reads the response
+        dispatchPipelined(messages, window)                     Writes several commands keeping them in flight
+        sendBatch(commands, wait, timeout)                      Writes several commands in as few USB writes as possible
+        waitFor(cmd, s, timeout)                                Writes command to the printer and waits for the response
+        waitForStatus(cmd, s, timeout)                          Writes command to the printer and waits for the status
+        read(timeout)                                           Reads data from the communication buffer
+        write(message, timeout)                                 Writes data to the communication buffer
+        ping()                                                  Tries to contact the printer
+        cancelPending()                                         Cancels the operations that did not start yet
+        getCommandIntf()                                        Returns the AsyncBeeCmd object for this connection
+    """
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, conn, executor=None, timeout=None):
+        r"""
+        __init__ Method
+
+        arguments:
+            conn - connected Conn object
+            executor - optional IOExecutor (default = executor of the printer)
+            timeout - optional seconds an operation may wait to start
+        """
+        self._conn = conn
+        self._executor = executor
+        self._timeout = timeout
+
+        return
+
+    def _getExecutor(self):
+        return self._executor if self._executor is not None else self._conn.getExecutor()
+
+    def _submit(self, fn, *args, **kwargs):
+        return self._getExecutor().submitExpiring(self._conn, self._timeout, fn, *args, **kwargs)
+
+    def cancelPending(self):
+        return self._getExecutor().cancelPending(self._conn)
+
+    def sendCmd(self, cmd, wait=None, timeout=None):
+        return self._submit(self._conn.sendCmd, cmd, wait, timeout)
+
+    def dispatch(self, message):
+        return self._submit(self._conn.dispatch, message)
+
+    def dispatchPipelined(self, messages, window=None):
+        return self._submit(self._conn.dispatchPipelined, messages, window)
+
+    def sendBatch(self, commands, wait=None, timeout=None):
+        return self._submit(self._conn.sendBatch, commands, wait, timeout)
+
+    def waitFor(self, cmd, s, timeout=None):
+        return self._submit(self._conn.waitFor, cmd, s, timeout)
+
+    def waitForStatus(self, cmd, s, timeout=None):
+        return self._submit(self._conn.waitForStatus, cmd, s, timeout)
+
+    def read(self, timeout=2000):
+        return self._submit(self._conn.read, timeout)
+
+    def write(self, message, timeout=500):
+        return self._submit(self._conn.write, message, timeout)
+
+    def ping(self):
+        return self._submit(self._conn.ping)
+
+    # *************************************************************************
+    #                        getCommandIntf Method
+    # *************************************************************************
+    def getCommandIntf(self):
+        r"""
+        Returns the AsyncBeeCmd object with the non blocking command interface or None
+        if the printer is not connected
+        """
+        beeCmd = self._conn.getCommandIntf()
+        if beeCmd is None:
+            return None
+
+        return AsyncBeeCmd(self._conn, beeCmd, self._executor, self._timeout)
+
+
+class AsyncBeeCmd:
+    r"""
+        AsyncBeeCmd Class
+
+        Non blocking interface to the BeeCmd commands. Every public BeeCmd method is
+        available with the same arguments and returns a future. The status monitor runs
+        on the IOExecutor instead of a dedicated thread. File transfers are started on the
+        IOExecutor and run in their transfer thread, their futures complete when the
+        transfer ends. By default the operations run on the single worker executor of
+        the printer, in call order. Futures can be cancelled until the operation starts
+        and, with a timeout, the operations that could not start within timeout seconds
+        are cancelled
+
+        __init__(conn, beeCmd, executor, timeout)               Initializes current class
+        transferSDFile(fileName, sdFileName)                    Transfers GCode file, the future completes when the transfer ends
+        printFile(filePath, printTemperature, sdFileName)       Transfers a file and starts printing
+        repeatLastPrint(printTemperature)                       Repeats last printed file
+        flashFirmware(fileName, firmwareString)                 Flash New Firmware
+        startStatusMonitor(statusCallback, interval)            Polls the print variables every interval seconds
+        stopStatusMonitor()                                     Stops the status monitor
+        cancelPending()                                         Cancels the operations that did not start yet
+        cancel(future)                                          Cancels an operation or aborts its running transfer
+        cancelAll()                                             Cancels the pending operations and the running transfers
+        cancelTransfer()                                        Aborts the current transfer without waiting for the queue
+        cancelPrint()                                           Cancels the print without waiting for the queue
+        pausePrint()                                            Pauses the print without waiting for the queue
+        enterShutdown()                                         Enters shutdown without waiting for the queue
+    """
+
+    STATUS_MONITOR_INTERVAL = 5
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, conn, beeCmd=None, executor=None, timeout=None):
+        r"""
+        __init__ Method
+
+        arguments:
+            conn - connected Conn object
+            beeCmd - optional BeeCmd object (default = conn.getCommandIntf())
+            executor - optional IOExecutor (default = executor of the printer)
+            timeout - optional seconds an operation may wait to start
+        """
+        self._conn = conn
+        self._beeCmd = beeCmd if beeCmd is not None else conn.getCommandIntf()
+        self._executor = executor
+        self._timeout = timeout
+        self._statusCallback = None
+        self._transfers = {}            # future -> FileTransferThread of the running transfers
+
+        return
+
+    def __getattr__(self, name):
+        attr = getattr(self._beeCmd, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def submitter(*args, **kwargs):
+            return self._submit(attr, *args, **kwargs)
+
+        submitter.__name__ = name
+        submitter.__doc__ = attr.__doc__
+
+        return submitter
+
+    def _getExecutor(self):
+        return self._executor if self._executor is not None else self._conn.getExecutor()
+
+    def _submit(self, fn, *args, **kwargs):
+        return self._getExecutor().submitExpiring(self._conn, self._timeout, fn, *args, **kwargs)
+
+    def cancelPending(self):
+        return self._getExecutor().cancelPending(self._conn)
+
+    # *************************************************************************
+    #                        cancel Method
+    # *************************************************************************
+    def cancel(self, future):
+        r"""
+        cancel method
+
+        Cancels an operation of this object. Operations that did not start are removed
+        from the executor and running file transfers are aborted, their future completes
+        with False. Other running operations can not be interrupted
+
+        returns:
+            True if the operation was cancelled or its transfer aborted
+        """
+        if future.cancel():
+            return True
+
+        thread = self._transfers.get(future)
+        if thread is None or future.done():
+            return False
+        thread.cancelFileTransfer()
+
+        return True
+
+    # *************************************************************************
+    #                        cancelAll Method
+    # *************************************************************************
+    def cancelAll(self):
+        r"""
+        cancelAll method
+
+        Cancels the operations that did not start, stops the status monitor and aborts
+        the running file transfers
+
+        returns:
+            number of operations cancelled
+        """
+        cancelled = self.cancelPending()
+        self.stopStatusMonitor()
+        for future in list(self._transfers.keys()):
+            if self.cancel(future):
+                cancelled += 1
+
+        return cancelled
+
+    def cancelTransfer(self):
+        # Not queued behind the pending operations, it only flags the transfer thread
+        future = CommandFuture()
+        future.set_running_or_notify_cancel()
+        future.set_result(self._beeCmd.cancelTransfer())
+
+        return future
+
+    def cancelPrint(self):
+        return self._runNow(self._beeCmd.cancelPrint)
+
+    def pausePrint(self):
+        return self._runNow(self._beeCmd.pausePrint)
+
+    def enterShutdown(self):
+        return self._runNow(self._beeCmd.enterShutdown)
+
+    # *************************************************************************
+    #                        _runNow Method
+    # *************************************************************************
+    def _runNow(self, fn, *args, **kwargs):
+        r"""
+        Runs fn in its own thread instead of the executor, so the emergency commands
+        (M112, M640, M36) are not queued behind a long operation such as a homing or a
+        transfer start. The returned future completes with the value returned by fn
+        """
+        future = CommandFuture()
+        future.set_running_or_notify_cancel()
+
+        def run():
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as ex:
+                future.set_exception(ex)
+
+        t = threading.Thread(target=run, name="bee_async_%s" % fn.__name__)
+        t.daemon = True
+        t.start()
+
+        return future
+
+    def transferSDFile(self, fileName, sdFileName=None, **kwargs):
+        return self._submitTransfer(None, self._beeCmd.transferSDFile, fileName, sdFileName,
+                                    background=True, **kwargs)
+
+    def printFile(self, filePath, printTemperature=200, sdFileName=None, **kwargs):
+        return self._submitTransfer(None, self._beeCmd.printFile, filePath, printTemperature, sdFileName,
+                                    background=True, **kwargs)
+
+    def repeatLastPrint(self, printTemperature=200):
+        return self._submitTransfer(None, self._beeCmd.repeatLastPrint, printTemperature,
+                                    background=True)
+
+    def flashFirmware(self, fileName, firmwareString='BEEVC-BEETHEFIRST-10.0.0.BIN', **kwargs):
+
+        def finish():
+            # As BeeCmd.flashFirmware, once the image is written
+            self._beeCmd.setFirmwareString(firmwareString)
+
+        return self._submitTransfer(finish, self._beeCmd._startFirmwareFlash, fileName, firmwareString,
+                                    background=True, **kwargs)
+
+    # *************************************************************************
+    #                        _submitTransfer Method
+    # *************************************************************************
+    def _submitTransfer(self, finish, start, *args, **kwargs):
+        r"""
+        Runs start, a BeeCmd method that starts a transfer thread, on the executor. The
+        transfer runs in its own thread so the operations submitted after it (status
+        queries, cancelTransfer...) do not wait for it. The returned future completes
+        when the transfer thread ends, with the value returned by start (False if the
+        transfer was cancelled) or, if finish is given, with the value returned by
+        finish, which is then run on the executor
+        """
+        future = CommandFuture()
+
+        def begin():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                previous = self._beeCmd.getTransferThread()
+                result = start(*args, **kwargs)
+                thread = self._beeCmd.getTransferThread()
+            except BaseException as ex:
+                future.set_exception(ex)
+                return
+
+            if thread is None or thread is previous:
+                # No transfer was started (missing file, transfer already running...)
+                future.set_result(result)
+                return
+
+            self._transfers[future] = thread
+            thread.addDoneCallback(lambda t: self._transferEnded(future, t, result, finish))
+
+        started = self._submit(begin)
+        started.add_done_callback(lambda f: future.cancel() if f.cancelled() else None)
+
+        return future
+
+    def _transferEnded(self, future, thread, result, finish):
+
+        self._transfers.pop(future, None)
+        if thread.cancelTransfer:
+            result = False
+
+        if finish is None:
+            future.set_result(result)
+            return
+
+        try:
+            finished = self._getExecutor().submit(self._conn, finish)
+        except RuntimeError as ex:
+            future.set_exception(ex)
+            return
+        finished.add_done_callback(lambda f: _copyOutcome(f, future))
+
+    # *************************************************************************
+    #                        startStatusMonitor Method
+    # *************************************************************************
+    def startStatusMonitor(self, statusCallback, interval=STATUS_MONITOR_INTERVAL):
+        r"""
+        startStatusMonitor method
+
+        Polls the print variables every interval seconds and passes them to statusCallback
+        until the print finishes or stopStatusMonitor is called. Unlike the BeeCmd version
+        no thread is created, the polls are scheduled on the executor.
+        """
+        self._statusCallback = statusCallback
+        self._submit(self._pollStatus, statusCallback, interval)
+
+    # *************************************************************************
+    #                        stopStatusMonitor Method
+    # *************************************************************************
+    def stopStatusMonitor(self):
+        r"""
+        Stops the status monitor
+        """
+        self._statusCallback = None
+
+    def _pollStatus(self, statusCallback, interval):
+
+        if self._statusCallback is not statusCallback:
+            return
+
+        printVars = self._beeCmd.getPrintVariables()
+        if printVars is None:
+            printVars = {}
+
+        statusCallback(printVars)
+
+        if 'Lines' in printVars and 'Executed Lines' in printVars and \
+                printVars['Executed Lines'] >= printVars['Lines']:
+            # the print has finished
+            self._statusCallback = None
+            return
+
+        self._getExecutor().submitLater(self._conn, interval, self._pollStatus, statusCallback, interval)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import threading
+from beedriver import logger
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+# *************************************************************************
+#                        sliceView Method
+# *************************************************************************
+def sliceView(data, start, end):
+    r"""
+    Returns a read only view of data[start:end] without copying it. Python 2 pyusb
+    only accepts the old buffer objects, memoryview is used where buffer does not exist
+    """
+    try:
+        return buffer(data, start, end - start)
+    except NameError:
+        return memoryview(data)[start:end]
+
+
+class BlockReader:
+    r"""
+        BlockReader Class
+
+        Double buffered reader of the blocks of a file transfer. A background thread
+        reads the next block from the source while the current one is being sent, so
+        the USB link does not wait for the disk (or the G-code minifier). The current
+        block is kept until the next one is requested so it can be sent again after
+        a transmission error.
+
+        Works as a file object for the transfer (seek/read of whole blocks)
+
+        __init__(fileObj, blockBytes)                           Initializes current class
+        prefetch(pos)                                           Starts reading the block at pos in the background
+        seek(pos)                                               Moves the read position
+        read(n)                                                 Returns the block at the read position
+        getSourcePosition()                                     Returns the source position after the last block read
+        close()                                                 Stops the reader thread and closes the source
+    """
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, fileObj, blockBytes):
+        r"""
+        __init__ Method
+
+        arguments:
+            fileObj - source file object (seek/read), only used by the reader thread
+            blockBytes - block size in bytes
+        """
+        self._fileObj = fileObj
+        self._blockBytes = blockBytes
+        self._cond = threading.Condition()
+        self._blocks = {}               # position -> (block data, source position after the block)
+        self._sourcePos = 0
+        self._wanted = []               # positions to read, in order
+        self._reading = None            # position being read
+        self._pos = 0
+        self._error = None
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="bee_transfer._block_reader_thread")
+        self._thread.daemon = True
+        self._thread.start()
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while len(self._wanted) == 0 and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                pos = self._wanted.pop(0)
+                self._reading = pos
+
+            try:
+                self._fileObj.seek(pos)
+                data = self._fileObj.read(self._blockBytes)
+                if hasattr(self._fileObj, 'getSourcePosition'):
+                    sourcePos = self._fileObj.getSourcePosition()
+                else:
+                    sourcePos = pos + len(data)
+            except Exception as ex:
+                logger.error("Block reader error: %s", str(ex))
+                data = None
+                self._error = ex
+
+            with self._cond:
+                self._reading = None
+                if data is not None:
+                    self._blocks[pos] = (data, sourcePos)
+                self._cond.notify_all()
+
+    # *************************************************************************
+    #                        prefetch Method
+    # *************************************************************************
+    def prefetch(self, pos):
+        r"""
+        Starts reading the block at pos in the background
+        """
+        with self._cond:
+            self._request(pos, False)
+
+        return
+
+    def _request(self, pos, urgent):
+        if pos in self._blocks or pos == self._reading or pos in self._wanted:
+            return
+        if urgent:
+            self._wanted.insert(0, pos)
+        else:
+            self._wanted.append(pos)
+        self._cond.notify_all()
+
+    # *************************************************************************
+    #                        seek Method
+    # *************************************************************************
+    def seek(self, pos):
+        self._pos = pos
+
+    # *************************************************************************
+    #                        read Method
+    # *************************************************************************
+    def read(self, n=None):
+        r"""
+        Returns the block at the read position, waiting for the reader thread if it
+        was not prefetched. Blocks before this one are released
+        """
+        pos = self._pos
+        with self._cond:
+            self._request(pos, True)
+            while pos not in self._blocks:
+                if self._error is not None:
+                    raise IOError("Block reader error: %s" % str(self._error))
+                self._cond.wait(1)
+
+            for p in list(self._blocks.keys()):
+                if p < pos:
+                    del self._blocks[p]
+            data, self._sourcePos = self._blocks[pos]
+
+        if n is not None and n < len(data):
+            data = data[:n]
+        self._pos += len(data)
+
+        return data
+
+    # *************************************************************************
+    #                        getSourcePosition Method
+    # *************************************************************************
+    def getSourcePosition(self):
+        r"""
+        Returns the position in the source file (e.g. before minification) after the
+        last block read
+        """
+        return self._sourcePos
+
+    # *************************************************************************
+    #                        close Method
+    # *************************************************************************
+    def close(self):
+        r"""
+        Stops the reader thread and closes the source file
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._fileObj.close()
+
+        return
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+import threading
+import heapq
+import itertools
+import contextlib
+from beedriver import queryCache
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+# Priority classes, lower values are written first
+EMERGENCY = 0
+NORMAL = 1
+TELEMETRY = 2
+
+# Stop, pause and shutdown
+EMERGENCY_COMMANDS = frozenset(['M112', 'M640', 'M36'])
+
+
+# *************************************************************************
+#                        priorityOf Method
+# *************************************************************************
+def priorityOf(message):
+    r"""
+    Returns the priority class of a command: EMERGENCY for stop/pause/shutdown,
+    TELEMETRY for the read only queries and NORMAL for everything else
+    """
+    code = queryCache.commandCode(message)
+    if code in EMERGENCY_COMMANDS:
+        return EMERGENCY
+    if code in queryCache.READ_ONLY_COMMANDS:
+        return TELEMETRY
+
+    return NORMAL
+
+
+class CommandScheduler:
+    r"""
+        CommandScheduler Class
+
+        Orders the writes to the printer by priority class. Each write takes the USB
+        write slot; when it is released the waiting write with the lowest priority
+        class gets it, in arrival order within the same class. An emergency command
+        is therefore written on the next slot, ahead of the queued telemetry
+
+        __init__()                                              Initializes current class
+        slot(priority)                                          Context manager that holds the write slot
+        getWaiting()                                            Returns the number of writes waiting per class
+    """
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self):
+        r"""
+        __init__ Method
+        """
+        self._cond = threading.Condition()
+        self._busy = False
+        self._waiting = []              # heap of (priority, arrival number)
+        self._arrivals = itertools.count()
+
+        return
+
+    # *************************************************************************
+    #                        slot Method
+    # *************************************************************************
+    @contextlib.contextmanager
+    def slot(self, priority=NORMAL):
+        r"""
+        slot method
+
+        Waits for the write slot, in priority order, and holds it in the with block
+        """
+        ticket = (priority, next(self._arrivals))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            while self._busy or self._waiting[0] != ticket:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._busy = True
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    # *************************************************************************
+    #                        getWaiting Method
+    # *************************************************************************
+    def getWaiting(self):
+        r"""
+        Returns a dict with the number of writes waiting for the slot per priority class
+        """
+        with self._cond:
+            waiting = {EMERGENCY: 0, NORMAL: 0, TELEMETRY: 0}
+            for priority, _ in self._waiting:
+                waiting[priority] += 1
+
+            return waiting
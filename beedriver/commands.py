@@ -4,7 +4,11 @@ import os
 import threading
 import time
 from beedriver import logger, printStatusThread
+from beedriver import parsers
+from beedriver import queryCache
 from beedriver import transferThread
+from beedriver import printerStore
+from beedriver import streamThread
 import platform
 
 # Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
@@ -40,6 +44,8 @@ class BeeCmd:
     homeXY()                                                  Home X and Y axis
     homeZ()                                                   Home Z axis
     move(x, y, z, e, f, wait)                                 Relative move
+    jog(x, y, z, e, f)                                        Adds a relative displacement to the continuous jog channel
+    stopJog(wait)                                             Stops the continuous jog channel
     startCalibration()                                        Starts the calibration procedure
     cancelCalibration()                                       Cancels the calibration procedure.
     goToNextCalibrationPoint()                                Moves to next calibration point.
@@ -54,27 +60,41 @@ class BeeCmd:
     goToRestPos()                                             Moves the printer to the rest position
     setFilamentString(filStr)                                 Sets filament string
     getFilamentString()                                       Returns filament string
-    printFile(filePath, printTemperature, sdFileName)         Transfers a file to the printer and starts printing
+    printFile(filePath, printTemperature, sdFileName, ...)    Transfers a file to the printer and starts printing
     repeatLastPrint(printTemperature)                         Repeats last printed file
+    streamPrint(filePath, printTemperature, resume, window)   Prints a file streaming its lines over USB, without the SD card
+    getStreamProgress()                                       Returns the line counters of the streamed print
+    queuePrint(filePath, printTemperature, sdFileName)        Adds a print job to the printer job queue
+    getPrintQueue()                                           Returns the jobs of the printer job queue
+    removeQueuedPrint(job)                                    Removes a job that did not start printing
     initSD()                                                  Inits SD card
     getFileList()                                             Returns list with GCode files stored in the printers memory
     createFile(fileName)                                      Creates a file in the SD card root directory
     openFile(fileName)                                        Opens file in the sd card root dir
+    getSDFileSize(fileName)                                   Opens file in the sd card root dir and returns its size
     startSDPrint(sdFileName)                                  Starts printing selected file
     cancelPrint()                                             Cancels current print and home the printer axis
     getPrintVariables()                                       Returns List with Print Variables:
     setBlowerSpeed(speed)                                     Sets Blower Speed
     setFirmwareString(fwStr)                                  Sets new bootloader firmware String
-    flashFirmware(fileName, firmwareString)                   Flash New Firmware
-    transferSDFile(fileName, sdFileName)                      Transfers GCode file to printer internal memory
-    getTransferCompletionState()                              Returns current transfer completion percentage 
+    flashFirmware(fileName, firmwareString, ...)              Flash New Firmware
+    isFirmwareCurrent(fileName, firmwareString)               Returns True if the printer already runs a firmware image
+    transferSDFile(fileName, sdFileName, ...)                 Transfers GCode file to printer internal memory
+    getTransferCompletionState(details)                       Returns current transfer completion percentage 
+    getTransferResumedBytes()                                 Returns the bytes the last transfer did not resend thanks to resuming
+    getTransferSkippedBytes()                                 Returns the bytes the last transfer did not send because they were in the SD card
+    getTransferThread()                                       Returns the FileTransferThread of the last transfer
     cancelTransfer()                                          Cancels Current Transfer 
     getFirmwareVersion()                                      Returns Firmware Version String
+    getBootloaderVersion()                                    Returns Bootloader Version String
     pausePrint()                                              Initiates pause process
     resumePrint()                                             Resume print from pause/shutdown
     enterShutdown()                                           Pauses print and sets printer in shutdown
+    getPrintState()                                           Returns the pause/shutdown state of the print
+    waitForPause(timeout)                                     Waits until a pause in progress completes
     clearShutdownFlag()                                       Clears shutdown Flag
     sendCmd(cmd, wait, timeout)                               Sends command to printer
+    sendBatch(commands, wait, timeout)                        Sends several commands in as few USB writes as possible
     startStatusMonitor()                                      Starts the print status monitor thread
     isHeating()                                               Returns True if heating is still in progress
     isTransferring()                                          Returns True if a file is being transfer
@@ -83,6 +103,16 @@ class BeeCmd:
     MESSAGE_SIZE = 512
     BLOCK_SIZE = 64
 
+    # Pause/shutdown states
+    PRINT_RUNNING = 'Running'
+    PRINT_PAUSING = 'Pausing'
+    PRINT_PAUSED = 'Paused'
+    PRINT_SHUTDOWN = 'Shutdown'
+
+    PAUSE_POLL_MIN = 0.1        # first status poll interval while waiting for the pause (seconds)
+    PAUSE_POLL_MAX = 2          # the interval doubles up to this value
+    PAUSE_TIMEOUT = 300         # seconds enterShutdown waits for the printer to pause
+
     # *************************************************************************
     #                            __init__ Method
     # *************************************************************************
@@ -105,10 +135,6 @@ class BeeCmd:
         self._calibrationState = 0
         self._setPointTemperature = 0
 
-        self._pausing = False
-        self._paused = False
-        self._shutdown = False
-
         self._inBootloader = False
         self._inFirmware = False
 
@@ -186,6 +212,7 @@ class BeeCmd:
     # *************************************************************************
     #                            getPrinterMode Method
     # *************************************************************************
+    @queryCache.cachedQuery
     def getPrinterMode(self):
         r"""
         getPrinterMode method
@@ -196,19 +223,26 @@ class BeeCmd:
             logger.debug('File Transfer Thread active, please wait for transfer thread to end')
             return None
 
+        snapshot = self._beeCon.getTelemetrySnapshot()
+        if snapshot is not None and snapshot.mode is not None:
+            self._setMode(snapshot.mode)
+            return snapshot.mode
+
         with self._commandLock:
             resp = self._beeCon.sendCmd("M625\n")
 
-            if 'Bad M-code 625' in resp:   # printer in bootloader mode
-                self._inBootloader = True
-                self._inFirmware = False
-                return "Bootloader"
-            elif 'ok Q' in resp:
-                self._inBootloader = False
-                self._inFirmware = True
-                return "Firmware"
-            else:
-                return None
+            mode = parsers.parsePrinterMode(resp)
+            self._setMode(mode)
+
+            return mode
+
+    def _setMode(self, mode):
+        if mode == 'Bootloader':
+            self._inBootloader = True
+            self._inFirmware = False
+        elif mode == 'Firmware':
+            self._inBootloader = False
+            self._inFirmware = True
         
     # *************************************************************************
     #                            cleanBuffer Method
@@ -274,9 +308,13 @@ class BeeCmd:
 
         return True if the printer is in printing mode or False if not
         """
-        if self.isTransferring():
+        if self._isOwnTransfer():
             return False
 
+        stream = self._beeCon.getStream()
+        if stream is not None:
+            return stream.getState() == stream.STATE_PRINTING
+
         status = self.getStatus()
         if status is not None and status == 'SD_Print':
             return True
@@ -296,6 +334,10 @@ class BeeCmd:
         if self.isTransferring() or self.isHeating():
             return True
 
+        stream = self._beeCon.getStream()
+        if stream is not None and not stream.isPaused():
+            return True
+
         status = self.getStatus()
         if status is not None and status == 'SD_Print':
             return True
@@ -329,7 +371,7 @@ class BeeCmd:
 
         return True if the printer is in Shutdown mode or False if not
         """
-        if self.isTransferring():
+        if self._isOwnTransfer():
             return False
 
         status = self.getStatus()
@@ -341,66 +383,133 @@ class BeeCmd:
     # *************************************************************************
     #                            getStatus Method
     # *************************************************************************
+    @queryCache.cachedQuery
     def getStatus(self):
         r"""
         getStatus method
 
-        returns the current status of the printer
+        returns the current status of the printer. During G-code transfers the status is
+        read between two blocks
         """
-        mode = self.getPrinterMode()
+        return self._readStatus()
+
+    def _readStatus(self):
+        r"""
+        Reads the status of the printer without the query cache (getStatus)
+        """
+        snapshot = self._beeCon.getTelemetrySnapshot()
+        if snapshot is not None and snapshot.status is not None:
+            self._setMode(snapshot.mode)
+            return self._setStatus(snapshot.status)
+
+        with self._commandLock:
+            # The same M625 reply gives the mode and the status
+            resp = self._beeCon.queryBetweenBlocks("M625\n")
+
+        if resp is None:
+            logger.debug('File Transfer Thread active, please wait for transfer thread to end')
+            return None
+
+        mode = parsers.parsePrinterMode(resp)
+        self._setMode(mode)
         if mode == 'Bootloader':
             logger.info('Printer in Bootloader mode')
             return 'Bootloader'
-        if mode is None or (mode != 'Firmware' and mode != 'Bootloader'):
+        if mode is None:
             logger.warning('GetStatus: can only get status in firmware')
             return None
 
-        if self.isTransferring():
-            logger.debug('File Transfer Thread active, please wait for transfer thread to end')
-            return None
+        # Other commands can use the printer while waiting to ask again
+        while 's:' not in resp.lower():
+            time.sleep(1)
+            with self._commandLock:
+                reply = self._beeCon.queryBetweenBlocks("M625\n")
+            if reply is None:
+                return None
+            resp += reply
 
-        resp = ''
-        status = ''
-        done = False
+        return self._setStatus(parsers.parseStatusReply(resp))
 
-        with self._commandLock:
-            while not done:
-
-                while 's:' not in resp.lower():
-                    resp += self._beeCon.sendCmd("M625\n")
-                    time.sleep(1)
-
-                if 'pause' in resp.lower():
-                    status = 'Pause'
-                    self._paused = True
-                    done = True
-                elif 'shutdown' in resp.lower():
-                    status = 'Shutdown'
-                    self._shutdown = True
-                    done = True
-
-                elif 's:3' in resp.lower():
-                    status = 'Ready'
-                    done = True
-                elif 's:4' in resp.lower():
-                    status = 'Moving'
-                    done = True
-                elif 's:5' in resp.lower():
-                    status = 'SD_Print'
-                    done = True
-                elif 's:6' in resp.lower():
-                    status = 'Transfer'
-                    done = True
-                elif 's:7' in resp.lower() or 'pause' in resp.lower():
-                    status = 'Pause'
-                    self._paused = True
-                    done = True
-                elif 's:9' in resp.lower() or 'shutdown' in resp.lower():
-                    status = 'Shutdown'
-                    self._shutdown = True
-                    done = True
-
-            return status
+    def _setStatus(self, status):
+        if status == 'Pause':
+            self._setPrintState(BeeCmd.PRINT_PAUSED, [BeeCmd.PRINT_RUNNING, BeeCmd.PRINT_PAUSING])
+        elif status == 'Shutdown':
+            self._setPrintState(BeeCmd.PRINT_SHUTDOWN)
+        elif status == 'SD_Print':
+            # Resumed from the printer panel
+            self._setPrintState(BeeCmd.PRINT_RUNNING, [BeeCmd.PRINT_PAUSED, BeeCmd.PRINT_SHUTDOWN])
+
+        return status
+
+    # *************************************************************************
+    #                            _setPrintState Method
+    # *************************************************************************
+    def _setPrintState(self, state, fromStates=None):
+        r"""
+        Moves the pause/shutdown state machine of the connection (Conn.setPrintState),
+        shared by all the BeeCmd objects of the printer
+        """
+        self._beeCon.setPrintState(state, fromStates)
+
+        return
+
+    # *************************************************************************
+    #                            getPrintState Method
+    # *************************************************************************
+    def getPrintState(self):
+        r"""
+        getPrintState method
+
+        Returns the pause/shutdown state of the print: 'Running', 'Pausing', 'Paused' or
+        'Shutdown'
+        """
+        return self._beeCon.getPrintState()
+
+    # *************************************************************************
+    #                            waitForPause Method
+    # *************************************************************************
+    def waitForPause(self, timeout=PAUSE_TIMEOUT):
+        r"""
+        waitForPause method
+
+        Waits until a pause in progress completes. The wait is woken by every status read
+        by any thread and by the telemetry thread snapshots; meanwhile the status is polled,
+        bypassing the query cache, every PAUSE_POLL_MIN seconds, doubling up to PAUSE_POLL_MAX
+
+        arguments:
+            timeout - maximum wait in seconds
+
+        returns:
+            True if the printer is paused or in shutdown, False otherwise
+        """
+        deadline = time.time() + timeout
+        interval = BeeCmd.PAUSE_POLL_MIN
+
+        def onSnapshot(snapshot):
+            self._setStatus(snapshot.status)
+
+        telemetry = self._beeCon.getTelemetry()
+        if telemetry is not None:
+            telemetry.addListener(onSnapshot)
+
+        try:
+            while True:
+                state = self.getPrintState()
+                if state == BeeCmd.PRINT_PAUSING:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        logger.warning('Timeout while waiting for the printer to pause')
+                        return False
+                    state = self._beeCon.waitPrintStateChange(BeeCmd.PRINT_PAUSING, min(interval, remaining))
+                if state != BeeCmd.PRINT_PAUSING:
+                    return state in (BeeCmd.PRINT_PAUSED, BeeCmd.PRINT_SHUTDOWN)
+
+                # A cached status could be older than the pause command
+                self._readStatus()
+                interval = min(interval * 2, BeeCmd.PAUSE_POLL_MAX)
+        finally:
+            if telemetry is not None:
+                telemetry.removeListener(onSnapshot)
 
     # *************************************************************************
     #                            beep Method
@@ -500,8 +609,6 @@ class BeeCmd:
             return None
 
         with self._commandLock:
-            resp = self._beeCon.sendCmd("G91\n")
-
             newX = 0
             newY = 0
             newZ = 0
@@ -524,15 +631,58 @@ class BeeCmd:
                 commandStr = "G1 X" + str(newX) + " Y" + str(newY) \
                              + " Z" + str(newZ) + " E" + str(newE) + "\n"
 
+            # Relative move and back to absolute coordinates in a single write
             if wait is not None:
-                self._beeCon.sendCmd(commandStr)
+                self._beeCon.sendBatch(["G91\n", commandStr, "G90\n"])
             else:
-                self._beeCon.sendCmd(commandStr, "3")
-                
-            self._beeCon.sendCmd("G90\n")
+                self._beeCon.sendBatch(["G91\n", commandStr, "G90\n"], "3")
 
             return
     
+    # *************************************************************************
+    #                            jog Method
+    # *************************************************************************
+    def jog(self, x=None, y=None, z=None, e=None, f=None):
+        r"""
+        jog method
+
+        Adds a relative displacement to the continuous jog channel of the printer and
+        returns immediately. Displacements received while the printer queue is full are
+        merged in a single move
+
+        arguments:
+        x - X axis displacement
+        y - Y axis displacement
+        z - Z axis displacement
+        e - E extruder displacement
+
+        f - feedrate
+
+        """
+        if self.isTransferring():
+            logger.debug('File Transfer Thread active, please wait for transfer thread to end')
+            return None
+
+        self._beeCon.startJog().jog(x, y, z, e, f)
+
+        return
+
+    # *************************************************************************
+    #                            stopJog Method
+    # *************************************************************************
+    def stopJog(self, wait=True):
+        r"""
+        stopJog method
+
+        Stops the continuous jog channel, after sending the pending displacement if wait is True
+        """
+        jog = self._beeCon.getJog()
+        if jog is not None and wait:
+            jog.waitIdle(self._beeCon.READ_TIMEOUT / 1000.0)
+        self._beeCon.stopJog()
+
+        return
+
     # *************************************************************************
     #                     startCalibration Method
     # *************************************************************************
@@ -597,6 +747,7 @@ class BeeCmd:
     # *************************************************************************
     #                     getNozzleTemperature Method
     # *************************************************************************
+    @queryCache.cachedQuery
     def getNozzleTemperature(self):
         r"""
         getNozzleTemperature method
@@ -604,21 +755,21 @@ class BeeCmd:
         reads current nozzle temperature
 
         returns:
-            nozzle temperature
+            nozzle temperature (None if it could not be read during a file transfer)
         """
-        if self.isTransferring():
-            logger.debug('File Transfer Thread active, please wait for transfer thread to end')
-            return None
+        snapshot = self._beeCon.getTelemetrySnapshot()
+        if snapshot is not None and snapshot.nozzleTemperature is not None:
+            return snapshot.nozzleTemperature
 
         with self._commandLock:
-            # get Temperature
-            resp = self._beeCon.sendCmd("M105\n")
+            # get Temperature, between two blocks during G-code transfers
+            resp = self._beeCon.queryBetweenBlocks("M105\n")
+            if resp is None:
+                logger.debug('File Transfer Thread active, please wait for transfer thread to end')
+                return None
 
             try:
-                splits = resp.split(" ")
-                tPos = splits[0].find("T:")
-                t = float(splits[0][tPos+2:])
-                return t
+                return parsers.parseNozzleTemperature(resp)
             except Exception as ex:
                 logger.error("Error getting nozzle temperature: %s", str(ex))
 
@@ -754,17 +905,12 @@ class BeeCmd:
             return None
 
         with self._commandLock:
-            # set feedrate
-            self._beeCon.sendCmd("G1 F15000\n")
-
-            # set acceleration
-            self._beeCon.sendCmd("M206 X400\n")
-
-            # go to first point
-            self._beeCon.sendCmd("G1 X30 Y0 Z10\n")
-
-            # set acceleration
-            self._beeCon.sendCmd("M206 X1000\n", "3")
+            self._beeCon.sendBatch([
+                "G1 F15000\n",         # set feedrate
+                "M206 X400\n",         # set acceleration
+                "G1 X30 Y0 Z10\n",     # go to first point
+                "M206 X1000\n",        # set acceleration
+            ], "3")
 
             return
 
@@ -782,17 +928,12 @@ class BeeCmd:
             return None
 
         with self._commandLock:
-            # set feedrate
-            self._beeCon.sendCmd("G1 F15000\n")
-
-            # set acceleration
-            self._beeCon.sendCmd("M206 X400\n")
-
-            # go to first point
-            self._beeCon.sendCmd("G1 X-50 Y0 Z110\n")
-
-            # set acceleration
-            self._beeCon.sendCmd("M206 X1000\n", "3")
+            self._beeCon.sendBatch([
+                "G1 F15000\n",         # set feedrate
+                "M206 X400\n",         # set acceleration
+                "G1 X-50 Y0 Z110\n",   # go to first point
+                "M206 X1000\n",        # set acceleration
+            ], "3")
 
             return
 
@@ -836,6 +977,7 @@ class BeeCmd:
     # *************************************************************************
     #                            getFilamentString Method
     # *************************************************************************
+    @queryCache.cachedQuery
     def getFilamentString(self):
         r"""
         getFilamentString method
@@ -864,11 +1006,30 @@ class BeeCmd:
     # *************************************************************************
     #                            printFile Method
     # *************************************************************************
-    def printFile(self, filePath, printTemperature=200, sdFileName=None):
+    def printFile(self, filePath, printTemperature=200, sdFileName=None, background=True, resume=False,
+                  delta=False, cache=False, minify=False, streaming=False, streamMargin=None):
         r"""
         printFile method
         
         Transfers a file to the printer and starts printing
+
+        arguments:
+            filePath - local file path
+            printTemperature - print temperature
+            sdFileName - optional SD file name
+            background - if False the transfer runs in the calling thread and the method
+                         only returns when the print is started
+            resume - if True an interrupted transfer of the same file continues from the
+                     last block acknowledged by the printer
+            delta - if True only the blocks that differ from the last content written to
+                    the SD file are sent
+            cache - if True and a file with the same content is already in the SD card
+                    that file is printed without transferring it again
+            minify - if True comments, redundant words and excess precision are removed
+                     from the G-code while it is transferred
+            streaming - if True the print starts once streamMargin bytes are in the SD card
+                        and the nozzle is hot, the rest of the file is uploaded while printing
+            streamMargin - optional bytes uploaded before a streaming print starts
         
         returns True if print starts successfully
         
@@ -896,8 +1057,10 @@ class BeeCmd:
                 self._beeCon.read()
 
                 self._transfThread = transferThread.FileTransferThread(
-                    self._beeCon, filePath, 'print', sdFileName, printTemperature)
-                self._transfThread.start()
+                    self._beeCon, filePath, 'print', sdFileName, printTemperature, resume, delta, cache, minify,
+                    streaming=streaming, streamMargin=streamMargin)
+
+            self._startTransfer(background)
 
         except Exception as ex:
             logger.error("Error starting the print operation: %s", str(ex))
@@ -908,11 +1071,12 @@ class BeeCmd:
     # *************************************************************************
     #                            repeatLastPrint Method
     # *************************************************************************
-    def repeatLastPrint(self,printTemperature=200):
+    def repeatLastPrint(self, printTemperature=200, background=True):
         r"""
         repeatLastPrint method
 
-        Starts printing last print
+        Starts printing last print. If background is False the method waits in the
+        calling thread until the print is started
 
         returns True if print starts successfully
 
@@ -937,7 +1101,8 @@ class BeeCmd:
 
                 self._transfThread = transferThread.FileTransferThread(
                     self._beeCon, None, 'print', None, printTemperature)
-                self._transfThread.start()
+
+            self._startTransfer(background)
 
         except Exception as ex:
             logger.error("Error starting the print operation: %s", str(ex))
@@ -945,6 +1110,116 @@ class BeeCmd:
 
         return True
 
+    # *************************************************************************
+    #                            streamPrint Method
+    # *************************************************************************
+    def streamPrint(self, filePath, printTemperature=200, resume=False, window=None):
+        r"""
+        streamPrint method
+
+        Prints a local file sending its lines over USB, without uploading it to the SD
+        card. The print is paused, resumed and cancelled with pausePrint, resumePrint and
+        cancelPrint
+
+        arguments:
+            filePath - local file path
+            printTemperature - print temperature (None to print without heating)
+            resume - if True a streamed print of the same file that was interrupted
+                     continues from the last line executed by the printer
+            window - optional maximum number of lines sent ahead of the acknowledgements
+
+        returns True if the print starts successfully
+        """
+        if self.isTransferring() or self._beeCon.getStream() is not None:
+            logger.error('Streamed print: a transfer or print is already running')
+            return False
+
+        if os.path.isfile(filePath) is False:
+            logger.error("streamPrint: File does not exist")
+            return False
+
+        if self.getPrinterMode() == 'Bootloader':
+            self.goToFirmware()
+
+        startLine = 0
+        if resume:
+            checkpoint = printerStore.StreamCheckpoint(self._beeCon.getConnectedPrinterSN())
+            startLine = checkpoint.getResumeLine(filePath)
+
+        if window is None:
+            window = streamThread.HostStreamThread.WINDOW
+
+        self._setPrintState(BeeCmd.PRINT_RUNNING)
+        stream = self._beeCon.startStream(filePath, printTemperature, startLine, window)
+
+        return stream is not None
+
+    # *************************************************************************
+    #                            getStreamProgress Method
+    # *************************************************************************
+    def getStreamProgress(self):
+        r"""
+        getStreamProgress method
+
+        Returns a dict with the lines of the file ('Lines'), the lines sent ('Sent Lines')
+        and the lines executed by the printer ('Executed Lines') of the running streamed
+        print, or None
+        """
+        stream = self._beeCon.getStream()
+        if stream is None:
+            return None
+
+        return stream.getProgress()
+
+    # *************************************************************************
+    #                            queuePrint Method
+    # *************************************************************************
+    def queuePrint(self, filePath, printTemperature=200, sdFileName=None):
+        r"""
+        queuePrint method
+
+        Adds a print job to the job queue of the printer. Jobs are printed back to back:
+        the next file is uploaded while the current one prints, the nozzle is heated for
+        it once the current print ends and the next print starts as soon as the printer
+        is Ready and at the print temperature
+
+        arguments:
+            filePath - local file path
+            printTemperature - print temperature
+            sdFileName - optional SD file name, by default the queue alternates two names
+
+        returns:
+            PrintJob object or None if the file does not exist
+        """
+        if os.path.isfile(filePath) is False:
+            logger.error("queuePrint: File does not exist")
+            return None
+
+        return self._beeCon.getJobQueue().addJob(filePath, printTemperature, sdFileName)
+
+    # *************************************************************************
+    #                            getPrintQueue Method
+    # *************************************************************************
+    def getPrintQueue(self):
+        r"""
+        getPrintQueue method
+
+        Returns the list of print jobs not finished, in print order
+        """
+        return self._beeCon.getJobQueue().getJobs()
+
+    # *************************************************************************
+    #                            removeQueuedPrint Method
+    # *************************************************************************
+    def removeQueuedPrint(self, job):
+        r"""
+        removeQueuedPrint method
+
+        Removes a job from the print queue. Returns False if the job is printing, use
+        cancelPrint to stop it
+        """
+        return self._beeCon.getJobQueue().removeJob(job)
+
     # *************************************************************************
     #                            initSD Method
     # *************************************************************************
@@ -1089,6 +1364,35 @@ class BeeCmd:
             logger.debug('File Transfer Thread active, please wait for transfer thread to end')
             return None
 
+        return self._openFile(fileName) is not None
+
+    # *************************************************************************
+    #                        getSDFileSize Method
+    # *************************************************************************
+    def getSDFileSize(self, fileName):
+        r"""
+        getSDFileSize method
+
+        opens file in the sd card root dir and returns its size
+
+        arguments:
+            fileName - file name
+
+        returns:
+            size in bytes or None if the file could not be opened or the printer did not
+            report its size
+        """
+
+        if self.isTransferring():
+            logger.debug('File Transfer Thread active, please wait for transfer thread to end')
+            return None
+
+        return parsers.parseFileSize(self._openFile(fileName))
+
+    def _openFile(self, fileName):
+        r"""
+        Opens an SD file, returns the reply to M23 or None if it was not opened
+        """
         # Init SD
         self.initSD()
 
@@ -1108,9 +1412,9 @@ class BeeCmd:
                 tries -= 1
 
             if tries <= 0:
-                return False
+                return None
 
-            return True
+            return resp
 
     # *************************************************************************
     #                            startSDPrint Method
@@ -1142,15 +1446,23 @@ class BeeCmd:
         """
         logger.debug('Cancelling print...')
 
-        if self.isTransferring() is True:
+        if self._isOwnTransfer():
             self.cancelTransfer()
             time.sleep(2)  # Waits for thread to stop transferring
             with self._commandLock:
                 self._beeCon.sendCmd("G28\n", "3")
             return True
 
-        with self._commandLock:
-            self._beeCon.sendCmd("M112\n", "3",20,True)
+        # Emergency commands do not take the command lock, the state transitions are
+        # guarded by the print state of the connection
+        if self._beeCon.getStream() is not None:
+            # The stream thread stops sending lines and sends M112
+            self._beeCon.stopStream()
+            self._setPrintState(BeeCmd.PRINT_RUNNING)
+            return True
+
+        # The connection writes M112 ahead of the commands waiting for the USB
+        self._beeCon.sendCmd("M112\n", "3",20,True)
 
         self.stopStatusMonitor()
         return True
@@ -1158,6 +1470,7 @@ class BeeCmd:
     # *************************************************************************
     #                        getPrintVariables Method
     # *************************************************************************
+    @queryCache.cachedQuery
     def getPrintVariables(self):
         r"""
         getPrintVariables method
@@ -1167,34 +1480,21 @@ class BeeCmd:
             Elapsed Time
             Number of Lines
             Executed Lines
+
+        During G-code transfers the variables are read between two blocks
         """
 
-        if self.isTransferring():
-            logger.debug('File Transfer Thread active, please wait for transfer thread to end')
-            return None
+        snapshot = self._beeCon.getTelemetrySnapshot()
+        if snapshot is not None and snapshot.printVariables is not None:
+            return dict(snapshot.printVariables)
 
         with self._commandLock:
-            printStatus = {}
-
-            resp = self._beeCon.sendCmd('M32\n')
-
-            split = resp.split(' ')
+            resp = self._beeCon.queryBetweenBlocks('M32\n')
+            if resp is None:
+                logger.debug('File Transfer Thread active, please wait for transfer thread to end')
+                return None
 
-            try:
-                for s in split:
-                    if 'A' in s:
-                        printStatus['Estimated Time'] = int(s[1:])
-                    elif 'B' in s:
-                        printStatus['Elapsed Time'] = int(s[1:])//(60*1000)
-                    elif 'C' in s:
-                        printStatus['Lines'] = int(s[1:])
-                    elif 'D' in s:
-                        printStatus['Executed Lines'] = int(s[1:])
-                        break  # If the D was found there is no need to process the string further
-            except:
-                logger.warning('Error parsing print variables response')
-
-            return printStatus
+            return parsers.parsePrintVariables(resp)
 
     # *************************************************************************
     #                        setBlowerSpeed Method
@@ -1238,16 +1538,37 @@ class BeeCmd:
     # *************************************************************************
     #                            flashFirmware Method
     # *************************************************************************
-    def flashFirmware(self, fileName, firmwareString='BEEVC-BEETHEFIRST-10.0.0.BIN'):
+    def flashFirmware(self, fileName, firmwareString='BEEVC-BEETHEFIRST-10.0.0.BIN', background=True, windowed=False,
+                      skipIfCurrent=False):
         r"""
         flashFirmware method
         
-        Flash new firmware
+        Flash new firmware. If background is False the transfer runs in the calling
+        thread instead of a transfer thread. If windowed is True several chunks are sent
+        ahead of the bootloader echo, which is checked as it arrives. If skipIfCurrent is
+        True nothing is flashed when the last image flashed to this printer has the same
+        content and the printer reports the same firmware string and bootloader version.
+        If only the firmware string was lost (interrupted flash) it is set again
         """
 
+        if not self._startFirmwareFlash(fileName, firmwareString, background, windowed, skipIfCurrent):
+            return
+
+        while self.getTransferCompletionState() is not None:
+            time.sleep(0.5)
+
+        self.setFirmwareString(firmwareString)
+
+        return
+
+    def _startFirmwareFlash(self, fileName, firmwareString, background=True, windowed=False, skipIfCurrent=False):
+        r"""
+        Checks the firmware image and starts its transfer (flashFirmware). Returns True
+        if the transfer was started
+        """
         if self.isTransferring():
             logger.debug('File Transfer Thread active, please wait for transfer thread to end')
-            return None
+            return False
 
         if ('linux' or 'darwin') in platform.system().lower():
             fileName = fileName.translate(None, ''.join("'"))
@@ -1256,29 +1577,95 @@ class BeeCmd:
 
         if os.path.isfile(fileName) is False:
             logger.warning("Flash firmware: File does not exist")
-            return
+            return False
+
+        fileHash = size = bootloaderVersion = None
+        if skipIfCurrent:
+            state, fileHash, size, bootloaderVersion = self._checkFirmware(fileName, firmwareString)
+            if state == 'current':
+                logger.info("Printer already running firmware %s, flash skipped", firmwareString)
+                return False
+            if state == 'string':
+                logger.info("Firmware image already flashed, setting firmware string %s", firmwareString)
+                self.setFirmwareString(firmwareString)
+                return False
 
         logger.info("Flashing new firmware File: %s", fileName)
+        record = self._recordFirmwareFlash(fileName, firmwareString, fileHash, size, bootloaderVersion)
         self.setFirmwareString('0.0.0')  # Clear FW Version
 
-        self._transfThread = transferThread.FileTransferThread(self._beeCon, fileName, 'Firmware', firmwareString)
-        self._transfThread.start()
+        self._transfThread = transferThread.FileTransferThread(self._beeCon, fileName, 'Firmware', firmwareString,
+                                                               windowed=windowed, firmwareRecord=record)
+        self._startTransfer(background)
 
-        while self.getTransferCompletionState() is not None:
-            time.sleep(0.5)
+        return True
+    
+    def _recordFirmwareFlash(self, fileName, firmwareString, fileHash=None, size=None, bootloaderVersion=None):
+        r"""
+        Records the start of a flash (printerStore.FirmwareRecord.start). Returns the
+        record or None if it could not be stored, the image is then flashed anyway
+        """
+        try:
+            if fileHash is None:
+                with open(fileName, 'rb') as f:
+                    fileHash, _, size = printerStore.hashStream(f, 65536)
+            record = printerStore.FirmwareRecord(self._beeCon.getConnectedPrinterSN())
+            if record.start(fileHash, size, firmwareString, bootloaderVersion):
+                return record
+        except Exception as ex:
+            logger.error("Error recording the firmware flash: %s", str(ex))
 
-        self.setFirmwareString(firmwareString)
+        logger.warning("Firmware flash not recorded, continuing with the flash")
+
+        return None
+
+    # *************************************************************************
+    #                            isFirmwareCurrent Method
+    # *************************************************************************
+    def isFirmwareCurrent(self, fileName, firmwareString):
+        r"""
+        isFirmwareCurrent method
+
+        Returns True if the last image flashed to this printer has the same content as
+        fileName and the printer reports firmwareString, so flashing it can be skipped
+        """
+        if os.path.isfile(fileName) is False:
+            logger.warning("isFirmwareCurrent: File does not exist")
+            return False
+
+        return self._checkFirmware(fileName, firmwareString)[0] == 'current'
+
+    def _checkFirmware(self, fileName, firmwareString):
+        r"""
+        Compares the printer with a firmware image (printerStore.FirmwareRecord.check)
+
+        returns:
+            (check result, image hash, image size, bootloader version)
+        """
+        with open(fileName, 'rb') as f:
+            fileHash, _, size = printerStore.hashStream(f, 65536)
+
+        bootloaderVersion = self.getBootloaderVersion()
+        record = printerStore.FirmwareRecord(self._beeCon.getConnectedPrinterSN())
+        state = record.check(fileHash, firmwareString.replace(' ', ''), self.getFirmwareVersion(), bootloaderVersion)
+
+        return state, fileHash, size, bootloaderVersion
 
-        return
-    
     # *************************************************************************
     #                            transferSDFile Method
     # *************************************************************************
-    def transferSDFile(self, fileName, sdFileName=None):
+    def transferSDFile(self, fileName, sdFileName=None, background=True, resume=False, delta=False, cache=False,
+                       minify=False):
         r"""
         transferSDFile method
         
-        Transfers GCode file to printer internal memory
+        Transfers GCode file to printer internal memory. If background is False the
+        transfer runs in the calling thread and the method returns when it ends. If resume
+        is True an interrupted transfer of the same file to the same SD file (even from a
+        previous session) continues from the last block acknowledged by the printer. If
+        delta is True only the blocks that differ from the content the driver last wrote
+        to the SD file are sent. If cache is True nothing is sent when the SD file already
+        has the same content. If minify is True the G-code is minified while it is sent
         """
         if self.isTransferring():
             logger.debug('File Transfer Thread active, please wait for transfer thread to end')
@@ -1290,31 +1677,87 @@ class BeeCmd:
 
         logger.info("Transfer GCode File: %s" % fileName)
 
-        if sdFileName is not None:
-            self._transfThread = transferThread.FileTransferThread(self._beeCon, fileName, 'gcode', sdFileName)
-        else:
-            self._transfThread = transferThread.FileTransferThread(self._beeCon, fileName, 'gcode')
-        self._transfThread.start()
+        self._transfThread = transferThread.FileTransferThread(self._beeCon, fileName, 'gcode', sdFileName,
+                                                               resume=resume, delta=delta, cache=cache,
+                                                               minify=minify)
+        self._startTransfer(background)
 
         return
+
+    # *************************************************************************
+    #                        _startTransfer Method
+    # *************************************************************************
+    def _startTransfer(self, background=True):
+        r"""
+        Starts the current transfer thread or, if background is False, runs the
+        transfer in the calling thread
+        """
+        if background:
+            self._transfThread.start()
+        else:
+            self._transfThread.run()
     
     # *************************************************************************
     #                        getTransferCompletionState Method
     # *************************************************************************
-    def getTransferCompletionState(self):
+    def getTransferCompletionState(self, details=False):
         r"""
         getTransferCompletionState method
         
-        Returns current transfer completion percentage 
+        Returns current transfer completion percentage. If details is True returns a
+        dict with the percentage ('percent'), the speed in bytes/second ('bytesPerSecond')
+        and the estimated seconds to finish ('eta')
         """
 
-        if self._transfThread.isAlive():
-            p = self._transfThread.getTransferCompletionState()
+        if self._transfThread is not None and self._transfThread.isRunning():
+            p = self._transfThread.getTransferCompletionState(details)
             logger.info("Transfer State: %s" % str(p))
             return p
 
         return None
     
+    # *************************************************************************
+    #                        getTransferResumedBytes Method
+    # *************************************************************************
+    def getTransferResumedBytes(self):
+        r"""
+        getTransferResumedBytes method
+
+        Returns the number of bytes the current or last transfer did not have to send
+        because it was resumed
+        """
+        if self._transfThread is not None:
+            return self._transfThread.getResumedBytes()
+
+        return 0
+
+    # *************************************************************************
+    #                        getTransferSkippedBytes Method
+    # *************************************************************************
+    def getTransferSkippedBytes(self):
+        r"""
+        getTransferSkippedBytes method
+
+        Returns the number of bytes the current or last delta or cached transfer did not
+        send because the SD card already had them
+        """
+        if self._transfThread is not None:
+            return self._transfThread.getSkippedBytes()
+
+        return 0
+
+    # *************************************************************************
+    #                        getTransferThread Method
+    # *************************************************************************
+    def getTransferThread(self):
+        r"""
+        getTransferThread method
+
+        Returns the FileTransferThread of the current or last transfer started by this
+        object or None
+        """
+        return self._transfThread
+
     # *************************************************************************
     #                        cancelTransfer Method
     # *************************************************************************
@@ -1324,7 +1767,7 @@ class BeeCmd:
         
         Cancels Current Transfer 
         """
-        if self._transfThread.isAlive():
+        if self._transfThread is not None and self._transfThread.isRunning():
             self._transfThread.cancelFileTransfer()
             return True
         
@@ -1337,11 +1780,21 @@ class BeeCmd:
         r"""
         isTransferring method
         
-        Returns True if a file is being transfer
+        Returns True if a file is being transfer, by this object or another transfer
+        using the connection (job queue uploads, other BeeCmd objects)
+        """
+        if self._beeCon.transferring and threading.current_thread() is not self._beeCon.transferOwner:
+            return True
+
+        return self._isOwnTransfer()
+
+    def _isOwnTransfer(self):
+        r"""
+        Returns True if the transfer thread of this object is transferring a file
         """
         if self._transfThread is not None:
             return self._transfThread.isTransferring()
-        
+
         return False
 
     # *************************************************************************
@@ -1361,6 +1814,7 @@ class BeeCmd:
     # *************************************************************************
     #                            getFirmwareVersion Method
     # *************************************************************************
+    @queryCache.cachedQuery
     def getFirmwareVersion(self):
         r"""
         getFirmwareVersion method
@@ -1373,8 +1827,10 @@ class BeeCmd:
             return None
 
         fw = 'BEEVC-BEETHEFIRST-0.0.0.BIN'
-        if self._beeCon.dummyPlugConnected():
-            return fw
+
+        if not self._inFirmware and not self._inBootloader:
+            # getPrinterMode takes the command lock
+            self.getPrinterMode()
 
         with self._commandLock:
             resp = self._beeCon.sendCmd('M115\n', 'ok')
@@ -1382,9 +1838,6 @@ class BeeCmd:
 
             split = resp.split('ok')
 
-            if not self._inFirmware and not self._inBootloader:
-                self.getPrinterMode()
-
             if len(split) > 0 and self._inBootloader:
                 fw = split[1]
             elif len(split) > 0 and not self._inBootloader:
@@ -1393,6 +1846,28 @@ class BeeCmd:
                 return None
 
         return fw.rstrip()
+
+    # *************************************************************************
+    #                            getBootloaderVersion Method
+    # *************************************************************************
+    def getBootloaderVersion(self):
+        r"""
+        getBootloaderVersion method
+
+        Returns Bootloader Version String or None if the printer is not in bootloader
+        """
+
+        if self.isTransferring():
+            logger.debug('File Transfer Thread active, please wait for transfer thread to end')
+            return None
+
+        with self._commandLock:
+            resp = self._beeCon.sendCmd('M116\n', 'ok')
+
+        if resp is None or 'Bad M-code' in resp:
+            return None
+
+        return resp.split('ok')[0].strip()
     
     # *************************************************************************
     #                            pausePrint Method
@@ -1404,18 +1879,33 @@ class BeeCmd:
         Initiates pause process
         """
 
-        if self.isTransferring():
+        # A print can be paused during other transfers (job queue uploads), M640 is
+        # then sent between two blocks
+        if self._isOwnTransfer():
             logger.debug('File Transfer Thread active, please wait for transfer thread to end')
             return None
 
-        with self._commandLock:
-            self._pausing = True
-            self._beeCon.sendCmd('M640\n', "3",20,True)
+        # Not under the command lock, M640 must not wait for the commands in progress
+        self._setPrintState(BeeCmd.PRINT_PAUSING, [BeeCmd.PRINT_RUNNING])
+
+        stream = self._beeCon.getStream()
+        if stream is not None:
+            # Streamed prints pause when the host stops sending lines
+            if stream.pause(timeout=BeeCmd.PAUSE_TIMEOUT):
+                self._setPrintState(BeeCmd.PRINT_PAUSED, [BeeCmd.PRINT_PAUSING])
+            else:
+                logger.warning('Pause: the streamed print did not pause')
+                self._setPrintState(BeeCmd.PRINT_RUNNING, [BeeCmd.PRINT_PAUSING])
+            return
 
-            self.stopStatusMonitor()
+        # The connection writes M640 ahead of the commands waiting for the USB
+        resp = self._beeCon.sendCmd('M640\n', "3",20,True)
+        status = self._setStatus(parsers.parseStatusReply(resp))
+        if status == 'Ready':
+            logger.info('Pause: the printer is not printing')
+            self._setPrintState(BeeCmd.PRINT_RUNNING, [BeeCmd.PRINT_PAUSING])
 
-            if self._beeCon.dummyPlugConnected():
-                self._paused = True
+        self.stopStatusMonitor()
 
         return
     
@@ -1428,14 +1918,23 @@ class BeeCmd:
         
         Resume print from pause/_shutdown
         """
-        if self.isTransferring():
+        if self._isOwnTransfer():
             logger.debug('File Transfer Thread active, please wait for transfer thread to end')
             return None
 
+        stream = self._beeCon.getStream()
+        if stream is not None:
+            with self._commandLock:
+                if self.getPrintState() == BeeCmd.PRINT_SHUTDOWN:
+                    self._beeCon.sendCmd('M505\n')
+                # The stream heats the nozzle again before sending the next line
+                stream.resume()
+                self._setPrintState(BeeCmd.PRINT_RUNNING)
+            return
+
         with self._commandLock:
             self._beeCon.sendCmd('M643\n')
-            self._pausing = False
-            self._shutdown = False
+            self._setPrintState(BeeCmd.PRINT_RUNNING)
 
         return
     
@@ -1447,27 +1946,27 @@ class BeeCmd:
         enterShutdown method
         
         Pauses print and sets printer in shutdown
+
+        returns:
+            True if the printer entered shutdown, False if it did not pause within
+            PAUSE_TIMEOUT seconds
         """
 
-        if self.isTransferring():
+        if self._isOwnTransfer():
             logger.debug('File Transfer Thread active, please wait for transfer thread to end')
             return None
 
-        if not self._pausing or not self._paused:
+        if self.getPrintState() == BeeCmd.PRINT_RUNNING:
             self.pausePrint()
 
-        if self._pausing and not self._paused:
-            nextPullTime = time.time() + 1
-            while not self._paused:
-                t = time.time()
-                if t > nextPullTime:
-                    s = self.getStatus()
+        if not self.waitForPause():
+            logger.warning('Shutdown: the printer did not pause')
+            return False
 
-        with self._commandLock:
-            self._beeCon.sendCmd('M36\n')
-            self._shutdown = True
+        self._beeCon.sendCmd('M36\n')
+        self._setPrintState(BeeCmd.PRINT_SHUTDOWN, [BeeCmd.PRINT_PAUSED, BeeCmd.PRINT_SHUTDOWN])
 
-        return
+        return True
     
     # *************************************************************************
     #                            clearShutdownFlag Method
@@ -1479,7 +1978,7 @@ class BeeCmd:
         Clears shutdown Flag
         """
 
-        if self.isTransferring():
+        if self._isOwnTransfer():
             logger.debug('File Transfer Thread active, please wait for transfer thread to end')
             return None
 
@@ -1507,6 +2006,30 @@ class BeeCmd:
 
             return self._beeCon.sendCmd(cmd, wait, timeout)
 
+    # *************************************************************************
+    #                            sendBatch Method
+    # *************************************************************************
+    def sendBatch(self, commands, wait=None, timeout=None):
+        r"""
+        sendBatch method
+
+        Sends several commands to the printer packed in as few USB writes as possible
+
+        arguments:
+            commands - list of commands
+            wait - optional status code to wait for after the last command
+            timeout - optional timeout (seconds) of the status wait
+
+        returns:
+            list with the reply to each command
+        """
+        if self.isTransferring():
+            logger.debug('File Transfer Thread active, please wait for transfer thread to end')
+            return None
+
+        with self._commandLock:
+            return self._beeCon.sendBatch(commands, wait, timeout)
+
     # *************************************************************************
     #                            startStatusMonitor Method
     # *************************************************************************
@@ -1568,6 +2091,7 @@ class BeeCmd:
     # *************************************************************************
     #                            getNozzleSize Method
     # *************************************************************************
+    @queryCache.cachedQuery
     def getNozzleSize(self):
         r"""
         getNozzleSize method
@@ -1612,15 +2136,13 @@ class BeeCmd:
     # *************************************************************************
     #                            getFilamentInSpool Method
     # *************************************************************************
+    @queryCache.cachedQuery
     def getFilamentInSpool(self):
         r"""
         getFilamentInSpool method
 
         Returns get Filament In Spool (mm)
         """
-        if self._beeCon.dummyPlugConnected():
-            return 350.0
-
         if self.isTransferring():
             logger.debug('File Transfer Thread active, please wait for transfer thread to end')
             return None
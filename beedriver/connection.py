@@ -1,11 +1,22 @@
 #!/usr/bin/env python
 import threading
 import time
+import contextlib
 
 import usb
 import usb.core
 from beedriver.commands import BeeCmd
 from beedriver import logger
+from beedriver import parsers
+from beedriver import readerThread
+from beedriver import telemetryThread
+from beedriver import jogThread
+from beedriver import streamThread
+from beedriver import jobQueueThread
+from beedriver import asyncCommands
+from beedriver import queryCache
+from beedriver import commandScheduler
+from beedriver import simulator
 
 """
 * Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
@@ -35,25 +46,63 @@ class Conn:
         connectToPrinter(selectedPrinter)                       Establishes Connection to selected printer
         connectToFirstPrinter()                                 Establishes Connection to first printer found
         connectToPrinterWithSN(serialNumber)                    Establishes Connection to printer by serial number
-        write(message,timeout)                                  writes data to the communication buffer
+        write(message,timeout,isData)                           writes data to the communication buffer
         read()                                                  read data from the communication buffer
+        readBytes(n, timeout)                                   read raw bytes from the communication buffer
+        readInto(target, timeout)                               read raw bytes into a preallocated buffer
         dispatch(message)                                       writes data to the buffer and reads the response
+        dispatchPipelined(messages, window)                     writes several commands keeping a window of them in flight
+        sendBatch(commands, wait, timeout)                      writes several commands packed in as few USB writes as possible
+        requestCmd(cmd)                                         writes a command without waiting for its reply
+        waitCmdReply(req, timeout)                              waits for the reply to a command written with requestCmd
+        enablePipelining(window)                                Enables pipelined command dispatch
+        disablePipelining()                                     Disables pipelined command dispatch
         sendCmd(cmd,wait,to)                                    Sends a command to the 3D printer
         waitFor(cmd, s, timeout)                                writes command to the printer and waits for the response
         waitForStatus(cmd, s, timeout)                         writes command to the printer and waits for status the response
+        queryBetweenBlocks(cmd, timeout)                        sends a read only query, between two blocks if a file is being transferred
+        runTransferWindow(limit)                                sends the queued queries, called by the transfer between blocks
         close()                                                 closes active communication with the printer
         isConnected()                                           Returns the current state of the printer connection
         getCommandIntf()                                        Returns the BeeCmd object with the command interface for higher level operations
+        getAsyncIntf(timeout)                                   Returns the non blocking command interface (futures)
+        getExecutor()                                           Returns the single worker executor of the printer
         reconnect()                                             closes and re-establishes the connection with the printer
+        startTelemetry(statusInterval, ...)                     Starts polling the printer telemetry in the background
+        stopTelemetry()                                         Stops the telemetry thread
+        getTelemetry()                                          Returns the telemetry thread or None
+        getTelemetrySnapshot()                                  Returns the latest telemetry snapshot or None
+        setQueryCacheTTL(ttl, query)                            Sets the time to live of the cached query results
+        getQueryCache()                                         Returns the QueryCache of the printer
+        setPriorityScheduling(enabled)                          Enables the priority order of stop/pause/shutdown commands
+        getQueueDepth()                                         Returns the last firmware queue depth reported
+        startJog(feedrate, maxQueued)                           Starts the continuous jog channel
+        stopJog()                                               Stops the jog channel
+        getJog()                                                Returns the jog channel or None
+        startStream(filePath, temperature, startLine, window)   Starts a host streamed print
+        stopStream(keepCheckpoint)                              Cancels the host streamed print
+        getStream()                                             Returns the host streamed print or None
+        getJobQueue()                                           Returns the print job queue, starting it if needed
+        stopJobQueue()                                          Stops the print job queue
+        getPrintState()                                         Returns the pause/shutdown state of the print
+        setPrintState(state, fromStates)                        Moves the pause/shutdown state machine
+        waitPrintStateChange(state, timeout)                    Waits while the print is in state
     """
 
     READ_TIMEOUT = 2000
     DEFAULT_READ_LENGTH = 512
 
+    PIPELINE_WINDOW = 4         # default number of commands kept in flight in pipelined mode
+    MAX_QUEUE_DEPTH = 8         # firmware command queue size used for "ok Q:n" flow control
+    STATUS_POLL_MIN = 0.02      # first status poll interval of waitForStatus (seconds)
+    STATUS_POLL_MAX = 0.5       # the status poll interval doubles up to this value
+    BATCH_WRITE_SIZE = 512      # maximum size of the USB writes of a command batch
+    TRANSFER_WINDOW_QUERIES = 2 # queries sent between two blocks of a file transfer
+
     # *************************************************************************
     #                            __init__ Method
     # *************************************************************************
-    def __init__(self, shutdownCallback=None, dummyPlug=False):
+    def __init__(self, shutdownCallback=None, dummyPlug=False, printerSimulator=None):
         r"""
         __init__ Method
 
@@ -62,6 +111,11 @@ class Conn:
         receives as argument the BeeConnection object and verifies the
         connection status
 
+        arguments:
+            shutdownCallback - optional function called when the connection is lost
+            dummyPlug - if True connects to a simulated printer instead of the USB devices
+            printerSimulator - optional PrinterSimulator used in dummy plug mode
+
         """
 
         self.dev = None
@@ -73,10 +127,12 @@ class Conn:
         self.intf = None
 
         self.transferring = False
+        self.transferWindows = False  # the transfer sends queued queries between blocks
+        self.transferOwner = None     # thread running the transfer in progress
         self.fileSize = 0
         self.bytesTransferred = 0
         self._dummyPlug = dummyPlug
-        self._dummyTemperature = 0.0
+        self._simulator = printerSimulator
 
         self._shutdownCallback = shutdownCallback
 
@@ -95,6 +151,24 @@ class Conn:
         self._connectionMonitor = None
         self._monitorConnection = True
 
+        self._reader = None           # Background USB reader thread
+        self._telemetry = None        # Background telemetry poller
+        self._jog = None              # Continuous jog channel
+        self._stream = None           # Host streamed print
+        self._jobQueue = None         # Print job queue
+        # Pause/shutdown state machine of the print, shared by the BeeCmd objects
+        self._printState = BeeCmd.PRINT_RUNNING
+        self._printStateCond = threading.Condition()
+        self._executor = asyncCommands.IOExecutor(1)  # Single worker executor of the asynchronous interfaces
+        self._windowQueries = []      # queries waiting for the next window between transfer blocks
+        self._windowCond = threading.Condition()
+        self._queryCache = queryCache.QueryCache()    # Results of the read only BeeCmd queries
+        self._scheduler = commandScheduler.CommandScheduler()    # Priority order of the writes
+        self._priorityScheduling = True
+
+        self._pipelineWindow = 0      # 0 disables pipelined dispatch
+        self._queueDepth = 0          # last queue depth reported by the firmware
+
         return
 
     # *************************************************************************
@@ -126,10 +200,14 @@ class Conn:
                 self._dummyPlug = True
 
         if self._dummyPlug is True:
-            # creates a dummy interface
+            # creates a simulated printer interface
+            if self._simulator is None:
+                self._simulator = simulator.PrinterSimulator()
+            epOut, epIn = self._simulator.getEndpoints()
             printer = {'VendorID': '10697', 'ProductID': '1',
-                       'Manufacturer': 'BEEVERYCREATIVE', 'Product':
-                           'BEETHEFIRST PLUS', 'Serial Number': '0000000003', 'Interfaces': []}
+                       'Manufacturer': 'BEEVERYCREATIVE', 'Product': self._simulator.product,
+                       'Serial Number': self._simulator.serialNumber,
+                       'Interfaces': [{'Class': 0, 'EP Out': epOut, 'EP In': epIn}]}
             self.printerList.append(printer)
 
             return self.printerList
@@ -184,24 +262,24 @@ class Conn:
         self.connectedPrinter = selectedPrinter
         logger.info('\n...Connecting to %s with serial number %s', str(selectedPrinter['Product']), str(selectedPrinter['Serial Number']))
 
-        if self._dummyPlug is True:
-            self.connected = True
-            return True
-
         self.ep_out = self.connectedPrinter['Interfaces'][0]['EP Out']
         self.ep_in = self.connectedPrinter['Interfaces'][0]['EP In']
         
         # Verify that the end points exist
         assert self.ep_out is not None
         assert self.ep_in is not None
-        
-        self.dev = self.ep_out.device
-        self.dev.set_configuration()
-        self.dev.reset()
-        time.sleep(0.5)
-        #self.dev.set_configuration()
-        self.cfg = self.dev.get_active_configuration()
-        self.intf = self.cfg[(0, 0)]
+
+        if self._dummyPlug is not True:
+            self.dev = self.ep_out.device
+            self.dev.set_configuration()
+            self.dev.reset()
+            time.sleep(0.5)
+            #self.dev.set_configuration()
+            self.cfg = self.dev.get_active_configuration()
+            self.intf = self.cfg[(0, 0)]
+
+        self._reader = readerThread.ReaderThread(self)
+        self._reader.start()
 
         self.connected = True
         
@@ -274,7 +352,7 @@ class Conn:
     # *************************************************************************
     #                        write Method
     # *************************************************************************
-    def write(self, message, timeout=500):
+    def write(self, message, timeout=500, isData=False):
         r"""
         write method
 
@@ -283,6 +361,7 @@ class Conn:
         arguments:
             message - data to be writen
             timeout - optional communication timeout (default = 500ms)
+            isData - True for raw file data (transfer blocks, firmware), which is not a command
 
         returns:
             byteswriten - bytes writen to the buffer
@@ -290,16 +369,15 @@ class Conn:
         
         bytes_written = 0
 
-        with self._connectionRLock:
-            if self._dummyPlug is True:
-                return len(message)
-            else:
-                try:
-                    bytes_written = self.ep_out.write(message, timeout)
-                except usb.core.USBError as e:
-                    logger.error("USB write data exception: %s", str(e))
-                except Exception as ex:
-                    logger.error("Write error - Connection lost: " + str(ex))
+        with self._writeSlot(message):
+            if not isData:
+                self._commandSent(message)
+            try:
+                bytes_written = self.ep_out.write(message, timeout)
+            except usb.core.USBError as e:
+                logger.error("USB write data exception: %s", str(e))
+            except Exception as ex:
+                logger.error("Write error - Connection lost: " + str(ex))
 
         return bytes_written
 
@@ -310,29 +388,128 @@ class Conn:
         r"""
         read method
 
-        reads existing data from the communication buffer
+        reads existing data from the communication buffer. The data is collected by
+        the connection reader thread, only data not claimed by a pending request is returned
 
         arguments:
-            timeout - optional communication timeout (default = 500ms)
+            timeout - optional communication timeout (default = 2000ms)
 
         returns:
             sret - string with data read from the buffer
         """
 
-        resp = ""
+        if self._reader is None:
+            return ""
 
-        with self._connectionRLock:
-            if self._dummyPlug is True:
-                return "ok Q:0"
+        return self._reader.readAvailable(timeout / 1000.0)
 
-            try:
-                self.write("")
-                ret = self.ep_in.read(readLen, timeout)
-                resp = ''.join([chr(x) for x in ret])
-            except usb.core.USBError as e:
-                logger.error("USB read data exception: %s", str(e))
-            except Exception as ex:
-                logger.error("Read error - Connection lost: " + str(ex))
+    # *************************************************************************
+    #                        readBytes Method
+    # *************************************************************************
+    def readBytes(self, n, timeout=1000):
+        r"""
+        readBytes method
+
+        reads raw bytes from the communication buffer
+
+        arguments:
+            n - number of bytes to read
+            timeout - optional communication timeout (default = 1000ms)
+
+        returns:
+            bytearray with the data read (shorter than n if the timeout expires)
+        """
+
+        if self._reader is None:
+            return bytearray()
+
+        return self._reader.readBytes(n, timeout / 1000.0)
+
+    # *************************************************************************
+    #                        readInto Method
+    # *************************************************************************
+    def readInto(self, target, timeout=1000):
+        r"""
+        readInto method
+
+        reads raw bytes from the communication buffer directly into a preallocated
+        writable buffer (bytearray or memoryview)
+
+        arguments:
+            target - writable buffer, filled up to its length
+            timeout - optional communication timeout (default = 1000ms)
+
+        returns:
+            number of bytes stored in target (less than len(target) if the timeout expires)
+        """
+
+        if self._reader is None:
+            return 0
+
+        return self._reader.readInto(target, timeout / 1000.0)
+
+    def _commandSent(self, message):
+        # The cached query results and the telemetry snapshot may be outdated by message
+        self._queryCache.commandSent(message)
+        telemetry = self._telemetry
+        if telemetry is not None:
+            telemetry.commandSent(message)
+
+    # *************************************************************************
+    #                        _request Method
+    # *************************************************************************
+    def _request(self, message, tokens=None, isData=False):
+        r"""
+        Registers a reply request and writes the message. Must be called with the
+        connection lock acquired so that the requests keep the write order. Raw file
+        data (isData) is not reported as a command
+        """
+        if not isData:
+            self._commandSent(message)
+        req = self._reader.register(tokens)
+        try:
+            self.ep_out.write(message)
+        except usb.core.USBError as e:
+            logger.error("USB dispatch (write) data exception: %s", str(e))
+        except Exception as ex:
+            logger.error("Dispatch write error - Connection lost: " + str(ex))
+
+        return req
+
+    # *************************************************************************
+    #                        _writeSlot Method
+    # *************************************************************************
+    @contextlib.contextmanager
+    def _writeSlot(self, message):
+        r"""
+        Holds the write slot of the command scheduler, in the priority class of message,
+        and the connection lock. Stop, pause and shutdown commands are written before
+        any other waiting command. During file transfers the ones of other threads are
+        sent between two blocks (_sendBetweenBlocks) so they are not taken as file data
+        """
+        priority = commandScheduler.NORMAL
+        if self._priorityScheduling:
+            priority = commandScheduler.priorityOf(message)
+
+        with self._scheduler.slot(priority):
+            with self._connectionLock:
+                yield
+
+    # *************************************************************************
+    #                        _waitReply Method
+    # *************************************************************************
+    def _waitReply(self, req, timeout):
+        r"""
+        Waits for the reply to a request. Returns None if the timeout (seconds) expires
+        """
+        resp = self._reader.waitReply(req, timeout)
+        if resp is None:
+            self._reader.cancel(req)
+            return None
+
+        depth = parsers.parseQueueDepth(resp)
+        if depth is not None:
+            self._queueDepth = depth
 
         return resp
 
@@ -351,34 +528,237 @@ class Conn:
         returns:
             sret - string with data read from the buffer
         """
+        if self._betweenBlocks():
+            return self._sendBetweenBlocks(message)
+        if self._pipelineWindow > 0:
+            return self.dispatchPipelined([message])[0]
+
         timeout = Conn.READ_TIMEOUT
         resp = "No response"
 
-        with self._connectionLock:
-            if self._dummyPlug is True:
-                return "ok Q:0"
+        with self._writeSlot(message):
+            time.sleep(0.009)
+            req = self._request(message)
 
-            try:
-                time.sleep(0.009)
-                self.ep_out.write(message)
-                time.sleep(0.009)
+        reply = self._waitReply(req, timeout / 1000.0)
+        if reply is None:
+            logger.error("USB dispatch (read) timeout")
+            return resp
 
-            except usb.core.USBError as e:
-                logger.error("USB dispatch (write) data exception: %s", str(e))
-            except Exception as ex:
-                logger.error("Dispatch write error - Connection lost: " + str(ex))
+        return reply
 
-            try:
-                ret = self.ep_in.read(Conn.DEFAULT_READ_LENGTH, timeout)
-                resp = ''.join([chr(x) for x in ret])
+    # *************************************************************************
+    #                        dispatchPipelined Method
+    # *************************************************************************
+    def dispatchPipelined(self, messages, window=None):
+        r"""
+        dispatchPipelined method
 
-            except usb.core.USBError as e:
-                logger.error("USB dispatch (read) data exception: %s", str(e))
-            except Exception as ex:
-                logger.error("Dispatch read error - Connection lost: " + str(ex))
+        writes several commands to the printer keeping up to window commands in flight.
+        Replies are matched to the commands by order and the queue depth reported
+        by the firmware ("ok Q:n") is used to throttle the number of commands in flight.
+        Commands from concurrent callers share the same window
+
+        arguments:
+            messages - list of commands to be writen
+            window - optional maximum number of commands in flight (default = pipelining window)
+
+        returns:
+            replies - list with the reply to each command, in the same order
+        """
+        if window is None:
+            window = self._pipelineWindow if self._pipelineWindow > 0 else Conn.PIPELINE_WINDOW
+
+        messages = [m if m.endswith('\n') else m + '\n' for m in messages]
+        if self._betweenBlocks():
+            return [self._sendBetweenBlocks(m) or "No response" for m in messages]
+
+        timeout = Conn.READ_TIMEOUT / 1000.0
+        requests = []
+        replies = []
+
+        for m in messages:
+            # Wait for a free slot, collecting our own replies meanwhile. Emergency
+            # commands do not wait for the window
+            while commandScheduler.priorityOf(m) != commandScheduler.EMERGENCY and \
+                    not self._reader.waitPendingBelow(self._pipelineLimit(window), 0.01):
+                if len(replies) < len(requests):
+                    replies.append(self._waitReplyOrDefault(requests[len(replies)], timeout))
+
+            with self._writeSlot(m):
+                requests.append(self._request(m))
+
+        while len(replies) < len(requests):
+            replies.append(self._waitReplyOrDefault(requests[len(replies)], timeout))
+
+        return replies
+
+    # *************************************************************************
+    #                        sendBatch Method
+    # *************************************************************************
+    def sendBatch(self, commands, wait=None, timeout=None, possibleDisconnection=False):
+        r"""
+        sendBatch method
+
+        writes several commands packing them in as few USB writes of up to
+        BATCH_WRITE_SIZE bytes as possible. Each write holds at most MAX_QUEUE_DEPTH
+        commands and its replies are collected before the next write
+
+        arguments:
+            commands - list of commands to send
+            wait - optional status code to wait for after the last command
+            timeout - optional timeout (seconds) of the status wait
+
+        returns:
+            replies - list with the reply to each command, in the same order. When wait
+                      is given the status replies are appended to the last reply
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        lines = [c if c.endswith('\n') else c + '\n' for c in commands]
+        if self._betweenBlocks():
+            replies = [self._sendBetweenBlocks(c) or "No response" for c in lines[:-1]]
+            if len(lines) > 0:
+                replies.append(self._sendBetweenBlocks(lines[-1], wait, timeout) or "No response")
+            return replies
+
+        replies = []
+
+        start = 0
+        while start < len(lines):
+            # Pack the next commands in one write
+            end = start + 1
+            size = len(lines[start])
+            while end < len(lines) and end - start < Conn.MAX_QUEUE_DEPTH and \
+                    size + len(lines[end]) <= Conn.BATCH_WRITE_SIZE:
+                size += len(lines[end])
+                end += 1
+
+            message = ''.join(lines[start:end])
+            with self._writeSlot(message):
+                requests = self._requestBatch(lines[start:end])
+
+            for req in requests:
+                replies.append(self._waitReplyOrDefault(req, Conn.READ_TIMEOUT / 1000.0))
+            start = end
+
+        if wait is not None and len(replies) > 0:
+            resp = replies[-1]
+            if "S:" + str(wait) not in resp:
+                resp = self._pollStatus(resp, wait, deadline, possibleDisconnection)
+            replies[-1] = resp
+
+        return replies
+
+    # *************************************************************************
+    #                        _requestBatch Method
+    # *************************************************************************
+    def _requestBatch(self, lines):
+        r"""
+        Registers a reply request for each command line and writes all of them in a
+        single USB write. Must be called with the connection lock acquired
+        """
+        requests = []
+        for line in lines:
+            self._commandSent(line)
+            requests.append(self._reader.register())
+        try:
+            self.ep_out.write(''.join(lines))
+        except usb.core.USBError as e:
+            logger.error("USB batch (write) data exception: %s", str(e))
+        except Exception as ex:
+            logger.error("Batch write error - Connection lost: " + str(ex))
+
+        return requests
+
+    # *************************************************************************
+    #                        requestCmd Method
+    # *************************************************************************
+    def requestCmd(self, cmd):
+        r"""
+        requestCmd method
+
+        writes a command without waiting for its reply. The caller keeps track of the
+        commands in flight and collects the replies, in order, with waitCmdReply
+
+        returns:
+            ReplyRequest object
+        """
+        if not cmd.endswith('\n'):
+            cmd += '\n'
+
+        with self._writeSlot(cmd):
+            return self._request(cmd)
+
+    # *************************************************************************
+    #                        waitCmdReply Method
+    # *************************************************************************
+    def waitCmdReply(self, req, timeout=None):
+        r"""
+        Waits for the reply to a command written with requestCmd, returning "No response"
+        if timeout seconds (default READ_TIMEOUT) expire
+        """
+        if timeout is None:
+            timeout = Conn.READ_TIMEOUT / 1000.0
+
+        return self._waitReplyOrDefault(req, timeout)
+
+    # *************************************************************************
+    #                        _waitReplyOrDefault Method
+    # *************************************************************************
+    def _waitReplyOrDefault(self, req, timeout):
+        r"""
+        Waits for the reply to a request returning "No response" on timeout
+        """
+        resp = self._waitReply(req, timeout)
+        if resp is None:
+            logger.error("USB pipelined dispatch (read) timeout")
+            return "No response"
 
         return resp
 
+    # *************************************************************************
+    #                        _pipelineLimit Method
+    # *************************************************************************
+    def _pipelineLimit(self, window):
+        r"""
+        Returns the number of commands that can be in flight given the last queue
+        depth reported by the firmware. At least one command is always allowed.
+        """
+        free = Conn.MAX_QUEUE_DEPTH - self._queueDepth
+
+        return max(1, min(window, free))
+
+    # *************************************************************************
+    #                        enablePipelining Method
+    # *************************************************************************
+    def enablePipelining(self, window=PIPELINE_WINDOW):
+        r"""
+        enablePipelining method
+
+        Enables pipelined dispatch. Commands sent with dispatch/sendCmd no longer
+        pay the fixed write/read delays and are flow controlled by the firmware queue depth
+
+        arguments:
+            window - maximum number of commands in flight (default = 4)
+        """
+        self._pipelineWindow = max(1, int(window))
+
+        return
+
+    # *************************************************************************
+    #                        disablePipelining Method
+    # *************************************************************************
+    def disablePipelining(self):
+        r"""
+        disablePipelining method
+
+        Restores the default one command at a time dispatch
+        """
+        self._pipelineWindow = 0
+
+        return
+
     # *************************************************************************
     #                        sendCmd Method
     # *************************************************************************
@@ -399,17 +779,6 @@ class Conn:
         if '\n' not in cmd:
             cmd += "\n"
 
-        if self._dummyPlug is True:
-            if cmd == 'M625\n':
-                return "S:3"
-            if cmd == 'M105\n':
-                if self._dummyTemperature == 240.0:
-                    self._dummyTemperature = 0.0
-                self._dummyTemperature += 10.0
-                return "T:" + str(self._dummyTemperature) + " ok Q:0"
-
-            return "ok Q:0"
-
         if wait is None:
             resp = self.dispatch(cmd)
         else:
@@ -423,7 +792,7 @@ class Conn:
     # *************************************************************************
     #                        waitFor Method
     # *************************************************************************
-    def waitFor(self, cmd, s, timeout=None, possibleDisconnection=False):
+    def waitFor(self, cmd, s, timeout=None, possibleDisconnection=False, isData=False):
         r"""
         waitFor method
 
@@ -433,29 +802,23 @@ class Conn:
             cmd - command to send
             s - string to be found in the response
             timeout - optional communication timeout (seconds)
+            isData - True for raw file data (transfer blocks), which is not a command
 
         returns:
             resp - string with data read from the buffer
         """
-        c_time = time.time()
-        resp = ""
+        if self._betweenBlocks():
+            return self._sendBetweenBlocks(cmd, timeout=timeout)
 
-        with self._connectionLock:
-            if self._dummyPlug is True:
-                return s
+        with self._writeSlot(cmd):
+            req = self._request(cmd, [s], isData)
 
-            self.write(cmd)
-
-            while s not in resp:
-                resp += self.read()
-
-                # Checks timeout
-                if timeout is not None:
-                    e_time = time.time()
-                    if e_time-c_time > timeout:
-                        if possibleDisconnection:
-                            return
-                        break
+        resp = self._reader.waitReply(req, timeout)
+        if resp is None:
+            partial = self._reader.cancel(req)
+            if possibleDisconnection:
+                return
+            return partial
 
         return resp
 
@@ -466,49 +829,219 @@ class Conn:
         r"""
         waitForStatus method
 
-        writes command to the printer and waits for status the response
+        writes command to the printer and waits for status the response (see _pollStatus)
 
         arguments:
             cmd - commmand to send
-            s - string to be found in the response
-            timeout - optional communication timeout (seconds)
+            s - status code to be found in the response
+            timeout - optional timeout (seconds) of the whole wait
 
         returns:
             resp - string with data read from the buffer
         """
-        c_time = time.time()
-        resp = ""
 
-        with self._connectionLock:
-            if self._dummyPlug is True:
-                return "ok Q:0 S:" + str(s)
+        if self._betweenBlocks():
+            return self._sendBetweenBlocks(cmd, s, timeout)
 
-            self.write(cmd)
+        deadline = None if timeout is None else time.time() + timeout
 
-            str2find = "S:" + str(s)
+        with self._writeSlot(cmd):
+            req = self._request(cmd)
 
-            while "ok" not in resp:
+        resp = self._waitReply(req, timeout)
+        if resp is None:
+            if possibleDisconnection:
+                return
+            resp = ""
 
-                resp += self.read()
+        return self._pollStatus(resp, s, deadline, possibleDisconnection)
+
+    # *************************************************************************
+    #                        _pollStatus Method
+    # *************************************************************************
+    def _pollStatus(self, resp, s, deadline, possibleDisconnection):
+        r"""
+        Polls the printer status until it is s, appending the replies to resp. The status
+        is polled with M625, first every STATUS_POLL_MIN seconds and doubling up to
+        STATUS_POLL_MAX, and any status line received meanwhile (unsolicited output or
+        the telemetry thread polls) ends the wait early
+
+        arguments:
+            resp - reply received so far
+            s - status code to wait for
+            deadline - time at which the wait is abandoned or None
+            possibleDisconnection - return None instead of resp on timeout
+        """
+        str2find = "S:" + str(s)
+        if str2find in resp:
+            return resp
+
+        # Status lines received from now on were sent after the command
+        sequence, status = self._reader.getStatusSequence()
+        interval = Conn.STATUS_POLL_MIN
+
+        while True:
+            # Until the next poll any status line received (unsolicited output or a
+            # telemetry poll) can end the wait
+            pollTime = time.time() + interval
+            if deadline is not None:
+                pollTime = min(pollTime, deadline)
+            while time.time() < pollTime:
+                last = sequence
+                sequence, status = self._reader.waitStatus(sequence, pollTime - time.time())
+                if sequence == last:
+                    break
+                if status == str(s):
+                    return resp + str2find + "\n"
+
+            if deadline is not None and time.time() >= deadline:
+                logger.warning("Timeout while waiting for %s response", str2find)
+                if possibleDisconnection:
+                    return
+                return resp
+
+            try:
+                with self._writeSlot("M625\n"):
+                    req = self._request("M625\n")
+                reply = self._waitReply(req, Conn.READ_TIMEOUT / 1000.0)
+                if reply is not None:
+                    resp += reply
+                    if str2find in reply:
+                        return resp
+                sequence, status = self._reader.getStatusSequence()
+            except Exception as ex:
+                logger.error("Exception while waiting for %s response: %s", str2find, str(ex))
+
+            interval = min(interval * 2, Conn.STATUS_POLL_MAX)
+
+    # *************************************************************************
+    #                        queryBetweenBlocks Method
+    # *************************************************************************
+    def queryBetweenBlocks(self, cmd, timeout=None, urgent=False):
+        r"""
+        queryBetweenBlocks method
 
-                # Checks timeout
-                if timeout is not None:
-                    e_time = time.time()
-                    if e_time-c_time > timeout:
-                        if possibleDisconnection:
-                            return
+        sends a command, usually a read only query (M105, M625, M32...). While a G-code
+        transfer uses the connection the command is queued and the transfer sends it
+        between two blocks, where the printer accepts commands. Callers of the same queued
+        read only query share its reply. Firmware transfers have no windows, commands wait
+        for their end
+
+        arguments:
+            cmd - query to send
+            timeout - optional time to wait for a window (seconds, default = read timeout)
+            urgent - if True the command is sent ahead of the queued queries
+
+        returns:
+            resp - string with the reply or None if no window was available in time
+        """
+        if '\n' not in cmd:
+            cmd += "\n"
+
+        if not self.transferring or threading.current_thread() is self.transferOwner:
+            # The transfer itself is between two blocks
+            return self.sendCmd(cmd)
+        if timeout is None:
+            timeout = Conn.READ_TIMEOUT / 1000.0
+        deadline = time.time() + timeout
+
+        with self._windowCond:
+            query = None
+            if commandScheduler.priorityOf(cmd) == commandScheduler.TELEMETRY:
+                for q in self._windowQueries:
+                    if q['cmd'] == cmd:
+                        query = q
                         break
+            if query is None:
+                query = {'cmd': cmd, 'reply': None, 'done': False, 'urgent': urgent}
+                if urgent:
+                    # After the other urgent commands
+                    self._windowQueries.insert(len([q for q in self._windowQueries if q['urgent']]), query)
+                else:
+                    self._windowQueries.append(query)
+
+            while not query['done']:
+                if not self.transferring:
+                    # The transfer ended, the query is sent now
+                    if query in self._windowQueries:
+                        self._windowQueries.remove(query)
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    if query in self._windowQueries:
+                        self._windowQueries.remove(query)
+                    return None
+                self._windowCond.wait(min(remaining, 0.1))
+
+        if not query['done']:
+            return self.sendCmd(cmd)
+
+        return query['reply']
+
+    def _betweenBlocks(self):
+        r"""
+        Returns True if the commands of the current thread must wait for a window between
+        two blocks of the transfer in progress: a transfer runs in another thread
+        """
+        return self.transferring and threading.current_thread() is not self.transferOwner
 
-            while str2find not in resp:
-                try:
-                    self.write("M625\n")
-                    time.sleep(0.5)
-                    resp += self.read()
-                except Exception as ex:
-                    logger.error("Exception while waiting for %s response: %s", str2find, str(ex))
+    # *************************************************************************
+    #                        _sendBetweenBlocks Method
+    # *************************************************************************
+    def _sendBetweenBlocks(self, cmd, wait=None, timeout=None):
+        r"""
+        Sends cmd in the next window between two blocks of the transfer in progress,
+        emergency commands ahead of the queued queries. If wait is a status code the status is then polled
+        in the following windows until it is reached or timeout seconds expire
+
+        returns:
+            resp - string with the replies or None if no window was available
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        urgent = commandScheduler.priorityOf(cmd) == commandScheduler.EMERGENCY
+        resp = self.queryBetweenBlocks(cmd, timeout, urgent)
+        if resp is None:
+            logger.error("%s not sent, no window in the transfer in progress", cmd.strip())
+            return None
+
+        while wait is not None and "S:" + str(wait) not in resp and self.isConnected() and \
+                (deadline is None or time.time() < deadline):
+            status = self.queryBetweenBlocks("M625\n", urgent=True)
+            if status is not None:
+                resp += status
+            time.sleep(Conn.STATUS_POLL_MIN)
 
         return resp
 
+    # *************************************************************************
+    #                        runTransferWindow Method
+    # *************************************************************************
+    def runTransferWindow(self, limit=TRANSFER_WINDOW_QUERIES):
+        r"""
+        runTransferWindow method
+
+        sends up to limit queued queries. Called by the file transfer between two
+        blocks, which bounds the cost of the queries to the transfer throughput
+
+        returns:
+            number of queries sent
+        """
+        with self._windowCond:
+            queries = self._windowQueries[:limit]
+            del self._windowQueries[:limit]
+
+        for query in queries:
+            try:
+                query['reply'] = self.dispatch(query['cmd'])
+            except Exception as ex:
+                logger.error("Error sending %s between transfer blocks: %s", query['cmd'].strip(), str(ex))
+            with self._windowCond:
+                query['done'] = True
+                self._windowCond.notify_all()
+
+        return len(queries)
+
     # *************************************************************************
     #                        close Method
     # *************************************************************************
@@ -516,11 +1049,30 @@ class Conn:
         r"""
         Closes active connection with printer
         """
+        # The print can not go on without the host, it is resumed from its checkpoint
+        self.stopStream(keepCheckpoint=True)
+        jobQueue = self._detachJobQueue()
+        if jobQueue is not None:
+            jobQueue.failJobs('the connection was closed')
+        self.stopJog()
+        self.stopTelemetry()
+
+        # The executor is kept for the next connection, only the queued operations are dropped
+        self._executor.cancelPending(self)
+        self._queryCache.invalidate()
+
         if self.ep_out is not None:
             with self._connectionLock:
                 try:
+                    if self._reader is not None:
+                        self._reader.stop()
+                        self._reader.join(1)
+                        self._reader = None
+
                     # release the device
-                    usb.util.dispose_resources(self.dev)
+                    if self.dev is not None:
+                        usb.util.dispose_resources(self.dev)
+                        self.dev = None
                     self.ep_out = None
                     self.ep_in = None
                     self.intf = None
@@ -569,6 +1121,36 @@ class Conn:
 
         return self.command_intf
 
+    # *************************************************************************
+    #                        getAsyncIntf Method
+    # *************************************************************************
+    def getAsyncIntf(self, timeout=None):
+        r"""
+        getAsyncIntf method
+
+        returns the AsyncBeeCmd object with the non blocking command interface. Every
+        BeeCmd method returns a future and runs on the executor of the printer
+
+        arguments:
+            timeout - optional seconds an operation may wait to start before it is cancelled
+
+        returns:
+            AsyncBeeCmd if connected
+            None if disconnected
+        """
+        return asyncCommands.AsyncConn(self, timeout=timeout).getCommandIntf()
+
+    # *************************************************************************
+    #                        getExecutor Method
+    # *************************************************************************
+    def getExecutor(self):
+        r"""
+        Returns the IOExecutor with a single worker thread that runs the asynchronous
+        operations of this printer, in submission order. The same executor is used by
+        all the asynchronous interfaces of this object, across reconnections
+        """
+        return self._executor
+
     # *************************************************************************
     #                        reconnect Method
     # *************************************************************************
@@ -584,10 +1166,31 @@ class Conn:
         """
         
         SN = str(self.connectedPrinter['Serial Number'])
+        telemetry = self.getTelemetry()
+        jog = self.getJog()
+        # Detached so close does not fail its jobs, they are restored once connected
+        jobQueue = self._detachJobQueue()
         self.close()
-        time.sleep(3)
+        if self._dummyPlug is not True:
+            time.sleep(3)
         self.getPrinterList()
         self.connectToPrinterWithSN(SN)
+
+        if telemetry is not None and self.connected:
+            self.startTelemetry(**telemetry.getIntervals())
+
+        if jog is not None and self.connected:
+            pending = jog.getPending()
+            jog = self.startJog(**jog.getSettings())
+            if any(pending.values()):
+                # Displacements that were not sent before the connection was closed
+                jog.jog(*[pending[axis] for axis in jogThread.AXES])
+
+        if jobQueue is not None:
+            if self.connected:
+                self.getJobQueue().restoreJobs(jobQueue)
+            else:
+                jobQueue.failJobs('the printer did not reconnect')
         
         return self.connected
 
@@ -606,20 +1209,357 @@ class Conn:
         """
         timeout = Conn.READ_TIMEOUT
         with self._connectionLock:
+            if self._reader is None:
+                return False
+
+            req = self._reader.register()
             try:
                 time.sleep(0.009)
                 self.ep_out.write('M625\n')
-                time.sleep(0.009)
             except:
+                self._reader.cancel(req)
                 return False
 
-            try:
-                # reads the response to clear the buffer
-                self.ep_in.read(Conn.DEFAULT_READ_LENGTH, timeout)
-            except:
-                return False
+        # reads the response to clear the buffer
+        if self._waitReply(req, timeout / 1000.0) is None:
+            return False
 
-            return True
+        return True
+
+    # *************************************************************************
+    #                        startTelemetry Method
+    # *************************************************************************
+    def startTelemetry(self, statusInterval=1, temperatureInterval=1, printInterval=5, logInterval=None):
+        r"""
+        startTelemetry method
+
+        Starts the telemetry thread of the printer. While it runs the BeeCmd status and
+        temperature queries read its snapshot instead of sending commands. If the thread
+        is already running only the intervals are changed
+
+        arguments:
+            statusInterval - seconds between status polls (M625)
+            temperatureInterval - seconds between temperature polls (M105)
+            printInterval - seconds between print variables polls (M32)
+            logInterval - seconds between status log polls (M1029), None disables them
+
+        returns:
+            TelemetryThread object
+        """
+        if self._telemetry is not None and self._telemetry.isAlive():
+            self._telemetry.setInterval('status', statusInterval)
+            self._telemetry.setInterval('temperature', temperatureInterval)
+            self._telemetry.setInterval('printVariables', printInterval)
+            self._telemetry.setInterval('log', logInterval)
+            return self._telemetry
+
+        self._telemetry = telemetryThread.TelemetryThread(self, statusInterval, temperatureInterval,
+                                                          printInterval, logInterval)
+        self._telemetry.start()
+
+        return self._telemetry
+
+    # *************************************************************************
+    #                        stopTelemetry Method
+    # *************************************************************************
+    def stopTelemetry(self):
+        r"""
+        Stops the telemetry thread if it is running
+        """
+        telemetry = self._telemetry
+        self._telemetry = None
+        if telemetry is not None:
+            telemetry.stop()
+            if telemetry is not threading.current_thread():
+                telemetry.join(Conn.READ_TIMEOUT / 1000.0)
+
+        return
+
+    # *************************************************************************
+    #                        getTelemetry Method
+    # *************************************************************************
+    def getTelemetry(self):
+        r"""
+        Returns the running TelemetryThread or None
+        """
+        telemetry = self._telemetry
+        if telemetry is not None and telemetry.isAlive():
+            return telemetry
+
+        return None
+
+    # *************************************************************************
+    #                        getTelemetrySnapshot Method
+    # *************************************************************************
+    def getTelemetrySnapshot(self):
+        r"""
+        Returns the latest TelemetrySnapshot, or None if the telemetry thread is not
+        running, did not complete its first poll or is suspended by a firmware transfer
+        """
+        telemetry = self.getTelemetry()
+        if telemetry is None or (self.transferring and not self.transferWindows):
+            return None
+
+        return telemetry.getSnapshot(Conn.READ_TIMEOUT / 1000.0)
+
+    # *************************************************************************
+    #                        getQueueDepth Method
+    # *************************************************************************
+    def getQueueDepth(self):
+        r"""
+        Returns the number of commands in the firmware queue in the last "ok Q:n" reply
+        """
+        return self._queueDepth
+
+    # *************************************************************************
+    #                        startJog Method
+    # *************************************************************************
+    def startJog(self, feedrate=None, maxQueued=jogThread.JogThread.MAX_QUEUED):
+        r"""
+        startJog method
+
+        Starts the continuous jog channel of the printer. If it is already running only
+        the feedrate is changed
+
+        arguments:
+            feedrate - optional feedrate of the jog moves
+            maxQueued - firmware queue depth above which the jog displacements are merged
+
+        returns:
+            JogThread object
+        """
+        jog = self.getJog()
+        if jog is not None:
+            if feedrate is not None:
+                jog.jog(f=feedrate)
+            return jog
+
+        self._jog = jogThread.JogThread(self, feedrate, maxQueued)
+        self._jog.start()
+
+        return self._jog
+
+    # *************************************************************************
+    #                        stopJog Method
+    # *************************************************************************
+    def stopJog(self):
+        r"""
+        Stops the jog channel if it is running
+        """
+        jog = self._jog
+        self._jog = None
+        if jog is not None:
+            jog.stop()
+            if jog is not threading.current_thread():
+                jog.join(Conn.READ_TIMEOUT / 1000.0)
+
+        return
+
+    # *************************************************************************
+    #                        getJog Method
+    # *************************************************************************
+    def getJog(self):
+        r"""
+        Returns the running JogThread or None
+        """
+        jog = self._jog
+        if jog is not None and jog.isAlive():
+            return jog
+
+        return None
+
+    # *************************************************************************
+    #                        startStream Method
+    # *************************************************************************
+    def startStream(self, filePath, temperature=None, startLine=0, window=streamThread.HostStreamThread.WINDOW):
+        r"""
+        startStream method
+
+        Starts printing a local G-code file by streaming its lines to the printer
+
+        arguments:
+            filePath - local G-code file
+            temperature - optional nozzle temperature reached before printing
+            startLine - number of lines of the file skipped
+            window - maximum number of lines waiting for their acknowledgement
+
+        returns:
+            HostStreamThread object or None if a streamed print is already running
+        """
+        with self._connectionRLock:
+            if self.getStream() is not None:
+                return None
+
+            self._stream = streamThread.HostStreamThread(self, filePath, temperature, startLine, window)
+            self._stream.start()
+
+            return self._stream
+
+    # *************************************************************************
+    #                        stopStream Method
+    # *************************************************************************
+    def stopStream(self, keepCheckpoint=False):
+        r"""
+        Cancels the host streamed print if it is running
+
+        arguments:
+            keepCheckpoint - if True the print can be resumed from its checkpoint
+        """
+        stream = self.getStream()
+        if stream is not None:
+            stream.cancel(keepCheckpoint)
+            if stream is not threading.current_thread():
+                stream.join(Conn.READ_TIMEOUT / 1000.0)
+
+        return
+
+    # *************************************************************************
+    #                        getStream Method
+    # *************************************************************************
+    def getStream(self):
+        r"""
+        Returns the running HostStreamThread or None
+        """
+        stream = self._stream
+        if stream is not None and stream.isAlive():
+            return stream
+
+        return None
+
+    # *************************************************************************
+    #                        getJobQueue Method
+    # *************************************************************************
+    def getJobQueue(self):
+        r"""
+        getJobQueue method
+
+        Returns the print job queue of the printer, the queue thread is started on the
+        first call
+
+        returns:
+            JobQueueThread object
+        """
+        with self._connectionRLock:
+            if self._jobQueue is None or not self._jobQueue.isAlive():
+                self._jobQueue = jobQueueThread.JobQueueThread(self)
+                self._jobQueue.start()
+
+            return self._jobQueue
+
+    # *************************************************************************
+    #                        stopJobQueue Method
+    # *************************************************************************
+    def stopJobQueue(self):
+        r"""
+        Stops the print job queue if it is running, the current print continues
+        """
+        self._detachJobQueue()
+
+        return
+
+    def _detachJobQueue(self):
+        r"""
+        Stops the print job queue and returns it, or None if there is no queue
+        """
+        with self._connectionRLock:
+            jobQueue = self._jobQueue
+            self._jobQueue = None
+        if jobQueue is not None:
+            jobQueue.stop()
+            if jobQueue is not threading.current_thread():
+                jobQueue.join(Conn.READ_TIMEOUT / 1000.0)
+
+        return jobQueue
+
+    # *************************************************************************
+    #                        setQueryCacheTTL Method
+    # *************************************************************************
+    def setQueryCacheTTL(self, ttl, query=None):
+        r"""
+        setQueryCacheTTL method
+
+        Sets for how long the results of the read only BeeCmd queries (getStatus,
+        getPrinterMode, getNozzleTemperature, getPrintVariables, getFirmwareVersion,
+        getNozzleSize, getFilamentString, getFilamentInSpool) are reused. Commands that
+        may change the printer state discard them. Concurrent calls of the same query
+        share one execution whatever the TTL
+
+        arguments:
+            ttl - time to live in seconds, 0 disables the cache
+            query - optional BeeCmd method name, if None ttl is the default of all queries
+        """
+        self._queryCache.setTTL(ttl, query)
+
+        return
+
+    # *************************************************************************
+    #                        getQueryCache Method
+    # *************************************************************************
+    def getQueryCache(self):
+        r"""
+        Returns the QueryCache shared by the BeeCmd objects of this connection
+        """
+        return self._queryCache
+
+    # *************************************************************************
+    #                        getPrintState Method
+    # *************************************************************************
+    def getPrintState(self):
+        r"""
+        Returns the pause/shutdown state of the print (BeeCmd.PRINT_RUNNING, ...)
+        """
+        with self._printStateCond:
+            return self._printState
+
+    # *************************************************************************
+    #                        setPrintState Method
+    # *************************************************************************
+    def setPrintState(self, state, fromStates=None):
+        r"""
+        setPrintState method
+
+        Moves the pause/shutdown state machine to state if the current state is one of
+        fromStates (any state if None) and wakes the threads waiting for it
+        """
+        with self._printStateCond:
+            if fromStates is None or self._printState in fromStates:
+                if self._printState != state:
+                    logger.debug('Print state: %s -> %s', self._printState, state)
+                self._printState = state
+                self._printStateCond.notify_all()
+
+        return
+
+    # *************************************************************************
+    #                        waitPrintStateChange Method
+    # *************************************************************************
+    def waitPrintStateChange(self, state, timeout):
+        r"""
+        Waits up to timeout seconds while the print is in state
+
+        returns:
+            the current print state
+        """
+        with self._printStateCond:
+            if self._printState == state:
+                self._printStateCond.wait(timeout)
+
+            return self._printState
+
+    # *************************************************************************
+    #                        setPriorityScheduling Method
+    # *************************************************************************
+    def setPriorityScheduling(self, enabled):
+        r"""
+        setPriorityScheduling method
+
+        If enabled (default) stop, pause and shutdown commands are written before the
+        other waiting commands and telemetry queries after them. If disabled commands
+        are written in arrival order
+        """
+        self._priorityScheduling = enabled
+
+        return
 
     def startConnectionMonitor(self):
         """
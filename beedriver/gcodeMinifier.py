@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+
+import re
+import threading
+from beedriver import logger
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    from utils import gcoder
+except ImportError:
+    gcoder = None
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+# Comment syntax recognized by the gcoder tokenizer: (comment) and ; comment
+_COMMENT_RE = re.compile(r'\([^\(\)]*\)|;.*')
+# Commands with a text argument (SD file names, LCD messages) where ( and ; are text
+_TEXT_COMMAND_RE = re.compile(r'^\s*(?:N\d+\s*)?M(?:23|28|30|32|33|117|118)(?!\d)', re.IGNORECASE)
+# Moves are rebuilt only if they have no words other than these
+_MOVE_WORDS_RE = re.compile(r'^[GXYZEFgxyzef0-9.+\-\s]*$')
+
+
+# *************************************************************************
+#                        isAvailable Method
+# *************************************************************************
+def isAvailable():
+    r"""
+    Returns True if the gcoder tokenizer used by the minifier can be imported
+    """
+    return gcoder is not None
+
+
+class GCodeMinifier:
+    r"""
+        GCodeMinifier Class
+
+        Line by line G-code minifier. Removes comments and blank lines, drops the
+        coordinates and feedrates of G0/G1 moves that repeat the current modal value
+        and rounds coordinates to the firmware precision. Feedrates are only shortened
+        when their value does not change and the text of commands such as M117 is kept
+        as is. Only the motion state is kept, so memory use does not depend on the file
+        size
+
+        __init__(xyzDecimals, eDecimals, fDecimals)             Initializes current class
+        minifyLine(line)                                        Returns the minified line ('' if the line can be dropped)
+    """
+
+    XYZ_DECIMALS = 3
+    E_DECIMALS = 5
+    F_DECIMALS = 0
+    EXACT_DECIMALS = 6      # decimals of the feedrates that are not rounded
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, xyzDecimals=XYZ_DECIMALS, eDecimals=E_DECIMALS, fDecimals=F_DECIMALS):
+        r"""
+        __init__ Method
+
+        arguments:
+            xyzDecimals - decimals kept in X, Y and Z coordinates
+            eDecimals - decimals kept in E coordinates
+            fDecimals - decimals kept in feedrates
+        """
+        self._decimals = {'x': xyzDecimals, 'y': xyzDecimals, 'z': xyzDecimals, 'e': eDecimals, 'f': fDecimals}
+        self._relative = False
+        self._pos = {'x': None, 'y': None, 'z': None}
+        self._feedrate = None
+        # After G20 coordinates are in inches, lines are then only stripped of comments
+        self._passthrough = False
+
+        return
+
+    # *************************************************************************
+    #                        minifyLine Method
+    # *************************************************************************
+    def minifyLine(self, line):
+        r"""
+        minifyLine method
+
+        arguments:
+            line - G-code line
+
+        returns:
+            minified line terminated with '\n' or '' if the line has no effect
+        """
+        if '*' in line:
+            # Line with checksum, must be sent unchanged
+            return line
+
+        if _TEXT_COMMAND_RE.match(line):
+            return line.strip() + '\n'
+
+        code = _COMMENT_RE.sub('', line).strip()
+        if code == '':
+            return ''
+
+        if self._passthrough or gcoder is None:
+            return code + '\n'
+
+        gline = gcoder.Line(code)
+        splitRaw = gcoder.split(gline)
+        command = gline.command
+
+        if command in ('G0', 'G1') and _MOVE_WORDS_RE.match(code):
+            gcoder.parse_coordinates(gline, splitRaw)
+            return self._minifyMove(gline)
+
+        if command == 'G90':
+            self._relative = False
+        elif command == 'G91':
+            self._relative = True
+        elif command == 'G20':
+            self._passthrough = True
+        elif command in ('G4', 'G21') or command.startswith('M'):
+            pass
+        elif command == 'G92' and len(splitRaw) > 1:
+            gcoder.parse_coordinates(gline, splitRaw)
+            for axis in self._pos:
+                if getattr(gline, axis) is not None:
+                    self._pos[axis] = self._round(axis, getattr(gline, axis))
+        else:
+            # Homing, arcs, tool changes and moves sent unchanged leave an unknown position
+            self._pos = {'x': None, 'y': None, 'z': None}
+            self._feedrate = None
+
+        return code + '\n'
+
+    # *************************************************************************
+    #                        _minifyMove Method
+    # *************************************************************************
+    def _minifyMove(self, gline):
+        r"""
+        Rebuilds a G0/G1 move without the redundant words
+        """
+        words = [gline.command]
+        moves = False
+        for axis in ('x', 'y', 'z'):
+            value = getattr(gline, axis)
+            if value is None:
+                continue
+            value = self._round(axis, value)
+            if self._relative:
+                if value == 0:
+                    continue
+                if self._pos[axis] is not None:
+                    self._pos[axis] = self._round(axis, self._pos[axis] + value)
+            else:
+                if self._pos[axis] == value:
+                    continue
+                self._pos[axis] = value
+            words.append(axis.upper() + self._format(axis, value))
+            moves = True
+
+        if gline.e is not None:
+            words.append('E' + self._format('e', self._round('e', gline.e)))
+            moves = True
+
+        if gline.f is not None:
+            feedrate = self._round('f', gline.f)
+            if feedrate != self._feedrate:
+                self._feedrate = feedrate
+                words.append('F' + self._format('f', feedrate))
+                moves = True
+
+        if not moves:
+            return ''
+
+        return ' '.join(words) + '\n'
+
+    def _round(self, word, value):
+        rounded = round(value, self._decimals[word])
+        if word == 'f' and rounded != value:
+            # Feedrates are only shortened when their value does not change (F0.4 is not F0)
+            return value
+
+        return rounded
+
+    def _format(self, word, value):
+        decimals = self._decimals[word]
+        if word == 'f':
+            decimals = max(decimals, GCodeMinifier.EXACT_DECIMALS)
+        s = '%.*f' % (decimals, value)
+        if '.' in s:
+            s = s.rstrip('0').rstrip('.')
+        if s in ('-0', ''):
+            s = '0'
+
+        return s
+
+
+class MinifiedStream:
+    r"""
+        MinifiedStream Class
+
+        Read only file object with the minified content of a G-code file. The file is
+        minified by a producer thread that runs ahead of the reader through a bounded
+        queue, so minification overlaps with the transfer and memory use is constant.
+
+        The stream can only be read forward. seek() accepts any position after the
+        start of the last data read, which lets a block be read again after a
+        transmission error
+
+        __init__(filePath, minifier)                            Initializes current class
+        read(n)                                                 Reads up to n bytes
+        seek(pos)                                               Moves the read position
+        tell()                                                  Returns the read position
+        getSourcePosition()                                     Returns the bytes of the source file already read
+        close()                                                 Stops the producer thread
+    """
+
+    CHUNK_SIZE = 65536
+    QUEUE_SIZE = 4
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, filePath, minifier=None):
+        r"""
+        __init__ Method
+
+        arguments:
+            filePath - G-code file to minify
+            minifier - optional GCodeMinifier (default settings if None)
+        """
+        self._filePath = filePath
+        self._minifier = minifier if minifier is not None else GCodeMinifier()
+        self._queue = queue.Queue(MinifiedStream.QUEUE_SIZE)
+        self._closed = False
+
+        self._chunk = b''               # chunk being read
+        self._chunkStart = 0            # stream position of the chunk
+        self._chunkSourceEnd = 0        # source file position at the end of the chunk
+        self._last = b''                # last data returned by read, kept for seek back
+        self._lastStart = 0
+        self._pos = 0
+        self._eof = False
+        self.error = None
+
+        self._producer = threading.Thread(target=self._produce, name="bee_transfer._minifier_thread")
+        self._producer.daemon = True
+        self._producer.start()
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.close()
+
+    # *************************************************************************
+    #                        _produce Method
+    # *************************************************************************
+    def _produce(self):
+        r"""
+        Producer thread, minifies the source file into chunks of about CHUNK_SIZE bytes
+        """
+        try:
+            with open(self._filePath, 'rb') as f:
+                out = []
+                outLen = 0
+                sourcePos = 0
+                for line in f:
+                    sourcePos += len(line)
+                    m = self._minifier.minifyLine(line)
+                    if m == '':
+                        continue
+                    out.append(m)
+                    outLen += len(m)
+                    if outLen >= MinifiedStream.CHUNK_SIZE:
+                        if not self._put((''.join(out), sourcePos)):
+                            return
+                        out = []
+                        outLen = 0
+                if outLen > 0 and not self._put((''.join(out), sourcePos)):
+                    return
+        except Exception as ex:
+            logger.error("G-code minifier error: %s", str(ex))
+            self.error = ex
+
+        self._put(None)
+
+        return
+
+    def _put(self, item):
+        while not self._closed:
+            try:
+                self._queue.put(item, True, 0.5)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    # *************************************************************************
+    #                        read Method
+    # *************************************************************************
+    def read(self, n):
+        r"""
+        Returns up to n bytes from the current position ('' at the end of the stream)
+        """
+        data = ''
+        if self._lastStart <= self._pos < self._lastStart + len(self._last):
+            # Data read again after a seek back
+            offset = self._pos - self._lastStart
+            data = self._last[offset:offset + n]
+        if len(data) < n:
+            data += self._readForward(self._pos + len(data), n - len(data))
+        self._last = data
+        self._lastStart = self._pos
+        self._pos += len(data)
+
+        return data
+
+    def _readForward(self, pos, n):
+        # Skip the data before the read position, if any
+        while self._chunkStart + len(self._chunk) <= pos and self._nextChunk():
+            pass
+
+        parts = []
+        size = 0
+        while size < n:
+            offset = pos + size - self._chunkStart
+            if offset >= len(self._chunk):
+                if not self._nextChunk():
+                    break
+                continue
+            part = self._chunk[offset:offset + n - size]
+            parts.append(part)
+            size += len(part)
+
+        return ''.join(parts)
+
+    def _nextChunk(self):
+        if self._eof:
+            return False
+        item = self._queue.get()
+        if item is None:
+            self._eof = True
+            return False
+        self._chunkStart += len(self._chunk)
+        self._chunk, self._chunkSourceEnd = item
+
+        return True
+
+    # *************************************************************************
+    #                        seek Method
+    # *************************************************************************
+    def seek(self, pos):
+        r"""
+        Moves the read position. Positions before the last data read are not available
+        """
+        if pos < self._lastStart:
+            raise IOError("MinifiedStream: cannot seek back to %d" % pos)
+        self._pos = pos
+
+        return
+
+    def tell(self):
+        return self._pos
+
+    # *************************************************************************
+    #                        getSourcePosition Method
+    # *************************************************************************
+    def getSourcePosition(self):
+        r"""
+        Returns the number of bytes of the source file that produced the data read so far
+        """
+        return self._chunkSourceEnd
+
+    # *************************************************************************
+    #                        close Method
+    # *************************************************************************
+    def close(self):
+        r"""
+        Stops the producer thread
+        """
+        self._closed = True
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        return
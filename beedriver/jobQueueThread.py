@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import time
+from beedriver import logger
+from beedriver import transferThread
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class PrintJob:
+    r"""
+        PrintJob Class
+
+        Print job of a JobQueueThread
+
+        filePath                                                Local G-code file
+        printTemperature                                        Print temperature
+        sdFileName                                              SD file name, chosen by the queue if None
+        state                                                   Job state (PrintJob.QUEUED, ...)
+    """
+
+    # Job states
+    QUEUED = 'Queued'
+    UPLOADING = 'Uploading'
+    UPLOADED = 'Uploaded'
+    HEATING = 'Heating'
+    PRINTING = 'Printing'
+    DONE = 'Done'
+    FAILED = 'Failed'
+    CANCELLED = 'Cancelled'
+
+    def __init__(self, filePath, printTemperature=200, sdFileName=None):
+        self.filePath = filePath
+        self.printTemperature = printTemperature
+        self.sdFileName = sdFileName
+        self.state = PrintJob.QUEUED
+        self.preheated = False
+        self.printStart = None          # time the print command was sent
+        self.printSeen = False          # the printer reported the print running
+
+    def __repr__(self):
+        return 'PrintJob(%s, %s)' % (self.filePath, self.state)
+
+
+class JobQueueThread(threading.Thread):
+    r"""
+        JobQueueThread Class
+
+        Print queue of a printer. Jobs are printed one after the other: the file of the
+        next job is uploaded to the SD card while the current one prints, the nozzle is
+        heated for it as soon as the current print ends (the setpoint of the current
+        print is kept until then) and its print is started when the printer status
+        returns to Ready and the nozzle reached the print temperature.
+        Commands are sent between the blocks of the upload in progress
+        (Conn.queryBetweenBlocks)
+
+        __init__(connection)                                    Initializes current class
+        addJob(filePath, printTemperature, sdFileName)          Adds a print job to the queue
+        removeJob(job)                                          Removes a job that is not printing
+        getJobs()                                               Returns the jobs not finished
+        getCurrentJob()                                         Returns the job being printed
+        waitIdle(timeout)                                       Waits until all the jobs finished
+        restoreJobs(previous)                                   Takes over the jobs of a stopped queue
+        failJobs(reason)                                        Marks the jobs not finished as failed
+        stop()                                                  Stops the thread
+    """
+
+    STATUS_POLL = 0.5           # seconds between printer status polls
+    PRINT_START_TIMEOUT = 10    # seconds the printer may take to report a started print
+    HEATING_MARGIN = 5          # degrees the setpoint is above the print temperature, as printFile
+    SD_FILE_NAMES = ('JOBA', 'JOBB')    # SD files used alternately by the jobs without a name
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, connection):
+        r"""
+        __init__ Method
+
+        arguments:
+            connection - Conn object
+        """
+        super(JobQueueThread, self).__init__(name="bee_jobs._queue_thread")
+        self.daemon = True
+
+        self._beeCon = connection
+        self._beeCmd = connection.getCommandIntf()
+        self._jobs = []                 # jobs not finished, in print order
+        self._current = None            # job heating or printing
+        self._upload = None             # FileTransferThread of the next job
+        self._uploadJob = None
+        self._cond = threading.Condition()
+        self._running = True
+
+        return
+
+    # *************************************************************************
+    #                        run Method
+    # *************************************************************************
+    def run(self):
+
+        while self._running and self._beeCon.isConnected():
+            try:
+                self._step()
+            except Exception as ex:
+                logger.error("Job queue error: %s", str(ex))
+
+            with self._cond:
+                if self._running:
+                    self._cond.wait(JobQueueThread.STATUS_POLL)
+
+        upload = self._upload
+        if upload is not None:
+            upload.cancelFileTransfer()
+
+        return
+
+    # *************************************************************************
+    #                        _step Method
+    # *************************************************************************
+    def _step(self):
+        r"""
+        Advances the jobs according to the printer status
+        """
+        with self._cond:
+            if self._current is None and len(self._jobs) == 0:
+                return
+
+        self._checkUpload()
+
+        status = self._beeCmd.getStatus()
+        current = self._current
+        if current is not None:
+            if current.state == PrintJob.HEATING:
+                if not current.preheated:
+                    self._heat(current)
+                self._startPrint(current)
+            elif status in ('SD_Print', 'Pause', 'Shutdown', 'Transfer'):
+                current.printSeen = True
+            elif status == 'Ready' and (current.printSeen or
+                                        time.time() - current.printStart > JobQueueThread.PRINT_START_TIMEOUT):
+                logger.info('Job queue: %s printed', current.filePath)
+                self._finish(current, PrintJob.DONE)
+                current = None
+
+        nextJob = self._nextJob()
+        if nextJob is None:
+            return
+
+        if nextJob.state == PrintJob.QUEUED and self._upload is None and not self._beeCon.transferring and \
+                (current is None or current.state == PrintJob.PRINTING):
+            self._startUpload(nextJob, current)
+
+        if current is not None or status != 'Ready':
+            return
+
+        # Heat for the next job once the current print ended, its upload may go on
+        if not nextJob.preheated:
+            self._heat(nextJob)
+
+        if nextJob.state == PrintJob.UPLOADED:
+            self._current = nextJob
+            nextJob.state = PrintJob.HEATING
+            self._startPrint(nextJob)
+
+        return
+
+    def _nextJob(self):
+        with self._cond:
+            for job in self._jobs:
+                if job is not self._current:
+                    return job
+
+        return None
+
+    def _finish(self, job, state):
+        with self._cond:
+            job.state = state
+            if job in self._jobs:
+                self._jobs.remove(job)
+            if self._current is job:
+                self._current = None
+            self._cond.notify_all()
+
+    # *************************************************************************
+    #                        _startUpload Method
+    # *************************************************************************
+    def _startUpload(self, job, current):
+        r"""
+        Starts the upload of the file of job to an SD file that is not being printed
+        """
+        sdFileName = job.sdFileName
+        currentName = current.sdFileName if current is not None else None
+        if sdFileName is None:
+            sdFileName = [name for name in JobQueueThread.SD_FILE_NAMES if name != currentName][0]
+        elif current is not None and sdFileName == currentName:
+            # Same SD file as the current print, uploaded when it ends
+            return
+
+        logger.info('Job queue: uploading %s to %s', job.filePath, sdFileName)
+        job.sdFileName = sdFileName
+        job.state = PrintJob.UPLOADING
+        self._upload = transferThread.FileTransferThread(self._beeCon, job.filePath, 'gcode', sdFileName)
+        self._uploadJob = job
+        self._upload.start()
+
+        return
+
+    def _checkUpload(self):
+        upload = self._upload
+        if upload is None or upload.isRunning():
+            return
+
+        job = self._uploadJob
+        self._upload = None
+        if job.state != PrintJob.UPLOADING:
+            return
+
+        job.sdFileName = upload.getSDFileName()
+        if upload.cancelTransfer or upload.bytesTransferred < upload.fileSize:
+            logger.error('Job queue: upload of %s failed', job.filePath)
+            self._finish(job, PrintJob.FAILED)
+        else:
+            job.state = PrintJob.UPLOADED
+
+        return
+
+    # *************************************************************************
+    #                        _heat Method
+    # *************************************************************************
+    def _heat(self, job):
+        r"""
+        Sets the nozzle temperature of job, the end of the previous print may have
+        switched the heater off. Only called while no job prints, the setpoint of the
+        current print is not changed. The job is preheated once the printer acknowledged
+        the setpoint, otherwise it is sent again in the next step
+        """
+        if job.printTemperature is not None:
+            resp = self._beeCon.queryBetweenBlocks("M104 S%.2f\n" % (job.printTemperature + JobQueueThread.HEATING_MARGIN))
+            if resp is None or resp == "No response":
+                logger.warning('Job queue: nozzle temperature of %s not set', job.filePath)
+                return
+
+        job.preheated = True
+
+        return
+
+    # *************************************************************************
+    #                        _startPrint Method
+    # *************************************************************************
+    def _startPrint(self, job):
+        r"""
+        Starts the print of job once the nozzle reached its temperature
+        """
+        if job.printTemperature is not None:
+            temperature = self._beeCmd.getNozzleTemperature()
+            if temperature is None or temperature < job.printTemperature:
+                return
+
+        logger.info('Job queue: printing %s', job.filePath)
+        if self._beeCon.queryBetweenBlocks("M33 %s\n" % job.sdFileName) is None:
+            return
+        job.printStart = time.time()
+        job.state = PrintJob.PRINTING
+
+        return
+
+    # *************************************************************************
+    #                        addJob Method
+    # *************************************************************************
+    def addJob(self, filePath, printTemperature=200, sdFileName=None):
+        r"""
+        addJob method
+
+        Adds a print job at the end of the queue
+
+        arguments:
+            filePath - local G-code file
+            printTemperature - print temperature (None to print without heating)
+            sdFileName - optional SD file name
+
+        returns:
+            PrintJob object
+        """
+        if not os.path.isfile(filePath):
+            raise ValueError("File does not exist: %s" % filePath)
+
+        job = PrintJob(filePath, printTemperature, sdFileName)
+        with self._cond:
+            self._jobs.append(job)
+            self._cond.notify_all()
+
+        return job
+
+    # *************************************************************************
+    #                        removeJob Method
+    # *************************************************************************
+    def removeJob(self, job):
+        r"""
+        removeJob method
+
+        Removes a job that did not start printing, cancelling its upload
+
+        returns:
+            True if the job was removed
+        """
+        with self._cond:
+            if job not in self._jobs or job is self._current:
+                return False
+            if job.state == PrintJob.UPLOADING and self._upload is not None:
+                self._upload.cancelFileTransfer()
+
+        self._finish(job, PrintJob.CANCELLED)
+
+        return True
+
+    # *************************************************************************
+    #                        getJobs Method
+    # *************************************************************************
+    def getJobs(self):
+        r"""
+        Returns the list of jobs not finished, the first one is printing if getCurrentJob
+        returns it
+        """
+        with self._cond:
+            return list(self._jobs)
+
+    def getCurrentJob(self):
+        return self._current
+
+    # *************************************************************************
+    #                        waitIdle Method
+    # *************************************************************************
+    def waitIdle(self, timeout=None):
+        r"""
+        waitIdle method
+
+        Waits until all the jobs are finished
+
+        returns:
+            True if the queue is empty, False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while len(self._jobs) > 0 and self.isAlive():
+                remaining = 1 if deadline is None else deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+            return len(self._jobs) == 0
+
+    # *************************************************************************
+    #                        restoreJobs Method
+    # *************************************************************************
+    def restoreJobs(self, previous):
+        r"""
+        restoreJobs method
+
+        Takes over the jobs of a stopped queue (Conn.reconnect). The job printing stays
+        current and the interrupted upload is started again
+
+        arguments:
+            previous - stopped JobQueueThread
+        """
+        jobs = previous.getJobs()
+        current = previous.getCurrentJob()
+        with self._cond:
+            for job in jobs:
+                if job.state == PrintJob.UPLOADING:
+                    job.state = PrintJob.QUEUED
+                if job not in self._jobs:
+                    self._jobs.append(job)
+            if current in jobs:
+                self._current = current
+            self._cond.notify_all()
+
+        if len(jobs) > 0:
+            logger.info('Job queue: %d jobs restored', len(jobs))
+
+        return
+
+    # *************************************************************************
+    #                        failJobs Method
+    # *************************************************************************
+    def failJobs(self, reason):
+        r"""
+        Marks the jobs not finished as failed, after the queue was stopped with the
+        connection
+        """
+        for job in self.getJobs():
+            logger.error('Job queue: %s failed, %s', job.filePath, reason)
+            self._finish(job, PrintJob.FAILED)
+
+        return
+
+    # *************************************************************************
+    #                        stop Method
+    # *************************************************************************
+    def stop(self):
+        r"""
+        Stops the job queue, the current print is not cancelled
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        return
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+import threading
+import time
+from beedriver import logger
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+AXES = ('X', 'Y', 'Z', 'E')
+
+
+class JogThread(threading.Thread):
+    r"""
+        JogThread Class
+
+        Continuous jog channel of a printer. Relative displacements are added to a
+        pending move and the thread sends it as soon as the firmware queue ("ok Q:n")
+        has room, so jog events that arrive while the printer is busy are merged in a
+        single move and the intermediate targets are never sent. Moves are not sent
+        during file transfers
+
+        __init__(connection, feedrate, maxQueued)               Initializes current class
+        jog(x, y, z, e, f)                                      Adds a relative displacement to the pending move
+        getPending()                                            Returns the displacement not sent yet
+        getStats()                                              Returns the number of jog events and moves sent
+        getSettings()                                           Returns the feedrate and the queue limit
+        waitIdle(timeout)                                       Waits until all the displacements were sent
+        stop()                                                  Stops the thread
+    """
+
+    MAX_QUEUED = 2              # moves kept in the firmware queue, more are merged
+    QUEUE_POLL = 0.05           # seconds between queue depth checks while the queue is full
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, connection, feedrate=None, maxQueued=MAX_QUEUED):
+        r"""
+        __init__ Method
+
+        arguments:
+            connection - Conn object
+            feedrate - optional feedrate of the moves (default = printer feedrate)
+            maxQueued - commands in the firmware queue above which the displacements are merged
+        """
+        super(JogThread, self).__init__(name="bee_jog._jog_thread")
+        self.daemon = True
+
+        self._beeCon = connection
+        self._feedrate = feedrate
+        self._maxQueued = maxQueued
+        self._pending = dict((axis, 0.0) for axis in AXES)
+        self._sending = False
+        self._events = 0
+        self._moves = 0
+        self._cond = threading.Condition()
+        self._running = True
+
+        return
+
+    # *************************************************************************
+    #                        run Method
+    # *************************************************************************
+    def run(self):
+
+        while self._running and self._beeCon.isConnected():
+            with self._cond:
+                while self._running and not self._hasPending():
+                    self._cond.wait(1)
+                if not self._running:
+                    break
+
+            if self._beeCon.transferring or self._beeCon.getQueueDepth() >= self._maxQueued:
+                # Keep merging the displacements until the printer frees a queue slot,
+                # the status query refreshes the reported queue depth
+                time.sleep(JogThread.QUEUE_POLL)
+                if not self._beeCon.transferring:
+                    self._beeCon.sendCmd("M625\n")
+                continue
+
+            with self._cond:
+                delta = self._pending
+                self._pending = dict((axis, 0.0) for axis in AXES)
+                feedrate = self._feedrate
+                self._sending = True
+
+            try:
+                self._beeCon.sendBatch(["G91\n", self._moveCommand(delta, feedrate), "G90\n"])
+            except Exception as ex:
+                logger.error("Jog move error: %s", str(ex))
+
+            with self._cond:
+                self._sending = False
+                self._moves += 1
+                self._cond.notify_all()
+
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        return
+
+    def _hasPending(self):
+        return any(self._pending[axis] != 0 for axis in AXES)
+
+    @staticmethod
+    def _moveCommand(delta, feedrate):
+        commandStr = "G1"
+        for axis in AXES:
+            if delta[axis] != 0:
+                commandStr += " " + axis + str(round(delta[axis], 4))
+        if feedrate is not None:
+            commandStr += " F" + str(float(feedrate))
+
+        return commandStr + "\n"
+
+    # *************************************************************************
+    #                        jog Method
+    # *************************************************************************
+    def jog(self, x=0, y=0, z=0, e=0, f=None):
+        r"""
+        jog method
+
+        Adds a relative displacement to the pending move. Returns immediately
+
+        arguments:
+            x, y, z, e - axis displacements
+            f - optional feedrate, used from the next move on
+        """
+        with self._cond:
+            for axis, value in zip(AXES, (x, y, z, e)):
+                if value is not None:
+                    self._pending[axis] += value
+            if f is not None:
+                self._feedrate = f
+            self._events += 1
+            self._cond.notify_all()
+
+        return
+
+    # *************************************************************************
+    #                        getPending Method
+    # *************************************************************************
+    def getPending(self):
+        r"""
+        Returns a dict with the displacement of each axis that was not sent yet
+        """
+        with self._cond:
+            return dict(self._pending)
+
+    # *************************************************************************
+    #                        getStats Method
+    # *************************************************************************
+    def getStats(self):
+        r"""
+        Returns a dict with the number of jog events received and moves sent
+        """
+        with self._cond:
+            return {'events': self._events, 'moves': self._moves}
+
+    # *************************************************************************
+    #                        getSettings Method
+    # *************************************************************************
+    def getSettings(self):
+        r"""
+        Returns the feedrate and the queue limit as keyword arguments of __init__
+        """
+        with self._cond:
+            return {'feedrate': self._feedrate, 'maxQueued': self._maxQueued}
+
+    # *************************************************************************
+    #                        waitIdle Method
+    # *************************************************************************
+    def waitIdle(self, timeout=None):
+        r"""
+        waitIdle method
+
+        Waits until all the displacements were sent to the printer
+
+        returns:
+            True if the channel is idle, False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._running and (self._sending or self._hasPending()):
+                remaining = 1 if deadline is None else deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+            return not self._sending and not self._hasPending()
+
+    # *************************************************************************
+    #                        stop Method
+    # *************************************************************************
+    def stop(self):
+        r"""
+        Stops the jog thread. Displacements not sent yet are discarded
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        return
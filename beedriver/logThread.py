@@ -142,6 +142,27 @@ class LogThread(threading.Thread):
 
         return
 
+    # *************************************************************************
+    #                        _query Method
+    # *************************************************************************
+    def _query(self, name):
+        r"""
+        Returns the reply to the M105 ('temperature') or M1029 ('log') query. If the
+        telemetry thread of the printer is running the reply is taken from its snapshot
+        when it was polled within the log period, the telemetry intervals are not changed
+        """
+        snapshot = self.beeCon.getTelemetrySnapshot()
+        if snapshot is not None:
+            reply = snapshot.temperatureReply if name == 'temperature' else snapshot.logReply
+            polled = snapshot.pollTimes.get(name)
+            if reply is not None and polled is not None and time.time() - polled <= self._freq:
+                return reply
+
+        if name == 'temperature':
+            return self.beeCon.sendCmd("M105\n")
+
+        return self.beeCon.sendCmd("M1029\n")
+
     # *************************************************************************
     #                        finiteTemperatureLog Method
     # *************************************************************************
@@ -152,7 +173,7 @@ class LogThread(threading.Thread):
 
         self._t = 0
         for i in range(0,self._samples):
-            reply = self.beeCon.sendCmd("M105\n")
+            reply = self._query('temperature')
             parsedLine = parsers.parseTemperatureReply(reply,self._printer)
             if parsedLine is not None:
                 self._logFile.write("{},{}".format(self._t, parsedLine))
@@ -177,7 +198,7 @@ class LogThread(threading.Thread):
 
         self._t = 0
         for i in range(0,self._samples):
-            reply = self.beeCon.sendCmd("M1029\n")
+            reply = self._query('log')
             parsedLine = parsers.parseLogReply(reply,self._printer)
             if parsedLine is not None:
                 self._logFile.write("{},{}".format(self._t, parsedLine))
@@ -202,7 +223,7 @@ class LogThread(threading.Thread):
 
         self._t = 0
         while not self._stopLog:
-            reply = self.beeCon.sendCmd("M1029\n")
+            reply = self._query('log')
             parsedLine = parsers.parseLogReply(reply,self._printer)
             if parsedLine is not None:
                 self._logFile.write("{},{}".format(self._t, parsedLine))
@@ -225,7 +246,7 @@ class LogThread(threading.Thread):
 
         self._t = 0
         while not self._stopLog:
-            reply = self.beeCon.sendCmd("M105\n")
+            reply = self._query('temperature')
             parsedLine = parsers.parseTemperatureReply(reply,self._printer)
             if parsedLine is not None:
                 i = i + 1
@@ -261,7 +282,7 @@ class LogThread(threading.Thread):
             if st is not None:
                 if 'SD_Print' not in st:
                     self._stopLog = True
-            reply = beeCmd.sendCmd("M1029\n")
+            reply = self._query('log')
 
             parsedLine = parsers.parseLogReply(reply)
             if parsedLine is not None:
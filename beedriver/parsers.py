@@ -134,3 +134,132 @@ def parseTemperatureReply(replyLine):
             logLine = "{},{},{}\n".format(float1, float2, float3)
 
     return logLine
+
+
+# Firmware acknowledge line, optionally carrying the command queue depth ("ok Q:n")
+REPLY_FRAME_RE = re.compile(r'\bok\b[^\n]*(?:\n|$)')
+QUEUE_DEPTH_RE = re.compile(r'ok Q:(\d+)')
+FILE_SIZE_RE = re.compile(r'file opened:.*size:\s*(\d+)', re.IGNORECASE)
+
+
+# *************************************************************************
+#                        parseQueueDepth Method
+# *************************************************************************
+def parseQueueDepth(replyLine):
+    r"""
+    Returns the last firmware queue depth reported in a reply ("ok Q:n") or None
+    """
+    depth = None
+    for m in QUEUE_DEPTH_RE.finditer(replyLine):
+        depth = int(m.group(1))
+
+    return depth
+
+
+# *************************************************************************
+#                        parsePrinterMode Method
+# *************************************************************************
+def parsePrinterMode(replyLine):
+    r"""
+    Returns the printer mode ('Bootloader' or 'Firmware') from the reply to M625 or None
+    """
+    if replyLine is None:
+        return None
+    if 'Bad M-code 625' in replyLine:   # printer in bootloader mode
+        return 'Bootloader'
+    if 'ok Q' in replyLine:
+        return 'Firmware'
+
+    return None
+
+
+# *************************************************************************
+#                        parseStatusReply Method
+# *************************************************************************
+def parseStatusReply(replyLine):
+    r"""
+    Returns the printer status from the reply to M625 in firmware mode (Ready, Moving,
+    SD_Print, Transfer, Pause or Shutdown) or None if the reply has no known status
+    """
+    if replyLine is None:
+        return None
+
+    resp = replyLine.lower()
+    if 'pause' in resp:
+        return 'Pause'
+    elif 'shutdown' in resp:
+        return 'Shutdown'
+    elif 's:3' in resp:
+        return 'Ready'
+    elif 's:4' in resp:
+        return 'Moving'
+    elif 's:5' in resp:
+        return 'SD_Print'
+    elif 's:6' in resp:
+        return 'Transfer'
+    elif 's:7' in resp:
+        return 'Pause'
+    elif 's:9' in resp:
+        return 'Shutdown'
+
+    return None
+
+
+# *************************************************************************
+#                        parseNozzleTemperature Method
+# *************************************************************************
+def parseNozzleTemperature(replyLine):
+    r"""
+    Returns the nozzle temperature from the reply to M105
+
+    raises:
+        ValueError/IndexError if the reply has no temperature
+    """
+    splits = replyLine.split(" ")
+    tPos = splits[0].find("T:")
+
+    return float(splits[0][tPos+2:])
+
+
+# *************************************************************************
+#                        parseFileSize Method
+# *************************************************************************
+def parseFileSize(replyLine):
+    r"""
+    Returns the size of the SD file in the reply to M23 ("File opened: NAME Size: N")
+    or None if the reply has no size
+    """
+    match = FILE_SIZE_RE.search(replyLine or '')
+    if match is None:
+        return None
+
+    return int(match.group(1))
+
+
+# *************************************************************************
+#                        parsePrintVariables Method
+# *************************************************************************
+def parsePrintVariables(replyLine):
+    r"""
+    Returns a dict with the print variables in the reply to M32 (Estimated Time,
+    Elapsed Time, Lines and Executed Lines)
+    """
+    printStatus = {}
+
+    split = replyLine.split(' ')
+
+    try:
+        for s in split:
+            if 'A' in s:
+                printStatus['Estimated Time'] = int(s[1:])
+            elif 'B' in s:
+                printStatus['Elapsed Time'] = int(s[1:])//(60*1000)
+            elif 'C' in s:
+                printStatus['Lines'] = int(s[1:])
+            elif 'D' in s:
+                printStatus['Executed Lines'] = int(s[1:])
+                break  # If the D was found there is no need to process the string further
+    except:
+        logger.warning('Error parsing print variables response')
+
+    return printStatus
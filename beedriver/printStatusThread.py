@@ -49,20 +49,9 @@ class PrintStatusThread(threading.Thread):
         printVars = dict()
         while self._running:
 
-            if self._beeConn.dummyPlugConnected():
-                # Simulated print job progress
-                printVars['Lines'] = 300
-                if 'Executed Lines' not in printVars:
-                    printVars['Executed Lines'] = 3
-                else:
-                    printVars['Executed Lines'] += 30
-                printVars['Estimated Time'] = 7000
-                if 'Elapsed Time' not in printVars:
-                    printVars['Elapsed Time'] = 10
-                else:
-                    printVars['Elapsed Time'] += 30
-            else:
-                printVars = self._commands.getPrintVariables()
+            printVars = self._commands.getPrintVariables()
+            if printVars is None:
+                printVars = dict()
 
             if 'Lines' in printVars and \
                 'Executed Lines' in printVars and \
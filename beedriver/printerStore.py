@@ -0,0 +1,650 @@
+#!/usr/bin/env python
+
+import os
+import json
+import hashlib
+import threading
+from beedriver import logger
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+# Directory where the per printer state is stored. Can be changed with setStoreDir
+# or with the BEEDRIVER_STORE_DIR environment variable
+_storeDir = os.environ.get('BEEDRIVER_STORE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.beedriver'))
+
+_storeLock = threading.Lock()
+
+
+# *************************************************************************
+#                        setStoreDir Method
+# *************************************************************************
+def setStoreDir(path):
+    r"""
+    Sets the directory where the per printer state files are stored
+    """
+    global _storeDir
+    _storeDir = path
+
+    return
+
+
+# *************************************************************************
+#                        getStoreDir Method
+# *************************************************************************
+def getStoreDir():
+    r"""
+    Returns the directory where the per printer state files are stored
+    """
+    return _storeDir
+
+
+# *************************************************************************
+#                        loadPrinterState Method
+# *************************************************************************
+def loadPrinterState(serialNumber, name):
+    r"""
+    loadPrinterState method
+
+    Loads a state file of a printer
+
+    arguments:
+        serialNumber - printer serial number
+        name - state file name
+
+    returns:
+        dict with the stored state (empty if the file does not exist or is not valid)
+    """
+    path = _statePath(serialNumber, name)
+    with _storeLock:
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+        except (IOError, ValueError) as ex:
+            logger.warning("Discarding invalid printer state file %s: %s", path, str(ex))
+            return {}
+
+    if not isinstance(state, dict):
+        return {}
+
+    return state
+
+
+# *************************************************************************
+#                        savePrinterState Method
+# *************************************************************************
+def savePrinterState(serialNumber, name, state):
+    r"""
+    savePrinterState method
+
+    Stores a state file of a printer. The file is replaced atomically so an
+    interrupted write never leaves a corrupted state
+
+    arguments:
+        serialNumber - printer serial number
+        name - state file name
+        state - dict with the state to store
+
+    returns:
+        True if the state was stored
+    """
+    path = _statePath(serialNumber, name)
+    tmpPath = path + '.tmp'
+    with _storeLock:
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(tmpPath, 'w') as f:
+                json.dump(state, f)
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmpPath, path)
+        except (IOError, OSError) as ex:
+            logger.error("Error storing printer state file %s: %s", path, str(ex))
+            return False
+
+    return True
+
+
+def _statePath(serialNumber, name):
+    return os.path.join(_storeDir, str(serialNumber).strip(), name + '.json')
+
+
+class TransferJournal:
+    r"""
+        TransferJournal Class
+
+        Persistent record of the G-code transfers to the SD card of a printer. For each
+        SD file it stores the local file that is being transferred and the position up
+        to which the printer acknowledged the data, so an interrupted transfer can
+        continue from there, even after a process restart
+
+        __init__(serialNumber)                                  Initializes current class
+        getResumePosition(sdFileName, filePath, blockBytes, minified)   Returns the position to resume a transfer from
+        start(sdFileName, filePath, blockBytes, position, minified)     Records the start of a transfer
+        update(sdFileName, position)                            Records the acknowledged position of a transfer
+        finish(sdFileName)                                      Removes a completed transfer
+    """
+
+    STATE_NAME = 'transfers'
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, serialNumber):
+        r"""
+        __init__ Method
+
+        arguments:
+            serialNumber - printer serial number
+        """
+        self._serialNumber = serialNumber
+        self._transfers = loadPrinterState(serialNumber, TransferJournal.STATE_NAME)
+
+        return
+
+    # *************************************************************************
+    #                        getResumePosition Method
+    # *************************************************************************
+    def getResumePosition(self, sdFileName, filePath, blockBytes, minified=False):
+        r"""
+        getResumePosition method
+
+        Returns the position up to which a previous transfer of the same local file to
+        the same SD file was acknowledged, or 0 if the transfer must start from the beginning.
+        Positions of minified transfers refer to the minified data
+        """
+        entry = self._transfers.get(sdFileName)
+        if entry is None:
+            return 0
+
+        if entry.get('fingerprint') != _fileFingerprint(filePath) or entry.get('blockBytes') != blockBytes \
+                or entry.get('minified', False) != minified:
+            return 0
+
+        position = entry.get('position', 0)
+        if position % blockBytes != 0 or (not minified and position >= entry['fingerprint'][1]):
+            return 0
+
+        return position
+
+    # *************************************************************************
+    #                        start Method
+    # *************************************************************************
+    def start(self, sdFileName, filePath, blockBytes, position=0, minified=False):
+        r"""
+        Records the start of the transfer of filePath to sdFileName
+        """
+        self._transfers[sdFileName] = {
+            'fingerprint': _fileFingerprint(filePath),
+            'blockBytes': blockBytes,
+            'position': position,
+            'minified': minified,
+        }
+
+        return self._save()
+
+    # *************************************************************************
+    #                        update Method
+    # *************************************************************************
+    def update(self, sdFileName, position):
+        r"""
+        Records that the printer acknowledged the data of sdFileName up to position
+        """
+        entry = self._transfers.get(sdFileName)
+        if entry is None:
+            return False
+        entry['position'] = position
+
+        return self._save()
+
+    # *************************************************************************
+    #                        finish Method
+    # *************************************************************************
+    def finish(self, sdFileName):
+        r"""
+        Removes the record of a completed transfer
+        """
+        if self._transfers.pop(sdFileName, None) is None:
+            return True
+
+        return self._save()
+
+    def _save(self):
+        return savePrinterState(self._serialNumber, TransferJournal.STATE_NAME, self._transfers)
+
+
+def _fileFingerprint(filePath):
+    r"""
+    Returns [absolute path, size, modification time] used to detect changes of a local file
+    """
+    st = os.stat(filePath)
+
+    return [os.path.abspath(filePath), st.st_size, int(st.st_mtime)]
+
+
+class BlockManifest:
+    r"""
+        BlockManifest Class
+
+        Persistent record of the content the driver wrote to the SD files of a printer.
+        For each SD file it stores the hash of every block (MESSAGE_SIZE * BLOCK_SIZE
+        bytes) so a new version of a G-code file can be transferred by sending only the
+        blocks that changed. Blocks whose content is not known (e.g. a transfer was
+        interrupted while they were being written) are stored as None
+
+        __init__(serialNumber)                                  Initializes current class
+        getChangedBlocks(sdFileName, hashes, blockBytes, size)  Returns the blocks that differ from the SD file
+        store(sdFileName, hashes, blockBytes, size)             Records the block hashes of an SD file
+        invalidate(sdFileName)                                  Forgets the content of an SD file
+        contains(sdFileName)                                    Returns True if the content of an SD file is recorded
+    """
+
+    STATE_NAME = 'manifests'
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, serialNumber):
+        r"""
+        __init__ Method
+
+        arguments:
+            serialNumber - printer serial number
+        """
+        self._serialNumber = serialNumber
+        self._manifests = loadPrinterState(serialNumber, BlockManifest.STATE_NAME)
+
+        return
+
+    # *************************************************************************
+    #                        getChangedBlocks Method
+    # *************************************************************************
+    def getChangedBlocks(self, sdFileName, hashes, blockBytes, size):
+        r"""
+        getChangedBlocks method
+
+        Compares the block hashes of a local file with the ones last written to the SD file
+
+        arguments:
+            sdFileName - SD file name
+            hashes - list with the hash of each block of the local file
+            blockBytes - block size in bytes
+            size - local file size in bytes
+
+        returns:
+            list with the indexes of the blocks that must be written or None if the SD
+            file content is not known or cannot be updated in place (the new file is
+            shorter than the SD file and M28 cannot truncate it)
+        """
+        entry = self._manifests.get(sdFileName)
+        if entry is None or entry.get('blockBytes') != blockBytes:
+            return None
+
+        if size < entry.get('size', 0):
+            return None
+
+        old = entry.get('hashes', [])
+
+        return [i for i, h in enumerate(hashes) if i >= len(old) or old[i] != h]
+
+    # *************************************************************************
+    #                        store Method
+    # *************************************************************************
+    def store(self, sdFileName, hashes, blockBytes, size):
+        r"""
+        Records the block hashes and the size of the content of sdFileName
+        """
+        self._manifests[sdFileName] = {'blockBytes': blockBytes, 'size': size, 'hashes': list(hashes)}
+
+        return self._save()
+
+    # *************************************************************************
+    #                        invalidate Method
+    # *************************************************************************
+    def invalidate(self, sdFileName):
+        r"""
+        Forgets the content of sdFileName, its next transfer sends every block
+        """
+        if self._manifests.pop(sdFileName, None) is None:
+            return True
+
+        return self._save()
+
+    def contains(self, sdFileName):
+        return sdFileName in self._manifests
+
+    def _save(self):
+        return savePrinterState(self._serialNumber, BlockManifest.STATE_NAME, self._manifests)
+
+
+class SDCache:
+    r"""
+        SDCache Class
+
+        Persistent index of the G-code files the driver stored in the SD card of a
+        printer, addressed by the SHA-1 of their content. Used to skip the transfer of
+        a file that is already in the SD card
+
+        __init__(serialNumber)                                  Initializes current class
+        getContentName(fileHash)                                Returns the SD file name derived from a content hash
+        find(fileHash, sdFileNames, sdFileName)                 Returns the SD file that holds the content
+        store(sdFileName, fileHash, size)                       Records the content of an SD file
+        invalidate(sdFileName)                                  Forgets the content of an SD file
+    """
+
+    STATE_NAME = 'sdcache'
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, serialNumber):
+        r"""
+        __init__ Method
+
+        arguments:
+            serialNumber - printer serial number
+        """
+        self._serialNumber = serialNumber
+        self._files = loadPrinterState(serialNumber, SDCache.STATE_NAME)
+
+        return
+
+    # *************************************************************************
+    #                        getContentName Method
+    # *************************************************************************
+    def getContentName(self, fileHash):
+        r"""
+        Returns a valid SD file name (8 chars, starting with a letter) derived from a
+        content hash, used when no SD file name is given
+        """
+        return 'C' + fileHash[:7].upper()
+
+    # *************************************************************************
+    #                        find Method
+    # *************************************************************************
+    def find(self, fileHash, sdFileNames, sdFileName=None):
+        r"""
+        find method
+
+        Looks for an SD file with the given content. Entries of files that are no
+        longer in the SD card are removed from the index
+
+        arguments:
+            fileHash - SHA-1 of the local file
+            sdFileNames - list with the names of the files in the SD card (getFileList)
+            sdFileName - optional SD file name, if given only that file is considered
+
+        returns:
+            name of the SD file with the content or None
+        """
+        present = set(n.upper() for n in sdFileNames)
+        stale = [n for n in self._files if n.upper() not in present]
+        for n in stale:
+            del self._files[n]
+        if len(stale) > 0:
+            self._save()
+
+        for name, entry in self._files.items():
+            if entry.get('sha1') != fileHash:
+                continue
+            if sdFileName is None or name.upper() == sdFileName.upper():
+                return name
+
+        return None
+
+    # *************************************************************************
+    #                        store Method
+    # *************************************************************************
+    def store(self, sdFileName, fileHash, size):
+        r"""
+        Records that sdFileName holds the content with hash fileHash
+        """
+        self._files[sdFileName] = {'sha1': fileHash, 'size': size}
+
+        return self._save()
+
+    # *************************************************************************
+    #                        invalidate Method
+    # *************************************************************************
+    def invalidate(self, sdFileName):
+        r"""
+        Forgets the content of sdFileName
+        """
+        if self._files.pop(sdFileName, None) is None:
+            return True
+
+        return self._save()
+
+    def _save(self):
+        return savePrinterState(self._serialNumber, SDCache.STATE_NAME, self._files)
+
+
+class FirmwareRecord:
+    r"""
+        FirmwareRecord Class
+
+        Persistent record of the last firmware image flashed to a printer: SHA-1 of the
+        image, firmware string and bootloader version (M116). An image is only marked
+        as flashed once the bootloader echoed all of it, so an interrupted flash is
+        never taken as current
+
+        __init__(serialNumber)                                  Initializes current class
+        check(fileHash, firmwareString, currentString, bootloaderVersion)   Compares the printer with a target image
+        start(fileHash, size, firmwareString, bootloaderVersion)            Records the start of a flash
+        finish()                                                Records that the image was flashed
+    """
+
+    STATE_NAME = 'firmware'
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, serialNumber):
+        r"""
+        __init__ Method
+
+        arguments:
+            serialNumber - printer serial number
+        """
+        self._serialNumber = serialNumber
+        self._record = loadPrinterState(serialNumber, FirmwareRecord.STATE_NAME)
+
+        return
+
+    # *************************************************************************
+    #                        check Method
+    # *************************************************************************
+    def check(self, fileHash, firmwareString, currentString, bootloaderVersion=None):
+        r"""
+        check method
+
+        Compares the state of the printer with a target firmware image
+
+        arguments:
+            fileHash - SHA-1 of the target image
+            firmwareString - firmware string of the target image
+            currentString - firmware string reported by the printer (M115)
+            bootloaderVersion - bootloader version reported by the printer (M116), None
+                                if unknown (printer in firmware mode)
+
+        returns:
+            'current' if the printer runs the target image, 'string' if the image is
+            flashed but the firmware string was not set (e.g. flash interrupted after
+            the transfer) and 'flash' if the image must be flashed
+        """
+        if self._record.get('state') != 'flashed' or self._record.get('sha1') != fileHash:
+            return 'flash'
+
+        if bootloaderVersion is not None and self._record.get('bootloader') is not None \
+                and bootloaderVersion != self._record['bootloader']:
+            return 'flash'
+
+        if currentString != firmwareString:
+            return 'string'
+
+        return 'current'
+
+    # *************************************************************************
+    #                        start Method
+    # *************************************************************************
+    def start(self, fileHash, size, firmwareString, bootloaderVersion=None):
+        r"""
+        Records the start of the flash of an image, the image is not current until finish
+        """
+        self._record = {
+            'sha1': fileHash,
+            'size': size,
+            'firmwareString': firmwareString,
+            'bootloader': bootloaderVersion,
+            'state': 'flashing',
+        }
+
+        return self._save()
+
+    # *************************************************************************
+    #                        finish Method
+    # *************************************************************************
+    def finish(self):
+        r"""
+        Records that the image being flashed was completely transferred and verified
+        """
+        if self._record.get('state') != 'flashing':
+            return False
+        self._record['state'] = 'flashed'
+
+        return self._save()
+
+    def _save(self):
+        return savePrinterState(self._serialNumber, FirmwareRecord.STATE_NAME, self._record)
+
+
+class StreamCheckpoint:
+    r"""
+        StreamCheckpoint Class
+
+        Persistent record of the host streamed print of a printer: the local file being
+        printed and the number of its lines known to be executed by the printer, so an
+        interrupted print can be streamed again from that line
+
+        __init__(serialNumber)                                  Initializes current class
+        getResumeLine(filePath)                                 Returns the line to resume a print of filePath from
+        start(filePath, line)                                   Records the start of a streamed print
+        update(line)                                            Records the lines executed by the printer
+        finish()                                                Removes the record of a completed print
+    """
+
+    STATE_NAME = 'stream'
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, serialNumber):
+        r"""
+        __init__ Method
+
+        arguments:
+            serialNumber - printer serial number
+        """
+        self._serialNumber = serialNumber
+        self._record = loadPrinterState(serialNumber, StreamCheckpoint.STATE_NAME)
+
+        return
+
+    # *************************************************************************
+    #                        getResumeLine Method
+    # *************************************************************************
+    def getResumeLine(self, filePath):
+        r"""
+        Returns the number of lines of filePath executed by an interrupted print of the
+        same file, or 0 if the print must start from the beginning
+        """
+        if self._record.get('fingerprint') != _fileFingerprint(filePath):
+            return 0
+
+        return self._record.get('line', 0)
+
+    # *************************************************************************
+    #                        start Method
+    # *************************************************************************
+    def start(self, filePath, line=0):
+        r"""
+        Records the start of the streamed print of filePath from line
+        """
+        self._record = {
+            'fingerprint': _fileFingerprint(filePath),
+            'line': line,
+        }
+
+        return self._save()
+
+    # *************************************************************************
+    #                        update Method
+    # *************************************************************************
+    def update(self, line):
+        r"""
+        Records that the printer executed the lines of the file before line
+        """
+        if 'fingerprint' not in self._record or self._record.get('line') == line:
+            return False
+        self._record['line'] = line
+
+        return self._save()
+
+    # *************************************************************************
+    #                        finish Method
+    # *************************************************************************
+    def finish(self):
+        r"""
+        Removes the record of a completed print
+        """
+        if len(self._record) == 0:
+            return True
+        self._record = {}
+
+        return self._save()
+
+    def _save(self):
+        return savePrinterState(self._serialNumber, StreamCheckpoint.STATE_NAME, self._record)
+
+
+# *************************************************************************
+#                        hashStream Method
+# *************************************************************************
+def hashStream(fileObj, blockBytes):
+    r"""
+    hashStream method
+
+    Reads a file object to the end computing the SHA-1 of the whole content and of
+    each blockBytes block
+
+    returns:
+        (content hash, list with the block hashes, size in bytes)
+    """
+    contentHash = hashlib.sha1()
+    blockHashes = []
+    size = 0
+    while True:
+        block = fileObj.read(blockBytes)
+        if not block:
+            break
+        contentHash.update(block)
+        blockHashes.append(hashlib.sha1(block).hexdigest())
+        size += len(block)
+
+    return contentHash.hexdigest(), blockHashes, size
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import functools
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+# Commands that do not change the printer state, sending them keeps the cache
+READ_ONLY_COMMANDS = frozenset(['M625', 'M637', 'M105', 'M32', 'M115', 'M116', 'M1001', 'M1025', 'M1028', 'M1029'])
+# SD file transfer commands (init SD, create file, block header), they do not change
+# the state read by the queries
+TRANSFER_COMMANDS = frozenset(['M21', 'M30', 'M28'])
+
+
+class _Flight:
+    r"""
+        Query being executed, callers of the same query wait for its result
+    """
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class QueryCache:
+    r"""
+        QueryCache Class
+
+        Time to live cache of the results of the read only BeeCmd queries of a printer.
+        Any command that may change the printer state invalidates all the results. A
+        TTL of 0 (default) disables caching.
+
+        Concurrent calls of the same query are coalesced (single flight): the first
+        caller executes the query and the others wait for and share its result, as long
+        as no state changing command was sent since it started
+
+        __init__(ttl)                                           Initializes current class
+        setTTL(ttl, query)                                      Sets the TTL of all or one of the queries
+        getTTL(query)                                           Returns the TTL of a query
+        get(query, loader)                                      Returns the cached result or calls loader
+        invalidate(query)                                       Discards all or one of the results
+        commandSent(cmd)                                        Invalidates the cache if cmd changes the printer state
+    """
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, ttl=0, coalesce=True):
+        r"""
+        __init__ Method
+
+        arguments:
+            ttl - default time to live of the results in seconds
+            coalesce - if True concurrent calls of the same query share one execution
+        """
+        self._ttl = ttl
+        self._coalesce = coalesce
+        self._queryTTL = {}
+        self._entries = {}          # query -> (result, time)
+        self._inflight = {}         # query -> _Flight
+        self._generation = 0        # incremented by every invalidation
+        self._lock = threading.Lock()
+
+        return
+
+    # *************************************************************************
+    #                        setTTL Method
+    # *************************************************************************
+    def setTTL(self, ttl, query=None):
+        r"""
+        Sets the time to live in seconds of the results of query (BeeCmd method name)
+        or the default of all the queries if query is None
+        """
+        with self._lock:
+            if query is None:
+                self._ttl = ttl
+            else:
+                self._queryTTL[query] = ttl
+            self._entries.clear()
+
+        return
+
+    def getTTL(self, query):
+        return self._queryTTL.get(query, self._ttl)
+
+    # *************************************************************************
+    #                        get Method
+    # *************************************************************************
+    def get(self, query, loader):
+        r"""
+        get method
+
+        Returns the result of query if it is younger than its TTL, otherwise calls
+        loader() and caches what it returns. None results are not cached. If the same
+        query is already being executed waits for its result instead
+
+        arguments:
+            query - query name (BeeCmd method name)
+            loader - function that executes the query
+        """
+        ttl = self.getTTL(query)
+        if ttl <= 0 and not self._coalesce:
+            return loader()
+
+        with self._lock:
+            if ttl > 0:
+                entry = self._entries.get(query)
+                if entry is not None and time.time() - entry[1] < ttl:
+                    return entry[0]
+
+            flight = self._inflight.get(query) if self._coalesce else None
+            leader = flight is None or flight.generation != self._generation
+            if leader:
+                flight = _Flight(self._generation)
+                if self._coalesce:
+                    self._inflight[query] = flight
+
+        if not leader:
+            # Same query in flight, share its result
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        startTime = time.time()
+        try:
+            flight.result = loader()
+        except Exception as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(query) is flight:
+                    del self._inflight[query]
+                # A result read while a command changed the printer state may be stale
+                if ttl > 0 and flight.result is not None and flight.generation == self._generation:
+                    self._entries[query] = (flight.result, startTime)
+            flight.done.set()
+
+        return flight.result
+
+    # *************************************************************************
+    #                        invalidate Method
+    # *************************************************************************
+    def invalidate(self, query=None):
+        r"""
+        Discards the result of query or all the results if query is None
+        """
+        with self._lock:
+            if query is None:
+                self._entries.clear()
+                self._generation += 1
+            else:
+                self._entries.pop(query, None)
+
+        return
+
+    # *************************************************************************
+    #                        commandSent Method
+    # *************************************************************************
+    def commandSent(self, cmd):
+        r"""
+        Called for every command written to the printer, invalidates the cache unless
+        the command is in READ_ONLY_COMMANDS or TRANSFER_COMMANDS
+        """
+        if len(self._entries) == 0 and len(self._inflight) == 0:
+            return
+
+        code = commandCode(cmd)
+        if code not in READ_ONLY_COMMANDS and code not in TRANSFER_COMMANDS:
+            self.invalidate()
+
+        return
+
+
+# *************************************************************************
+#                        commandCode Method
+# *************************************************************************
+def commandCode(cmd):
+    r"""
+    Returns the upper case code of a command ('M625', 'G1'...) or '' if cmd is empty
+    """
+    code = str(cmd[:16]).split(None, 1)
+    if len(code) == 0:
+        return ''
+
+    return code[0].split(';')[0].upper()
+
+
+# *************************************************************************
+#                        cachedQuery Method
+# *************************************************************************
+def cachedQuery(method):
+    r"""
+    Decorator of the read only BeeCmd queries, serves their results from the
+    QueryCache of the connection
+    """
+    @functools.wraps(method)
+    def wrapper(self):
+        result = self._beeCon.getQueryCache().get(method.__name__, lambda: method(self))
+        if isinstance(result, dict):
+            # The cached dict is shared, callers get a copy
+            return dict(result)
+
+        return result
+
+    return wrapper
@@ -0,0 +1,667 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import re
+from array import array
+import usb
+import usb.core
+from beedriver import logger
+from beedriver import parsers
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+_BLANK_RE = re.compile(r'\s*\Z')
+_STATUS_RE = re.compile(r'(?<![A-Za-z])S:(\d+)')
+
+
+# *************************************************************************
+#                        _prefix Method
+# *************************************************************************
+def _prefix(data, n):
+    r"""
+    Returns a view of the first n bytes of data without copying them
+    """
+    if isinstance(data, array):
+        # arrays do not export memoryviews, use the old buffer interface
+        return buffer(data, 0, n)
+
+    return memoryview(data)[:n]
+
+
+class ReceiveBuffer:
+    r"""
+        ReceiveBuffer Class
+
+        Fixed capacity byte buffer used to store the data received from the printer.
+        The data is kept contiguous (the buffer is compacted when its end is reached)
+        so reply tokens are searched in place, without copying the buffered data
+
+        __init__(capacity)                                      Initializes current class
+        write(data, n)                                          Appends n bytes of data, returns the number of bytes stored
+        search(pattern, start)                                  Searches a compiled pattern in the buffered data
+        find(sub, start)                                        Finds a substring in the buffered data
+        isBlank(start, end)                                     Checks if a range only contains whitespace
+        peek(start, end)                                        Returns a copy of a range without removing it
+        consume(n)                                              Removes and returns up to n bytes
+        consumeInto(target)                                     Moves buffered bytes into a writable buffer
+        free()                                                  Returns the free space in the buffer
+    """
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, capacity=65536):
+        r"""
+        __init__ Method
+
+        Initializes this class
+
+        arguments:
+            capacity - buffer size in bytes
+        """
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._capacity = capacity
+        self._head = 0
+        self._tail = 0
+
+        return
+
+    def __len__(self):
+        return self._tail - self._head
+
+    # *************************************************************************
+    #                        free Method
+    # *************************************************************************
+    def free(self):
+        r"""
+        Returns the number of bytes that can still be written
+        """
+        return self._capacity - len(self)
+
+    # *************************************************************************
+    #                        write Method
+    # *************************************************************************
+    def write(self, data, n=None):
+        r"""
+        write method
+
+        Appends data to the buffer
+
+        arguments:
+            data - object supporting the buffer interface with the bytes to store
+            n - optional number of bytes of data to store (default all)
+
+        returns:
+            number of bytes stored (less than n if the buffer is full)
+        """
+        if n is None:
+            n = len(data)
+        n = min(n, self.free())
+        if self._tail + n > self._capacity:
+            self._compact()
+        self._buf[self._tail:self._tail + n] = _prefix(data, n)
+        self._tail += n
+
+        return n
+
+    # *************************************************************************
+    #                        _compact Method
+    # *************************************************************************
+    def _compact(self):
+        r"""
+        Moves the buffered data to the start of the buffer
+        """
+        size = len(self)
+        self._view[0:size] = self._view[self._head:self._tail]
+        self._head = 0
+        self._tail = size
+
+        return
+
+    # *************************************************************************
+    #                        search Method
+    # *************************************************************************
+    def search(self, pattern, start=0):
+        r"""
+        Searches a compiled pattern in the buffered data, starting at offset start
+
+        returns:
+            (start, end) offsets of the match or None
+        """
+        m = pattern.search(self._buf, self._head + start, self._tail)
+        if m is None:
+            return None
+
+        return m.start() - self._head, m.end() - self._head
+
+    # *************************************************************************
+    #                        find Method
+    # *************************************************************************
+    def find(self, sub, start=0):
+        r"""
+        Returns the offset of sub in the buffered data or -1
+        """
+        pos = self._buf.find(sub, self._head + start, self._tail)
+
+        return pos - self._head if pos >= 0 else -1
+
+    # *************************************************************************
+    #                        rfind Method
+    # *************************************************************************
+    def rfind(self, sub, start=0):
+        r"""
+        Returns the offset of the last occurrence of sub in the buffered data or -1
+        """
+        pos = self._buf.rfind(sub, self._head + start, self._tail)
+
+        return pos - self._head if pos >= 0 else -1
+
+    # *************************************************************************
+    #                        isBlank Method
+    # *************************************************************************
+    def isBlank(self, start, end):
+        r"""
+        Returns True if the buffered data between start and end is only whitespace
+        """
+        return _BLANK_RE.match(self._buf, self._head + start, self._head + end) is not None
+
+    # *************************************************************************
+    #                        peek Method
+    # *************************************************************************
+    def peek(self, start, end):
+        r"""
+        Returns the buffered data between start and end as a string, keeping it in the buffer
+        """
+        return self._view[self._head + start:self._head + end].tobytes()
+
+    # *************************************************************************
+    #                        consume Method
+    # *************************************************************************
+    def consume(self, n=None):
+        r"""
+        Removes and returns up to n bytes (all if n is None) from the buffer as a string.
+        This is the only copy made of a reply frame
+        """
+        if n is None or n > len(self):
+            n = len(self)
+        data = self._view[self._head:self._head + n].tobytes()
+        self._advance(n)
+
+        return data
+
+    # *************************************************************************
+    #                        consumeInto Method
+    # *************************************************************************
+    def consumeInto(self, target, offset=0):
+        r"""
+        Moves up to len(target) - offset bytes to the writable buffer target
+
+        returns:
+            number of bytes moved
+        """
+        n = min(len(target) - offset, len(self))
+        target[offset:offset + n] = self._view[self._head:self._head + n]
+        self._advance(n)
+
+        return n
+
+    def _advance(self, n):
+        self._head += n
+        if self._head == self._tail:
+            # Empty, restart at the beginning to avoid compacting
+            self._head = 0
+            self._tail = 0
+
+        return
+
+
+class ReplyRequest:
+    r"""
+        ReplyRequest Class
+
+        Pending reply registered in the reader thread. The request is completed with the
+        first frame that contains one of its tokens.
+    """
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, tokens=None):
+        r"""
+        __init__ Method
+
+        arguments:
+            tokens - list of strings that end the reply frame. None waits for the
+                     firmware acknowledge line ("ok")
+        """
+        if tokens is not None:
+            tokens = [re.compile(re.escape(t), re.IGNORECASE) for t in tokens]
+        self.tokens = tokens
+        self.frame = None
+        self.cancelled = False
+        self.scanFrom = 0
+
+        return
+
+    # *************************************************************************
+    #                        findFrameEnd Method
+    # *************************************************************************
+    def findFrameEnd(self, rbuf):
+        r"""
+        Returns the position where this request's frame ends in the ReceiveBuffer
+        rbuf or -1 if the frame is not complete yet. Lines already searched are not
+        searched again on the next call
+        """
+        start = self.scanFrom
+        end = -1
+        if self.tokens is None:
+            m = rbuf.search(parsers.REPLY_FRAME_RE, start)
+            if m is not None:
+                end = m[1]
+        else:
+            for token in self.tokens:
+                m = rbuf.search(token, start)
+                if m is None:
+                    continue
+                eol = rbuf.find('\n', m[1])
+                pos = eol + 1 if eol >= 0 else len(rbuf)
+                if end < 0 or pos < end:
+                    end = pos
+
+            if end >= 0:
+                # If the acknowledge line that closes the reply was already received it
+                # belongs to this frame, otherwise it would be taken as the next reply
+                m = rbuf.search(parsers.REPLY_FRAME_RE, end)
+                if m is not None and rbuf.isBlank(end, m[0]):
+                    end = m[1]
+
+        if end < 0:
+            # Tokens never span lines, resume the search at the last incomplete line
+            eol = rbuf.rfind('\n', start)
+            if eol >= 0:
+                self.scanFrom = eol + 1
+
+        return end
+
+
+class ReaderThread(threading.Thread):
+    r"""
+        ReaderThread Class
+
+        Background thread that drains the printer IN endpoint into a receive buffer and
+        hands each reply frame to the request waiting for it. USB reads go to a
+        preallocated buffer and frames are decoded once, when they are complete
+
+        __init__(connection)                                    Initializes current class
+        register(tokens)                                        Registers a pending reply request
+        waitReply(request, timeout)                             Waits for the frame of a registered request
+        cancel(request)                                         Removes a pending request
+        pendingCount()                                          Returns the number of pending requests
+        readAvailable(timeout)                                  Returns all data not claimed by a request
+        readBytes(n, timeout)                                   Returns n raw bytes
+        readInto(target, timeout)                               Fills a writable buffer with raw bytes
+        getStatusSequence()                                     Returns the number of status lines received and the last status
+        waitStatus(sequence, timeout)                           Waits for a status line after sequence
+        stop()                                                  Stops the reader thread
+    """
+
+    READ_LENGTH = 512
+    POLL_TIMEOUT = 100          # ms, USB read timeout between stop flag checks
+    BUFFER_SIZE = 65536
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, connection):
+        r"""
+        __init__ Method
+
+        Initializes this class
+
+        arguments:
+            connection - Conn object with the endpoint to read from
+        """
+        super(ReaderThread, self).__init__(name="bee_connection._reader_thread")
+        self.daemon = True
+
+        self._ep_in = connection.ep_in
+        self._recv = ReceiveBuffer(ReaderThread.BUFFER_SIZE)
+        self._readBuf = array('B', [0]) * ReaderThread.READ_LENGTH
+        self._pending = []
+        self._cond = threading.Condition()
+        self._running = True
+        self._statusSequence = 0
+        self._lastStatus = None
+
+        return
+
+    def run(self):
+
+        while self._running:
+            try:
+                count = self._ep_in.read(self._readBuf, ReaderThread.POLL_TIMEOUT)
+            except usb.core.USBError as e:
+                if getattr(e, 'errno', None) == 110 or 'timed out' in str(e).lower():
+                    continue
+                logger.error("USB reader thread exception: %s", str(e))
+                time.sleep(0.1)
+                continue
+            except Exception as ex:
+                logger.error("Reader thread error - Connection lost: " + str(ex))
+                time.sleep(0.1)
+                continue
+
+            if count == 0:
+                continue
+
+            with self._cond:
+                offset = 0
+                while offset < count and self._running:
+                    received = len(self._recv)
+                    if offset == 0:
+                        offset = self._recv.write(self._readBuf, count)
+                    else:
+                        offset += self._recv.write(self._readBuf[offset:count])
+                    self._scanStatus(received)
+                    self._dispatchFrames()
+                    self._cond.notify_all()
+                    if offset < count:
+                        # Buffer full, wait for the consumers
+                        self._cond.wait(0.1)
+
+        with self._cond:
+            self._cond.notify_all()
+
+        return
+
+    # *************************************************************************
+    #                        stop Method
+    # *************************************************************************
+    def stop(self):
+        r"""
+        Stops the reader thread
+        """
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+
+        return
+
+    # *************************************************************************
+    #                        _scanStatus Method
+    # *************************************************************************
+    def _scanStatus(self, start):
+        r"""
+        Records the status lines ("S:n") in the data received from offset start, both
+        replies and unsolicited output. Must be called with the condition acquired
+        """
+        # A status split by the previous read is still in the buffer
+        start = max(0, start - 3)
+        while True:
+            m = self._recv.search(_STATUS_RE, start)
+            if m is None:
+                return
+            if m[1] == len(self._recv):
+                # The status code may continue in the next read
+                return
+            self._lastStatus = self._recv.peek(m[0] + 2, m[1])
+            self._statusSequence += 1
+            start = m[1]
+
+    # *************************************************************************
+    #                        _dispatchFrames Method
+    # *************************************************************************
+    def _dispatchFrames(self):
+        r"""
+        Hands complete frames to the pending requests, in order. Must be called with
+        the condition acquired
+        """
+        while len(self._pending) > 0 and len(self._recv) > 0:
+            req = self._pending[0]
+            end = req.findFrameEnd(self._recv)
+            if end < 0:
+                return
+            req.frame = self._recv.consume(end)
+            self._pending.pop(0)
+
+        return
+
+    # *************************************************************************
+    #                        register Method
+    # *************************************************************************
+    def register(self, tokens=None):
+        r"""
+        register method
+
+        Registers a pending reply. Requests are served in registration order so the
+        request must be registered before the command is written
+
+        arguments:
+            tokens - optional list of strings that end the reply (default waits for "ok")
+
+        returns:
+            ReplyRequest object
+        """
+        req = ReplyRequest(tokens)
+        with self._cond:
+            self._pending.append(req)
+            self._dispatchFrames()
+
+        return req
+
+    # *************************************************************************
+    #                        waitReply Method
+    # *************************************************************************
+    def waitReply(self, req, timeout=None):
+        r"""
+        waitReply method
+
+        Blocks until the request frame is received
+
+        arguments:
+            req - ReplyRequest returned by register
+            timeout - optional timeout in seconds
+
+        returns:
+            frame string or None if the timeout expired
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while req.frame is None:
+                if deadline is None:
+                    self._cond.wait(1)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+
+        return req.frame
+
+    # *************************************************************************
+    #                        cancel Method
+    # *************************************************************************
+    def cancel(self, req):
+        r"""
+        cancel method
+
+        Removes a request that timed out. If it was the first pending request the
+        data received so far for it is removed from the buffer and returned
+        """
+        partial = ""
+        with self._cond:
+            if req in self._pending:
+                if self._pending[0] is req:
+                    partial = self._recv.consume()
+                self._pending.remove(req)
+                req.cancelled = True
+                self._dispatchFrames()
+            self._cond.notify_all()
+
+        return partial
+
+    # *************************************************************************
+    #                        pendingCount Method
+    # *************************************************************************
+    def pendingCount(self):
+        r"""
+        Returns the number of requests waiting for a reply
+        """
+        with self._cond:
+            return len(self._pending)
+
+    # *************************************************************************
+    #                        waitPendingBelow Method
+    # *************************************************************************
+    def waitPendingBelow(self, n, timeout=None):
+        r"""
+        Blocks until fewer than n requests are pending
+
+        returns:
+            True if the condition was met, False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while len(self._pending) >= n:
+                remaining = 1 if deadline is None else deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+        return True
+
+    # *************************************************************************
+    #                        readAvailable Method
+    # *************************************************************************
+    def readAvailable(self, timeout=None):
+        r"""
+        readAvailable method
+
+        Returns the data received that is not claimed by a pending request. Waits up to
+        timeout seconds for data to arrive
+
+        returns:
+            string with data read (empty string on timeout)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while len(self._pending) > 0 or len(self._recv) == 0:
+                remaining = 1 if deadline is None else deadline - time.time()
+                if remaining <= 0:
+                    return ""
+                self._cond.wait(remaining)
+
+            data = self._recv.consume()
+            self._cond.notify_all()
+
+        return data
+
+    # *************************************************************************
+    #                        readBytes Method
+    # *************************************************************************
+    def readBytes(self, n, timeout=None):
+        r"""
+        readBytes method
+
+        Returns exactly n raw bytes from the stream (less if the timeout expires)
+
+        returns:
+            bytearray with the data read
+        """
+        data = bytearray(n)
+        count = self.readInto(data, timeout)
+        if count < n:
+            del data[count:]
+
+        return data
+
+    # *************************************************************************
+    #                        readInto Method
+    # *************************************************************************
+    def readInto(self, target, timeout=None):
+        r"""
+        readInto method
+
+        Fills the writable buffer target (bytearray or memoryview) with raw bytes from
+        the stream, without intermediate copies
+
+        returns:
+            number of bytes stored in target (less than len(target) if the timeout expires)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        count = 0
+        with self._cond:
+            while count < len(target):
+                count += self._recv.consumeInto(target, count)
+                self._resetScan()
+                self._cond.notify_all()
+                if count == len(target) or not self._running:
+                    break
+                remaining = 1 if deadline is None else deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+        return count
+
+    # *************************************************************************
+    #                        getStatusSequence Method
+    # *************************************************************************
+    def getStatusSequence(self):
+        r"""
+        Returns a tuple with the number of status lines received so far and the last
+        status code (string) or None
+        """
+        with self._cond:
+            return self._statusSequence, self._lastStatus
+
+    # *************************************************************************
+    #                        waitStatus Method
+    # *************************************************************************
+    def waitStatus(self, sequence, timeout):
+        r"""
+        waitStatus method
+
+        Blocks until a status line is received after the one numbered sequence
+
+        returns:
+            tuple (sequence, status) of the last status line received, unchanged on timeout
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._statusSequence == sequence and self._running:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            return self._statusSequence, self._lastStatus
+
+    # *************************************************************************
+    #                        _resetScan Method
+    # *************************************************************************
+    def _resetScan(self):
+        r"""
+        Restarts the token search of the first pending request after data was taken
+        from the head of the buffer. Must be called with the condition acquired
+        """
+        if len(self._pending) > 0:
+            self._pending[0].scanFrom = 0
+
+        return
@@ -0,0 +1,642 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import math
+import random
+import re
+import collections
+from array import array
+import usb
+import usb.core
+from beedriver import logger
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class PrinterSimulator:
+    r"""
+        PrinterSimulator Class
+
+        Simulated BEETHEFIRST printer used when the connection is in dummy plug mode.
+        It implements the firmware and bootloader protocol used by the driver: printer
+        status, SD card file store with M28 block transfers, print progress, heater
+        thermal model, filament and nozzle settings, status logs and the bootloader
+        echo used to flash firmware.
+
+        G0/G1 moves are buffered in a QUEUE_SIZE move queue whose depth is reported in
+        the "ok Q:n" replies; when it is full the reply is delayed until a move ends.
+        Extruding moves take the time of a print line, other moves MOVE_TIME.
+
+        The link can be degraded with a latency (seconds per reply), a bandwidth
+        (bytes/second) and an error rate (probability of losing a reply). timeScale
+        speeds up the simulated physical processes (heating, moves, printing).
+
+        __init__(...)                                           Initializes current class
+        getEndpoints()                                          Returns the (OUT, IN) simulated USB endpoints
+        receive(data)                                           Processes data written by the host
+        transmit(size, timeout)                                 Returns data to be read by the host
+        getStatusCode()                                         Returns the current status code (S:n)
+        getNozzleTemperature()                                  Returns the simulated nozzle temperature
+    """
+
+    # Status codes reported by M625
+    STATUS_READY = 3
+    STATUS_MOVING = 4
+    STATUS_PRINTING = 5
+    STATUS_TRANSFER = 6
+    STATUS_PAUSE = 7
+    STATUS_SHUTDOWN = 9
+
+    AMBIENT_TEMPERATURE = 25.0
+    HEATER_TIME_CONSTANT = 40.0     # seconds, first order thermal model
+    MOVE_TIME = 0.5                 # seconds for a move or homing
+    LOAD_TIME = 3.0                 # seconds for load/unload operations
+    QUEUE_SIZE = 8                  # moves buffered by the firmware, reported in "ok Q:n"
+    BLOCK_TIMEOUT = 1.0             # seconds without data before an M28 block is abandoned
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, latency=0.0, bandwidth=None, errorRate=0.0, timeScale=1.0, linesPerSecond=50.0,
+                 serialNumber='0000000003', product='BEETHEFIRST PLUS',
+                 firmwareString='BEEVC-BEETHEFIRST-10.4.0', seed=None):
+        r"""
+        __init__ Method
+
+        arguments:
+            latency - delay in seconds before each reply can be read
+            bandwidth - optional link bandwidth in bytes/second (None = unlimited)
+            errorRate - probability of losing a reply frame or corrupting a firmware echo
+            timeScale - speed factor applied to heating, moves and print progress
+            linesPerSecond - gcode lines executed per second while printing
+            serialNumber - serial number reported in the printer list
+            product - printer name reported in the printer list
+            firmwareString - firmware version string
+            seed - optional random seed for the error model
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.errorRate = errorRate
+        self.timeScale = timeScale
+        self.linesPerSecond = linesPerSecond
+        self.serialNumber = serialNumber
+        self.product = product
+
+        self._random = random.Random(seed)
+        self._lock = threading.Condition()
+        self._outQueue = []             # list of [readyTime, bytearray]
+
+        self._t0 = time.time()
+
+        # Printer state
+        self.mode = 'Firmware'
+        self.firmwareString = firmwareString
+        self.firmwareImage = None
+        self.sdFiles = {}
+        self._currentFile = None
+
+        self._temperature = PrinterSimulator.AMBIENT_TEMPERATURE
+        self._targetTemperature = 0.0
+        self._lastThermalUpdate = self._clock()
+
+        self._busyUntil = 0.0
+        self._moves = collections.deque()   # end times of the buffered moves
+        self._paused = False
+        self._shutdown = False
+
+        self._printFile = None          # last print job
+        self._printing = False
+        self._printLines = 0
+        self._printStart = 0.0
+        self._printOffset = 0.0         # executed lines before the last pause
+        self._printLineRate = 0.0
+
+        self.filamentString = 'A023 - Black'
+        self.filamentInSpool = 350.0
+        self.nozzleSize = 400
+        self.blowerSpeed = 0
+
+        # Raw data modes: M28 block transfer and firmware flash echo
+        self._blockRemaining = 0
+        self._blockPos = 0
+        self._blockDeadline = 0.0
+        self._flashRemaining = 0
+        self._flashData = None
+
+        self._lineBuffer = ''
+
+        return
+
+    # *************************************************************************
+    #                        getEndpoints Method
+    # *************************************************************************
+    def getEndpoints(self):
+        r"""
+        Returns the simulated (OUT, IN) endpoints
+        """
+        return SimulatedEndpointOut(self), SimulatedEndpointIn(self)
+
+    def _clock(self):
+        return (time.time() - self._t0) * self.timeScale
+
+    # *************************************************************************
+    #                        receive Method
+    # *************************************************************************
+    def receive(self, data):
+        r"""
+        receive method
+
+        Processes a USB message written by the host
+
+        arguments:
+            data - message bytes
+
+        returns:
+            number of bytes accepted
+        """
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+
+        if self.bandwidth:
+            time.sleep(len(data) / float(self.bandwidth))
+
+        with self._lock:
+            if self._blockRemaining > 0 and time.time() > self._blockDeadline:
+                logger.debug('Simulator: block transfer timed out')
+                self._blockRemaining = 0
+
+            if self._flashRemaining > 0:
+                self._receiveFlash(data)
+            elif self._blockRemaining > 0:
+                self._receiveBlock(data)
+            else:
+                self._lineBuffer += str(data)
+                while '\n' in self._lineBuffer:
+                    line, self._lineBuffer = self._lineBuffer.split('\n', 1)
+                    self._processLine(line)
+
+        return len(data)
+
+    # *************************************************************************
+    #                        transmit Method
+    # *************************************************************************
+    def transmit(self, size, timeout):
+        r"""
+        transmit method
+
+        Returns up to size bytes of reply data, waiting up to timeout ms
+
+        raises usb.core.USBError on timeout
+        """
+        deadline = time.time() + timeout / 1000.0
+        with self._lock:
+            while True:
+                now = time.time()
+                if len(self._outQueue) > 0 and self._outQueue[0][0] <= now:
+                    item = self._outQueue[0]
+                    data = item[1][:size]
+                    item[1] = item[1][size:]
+                    if len(item[1]) == 0:
+                        self._outQueue.pop(0)
+                    break
+
+                if now >= deadline:
+                    raise usb.core.USBError('Operation timed out')
+
+                wait = deadline - now
+                if len(self._outQueue) > 0:
+                    wait = min(wait, self._outQueue[0][0] - now)
+                self._lock.wait(wait)
+
+        if self.bandwidth:
+            time.sleep(len(data) / float(self.bandwidth))
+
+        return array('B', data)
+
+    # *************************************************************************
+    #                        _reply Method
+    # *************************************************************************
+    def _reply(self, text, ack=True, lossy=True, delay=0.0):
+        r"""
+        Queues a reply frame, applying the latency and error model
+        """
+        if ack:
+            text += 'ok Q:%d\n' % min(self._queueDepth(), PrinterSimulator.QUEUE_SIZE)
+
+        if lossy and self.errorRate > 0 and self._random.random() < self.errorRate:
+            logger.debug('Simulator: reply lost')
+            return
+
+        self._outQueue.append([time.time() + self.latency + delay, bytearray(text)])
+        self._lock.notify_all()
+
+    # *************************************************************************
+    #                        _receiveBlock Method
+    # *************************************************************************
+    def _receiveBlock(self, data):
+        r"""
+        Stores a message of the current M28 block in the SD file
+        """
+        data = data[:self._blockRemaining]
+        f = self.sdFiles[self._currentFile]
+        f[self._blockPos:self._blockPos + len(data)] = data
+        self._blockPos += len(data)
+        if self._printing and self._currentFile == self._printFile:
+            # Lines appended to the file being printed (print while uploading)
+            self._printLines += bytes(data).count(b'\n')
+        self._blockRemaining -= len(data)
+        self._blockDeadline = time.time() + PrinterSimulator.BLOCK_TIMEOUT
+        self._reply('tog\n', ack=False)
+
+    # *************************************************************************
+    #                        _receiveFlash Method
+    # *************************************************************************
+    def _receiveFlash(self, data):
+        r"""
+        Echoes firmware data back to the host as the bootloader does
+        """
+        data = bytearray(data[:self._flashRemaining])
+        self._flashData += data
+        self._flashRemaining -= len(data)
+
+        echo = bytearray(data)
+        if self.errorRate > 0 and self._random.random() < self.errorRate and len(echo) > 0:
+            echo[0] ^= 0xFF
+        self._outQueue.append([time.time() + self.latency, echo])
+        self._lock.notify_all()
+
+        if self._flashRemaining == 0:
+            self.firmwareImage = bytes(self._flashData)
+            self._flashData = None
+
+    # *************************************************************************
+    #                        _updateState Method
+    # *************************************************************************
+    def _updateState(self):
+        r"""
+        Advances the thermal model and the print progress to the current time
+        """
+        now = self._clock()
+        dt = now - self._lastThermalUpdate
+        self._lastThermalUpdate = now
+
+        target = self._targetTemperature
+        if target <= 0:
+            target = PrinterSimulator.AMBIENT_TEMPERATURE
+        self._temperature = target + (self._temperature - target) * \
+            math.exp(-dt / PrinterSimulator.HEATER_TIME_CONSTANT)
+
+        if self._printing and self._executedLines(now) >= self._printLines:
+            logger.debug('Simulator: print finished')
+            self._printing = False
+
+    def _executedLines(self, now=None):
+        if self._printFile is None:
+            return 0
+        if not self._printing:
+            return self._printLines
+        if now is None:
+            now = self._clock()
+        if self._paused or self._shutdown:
+            return int(self._printOffset)
+        return min(self._printLines, int(self._printOffset + (now - self._printStart) * self._printLineRate))
+
+    # *************************************************************************
+    #                        getStatusCode Method
+    # *************************************************************************
+    def getStatusCode(self):
+        r"""
+        Returns the current status code reported by M625
+        """
+        if self._shutdown:
+            return PrinterSimulator.STATUS_SHUTDOWN
+        if self._paused:
+            return PrinterSimulator.STATUS_PAUSE
+        if self._blockRemaining > 0:
+            return PrinterSimulator.STATUS_TRANSFER
+        if self._printing:
+            return PrinterSimulator.STATUS_PRINTING
+        if self._clock() < self._busyUntil:
+            return PrinterSimulator.STATUS_MOVING
+
+        return PrinterSimulator.STATUS_READY
+
+    # *************************************************************************
+    #                        getNozzleTemperature Method
+    # *************************************************************************
+    def getNozzleTemperature(self):
+        r"""
+        Returns the simulated nozzle temperature
+        """
+        with self._lock:
+            self._updateState()
+            return self._temperature
+
+    def _busy(self, duration):
+        self._busyUntil = max(self._busyUntil, self._clock()) + duration
+
+    def _queueDepth(self):
+        now = self._clock()
+        while len(self._moves) > 0 and self._moves[0] <= now:
+            self._moves.popleft()
+
+        return len(self._moves)
+
+    def _queueMove(self, duration):
+        r"""
+        Buffers a move, returns the seconds until the firmware accepts it (queue full)
+        """
+        wait = 0.0
+        if self._queueDepth() >= PrinterSimulator.QUEUE_SIZE:
+            wait = (self._moves[-PrinterSimulator.QUEUE_SIZE] - self._clock()) / self.timeScale
+        self._busy(duration)
+        self._moves.append(self._busyUntil)
+
+        return wait
+
+    # *************************************************************************
+    #                        _processLine Method
+    # *************************************************************************
+    def _processLine(self, line):
+        r"""
+        Executes a command line and queues the reply
+        """
+        line = line.split(';')[0].strip()
+        self._updateState()
+
+        if line == '':
+            self._reply('')
+            return
+
+        code = line.split(' ')[0].upper()
+        args = {}
+        for m in re.finditer(r'([A-Z])([-+]?[0-9]*\.?[0-9]*)', line[len(code):]):
+            args[m.group(1)] = m.group(2)
+        rest = line[len(code):].strip()
+
+        if self.mode == 'Bootloader':
+            self._processBootloaderLine(code, args, rest)
+            return
+
+        if code == 'M625' or code == 'M637':
+            status = self.getStatusCode()
+            text = 'S:%d' % status
+            if status == PrinterSimulator.STATUS_PAUSE:
+                # Once paused the motion is over and the printer accepts commands
+                text = 'S:%d Pause' % PrinterSimulator.STATUS_READY
+            elif status == PrinterSimulator.STATUS_SHUTDOWN:
+                text = 'S:%d Shutdown' % PrinterSimulator.STATUS_SHUTDOWN
+            self._reply(text + '\n')
+
+        elif code == 'M105':
+            self._reply('T:%.1f B:%.1f R:%.1f\n' % (self._temperature, PrinterSimulator.AMBIENT_TEMPERATURE,
+                                                    self._targetTemperature))
+
+        elif code in ('M104', 'M703') and 'S' in args:
+            self._targetTemperature = float(args['S'])
+            self._reply('')
+
+        elif code == 'M703':
+            # Go to load/unload position
+            self._busy(PrinterSimulator.MOVE_TIME)
+            self._reply('')
+
+        elif code == 'M704':
+            self._targetTemperature = 0.0
+            self._reply('')
+
+        elif code == 'G0' or code == 'G1':
+            duration = PrinterSimulator.MOVE_TIME
+            if 'E' in args and self.linesPerSecond > 0:
+                duration = 1.0 / self.linesPerSecond
+            wait = self._queueMove(duration)
+            self._reply('', delay=wait)
+
+        elif code == 'G28' or code == 'G131' or code == 'G132':
+            self._busy(PrinterSimulator.MOVE_TIME)
+            self._reply('')
+
+        elif code == 'M701' or code == 'M702':
+            self._busy(PrinterSimulator.LOAD_TIME)
+            self._reply('')
+
+        elif code == 'M21':
+            self._reply('SD card ok\n')
+
+        elif code == 'M20':
+            text = 'Begin file list\n'
+            for name in sorted(self.sdFiles.keys()):
+                text += '/%s\r\n' % name
+            text += 'End file list\n'
+            self._reply(text)
+
+        elif code == 'M30':
+            name = rest[:8]
+            self.sdFiles[name] = bytearray()
+            self._currentFile = name
+            self._reply('File created\n')
+
+        elif code == 'M23':
+            if rest in self.sdFiles:
+                self._currentFile = rest
+                self._reply('File opened: %s Size: %d\nFile selected\n' % (rest, len(self.sdFiles[rest])))
+            else:
+                self._reply('open failed, File: %s.\n' % rest)
+
+        elif code == 'M28':
+            start = int(args.get('A', 0))
+            end = int(args.get('D', -1))
+            if self._currentFile is None or end < start:
+                self._reply('Error: no file opened\n')
+                return
+            f = self.sdFiles[self._currentFile]
+            if len(f) < end + 1:
+                f.extend(bytearray(end + 1 - len(f)))
+            self._blockPos = start
+            self._blockRemaining = end - start + 1
+            self._blockDeadline = time.time() + PrinterSimulator.BLOCK_TIMEOUT
+            self._reply('', lossy=False)
+
+        elif code == 'M33':
+            name = rest if rest != '' else self._currentFile
+            if name in self.sdFiles:
+                self._printFile = name
+                self._printing = True
+                self._printLines = self.sdFiles[name].count(b'\n')
+                self._printStart = self._clock()
+                self._printOffset = 0.0
+                self._printLineRate = self.linesPerSecond
+                self._paused = False
+                self._shutdown = False
+            self._reply('')
+
+        elif code == 'M32':
+            executed = self._executedLines()
+            elapsed = 0
+            if self._printing:
+                elapsed = int((self._clock() - self._printStart) * 1000)
+            estimated = 0
+            if self._printLineRate > 0:
+                estimated = int(self._printLines / self._printLineRate / 60)
+            self._reply('A%d B%d C%d D%d \n' % (estimated, elapsed, self._printLines, executed))
+
+        elif code == 'M34':
+            if self._currentFile is not None:
+                self._reply(str(self.sdFiles[self._currentFile]))
+            else:
+                self._reply('')
+
+        elif code == 'M640':
+            if self._printing and not self._paused:
+                self._printOffset = self._executedLines()
+                self._paused = True
+                self._busy(PrinterSimulator.MOVE_TIME)
+            self._reply('')
+
+        elif code == 'M643':
+            if self._printing:
+                self._printStart = self._clock()
+            self._paused = False
+            self._shutdown = False
+            self._reply('')
+
+        elif code == 'M36':
+            self._shutdown = True
+            self._targetTemperature = 0.0
+            self._reply('')
+
+        elif code == 'M505':
+            self._shutdown = False
+            self._paused = False
+            self._printing = False
+            self._reply('')
+
+        elif code == 'M112':
+            self._moves.clear()
+            self._busyUntil = self._clock()
+            self._printing = False
+            self._paused = False
+            self._targetTemperature = 0.0
+            self._busy(PrinterSimulator.MOVE_TIME)
+            self._reply('')
+
+        elif code == 'M115':
+            self._reply('%s\n' % self.firmwareString)
+
+        elif code == 'M116':
+            self._reply('Bad M-code 116\n')
+
+        elif code == 'M1000':
+            self.filamentString = rest
+            self._reply('')
+
+        elif code == 'M1001':
+            self._reply("Filament: '%s'\n" % self.filamentString)
+
+        elif code == 'M1024':
+            self.filamentInSpool = float(args.get('X', self.filamentInSpool))
+            self._reply('')
+
+        elif code == 'M1025':
+            self._reply('Filament in Spool: %.2f\n' % self.filamentInSpool)
+
+        elif code == 'M1027':
+            self.nozzleSize = int(args.get('S', self.nozzleSize))
+            self._reply('')
+
+        elif code == 'M1028':
+            self._reply('Nozzle Size:%d\n' % self.nozzleSize)
+
+        elif code == 'M1029':
+            self._reply('%.2f %.2f %.2f 1.00 0.10 0.50 0.00 0.00 0.00 %.2f %d %d %.2f\n' %
+                        (self._temperature, self._targetTemperature,
+                         50.0 if self._targetTemperature > 0 else 0.0,
+                         PrinterSimulator.AMBIENT_TEMPERATURE, 0, self.blowerSpeed, 0.0))
+
+        elif code == 'M106':
+            self.blowerSpeed = int(args.get('S', 0))
+            self._reply('')
+
+        elif code == 'M609':
+            self._reply('')
+            self.mode = 'Bootloader'
+
+        elif code == 'M630':
+            self._reply('')
+
+        else:
+            # G90, G91, M206, M300 and any other command
+            self._reply('')
+
+    # *************************************************************************
+    #                        _processBootloaderLine Method
+    # *************************************************************************
+    def _processBootloaderLine(self, code, args, rest):
+        r"""
+        Executes a command line in bootloader mode
+        """
+        if code == 'M630':
+            self._reply('')
+            self.mode = 'Firmware'
+        elif code == 'M609' or code == 'M637':
+            self._reply('')
+        elif code == 'M115':
+            self._reply('ok %s\n' % self.firmwareString, ack=False)
+        elif code == 'M116':
+            self._reply('BEEVC-BOOTLOADER-1.0\n')
+        elif code == 'M114':
+            self.firmwareString = rest[1:] if rest.startswith('A') else rest
+            self._reply('')
+        elif code == 'M650':
+            self._flashRemaining = int(args.get('A', 0))
+            self._flashData = bytearray()
+            self._reply('', lossy=False)
+        else:
+            self._reply('Bad M-code %s\n' % code[1:])
+
+
+class SimulatedEndpointOut:
+    r"""
+        Simulated USB OUT endpoint
+    """
+
+    def __init__(self, simulator):
+        self._simulator = simulator
+        self.device = None
+
+    def write(self, data, timeout=None):
+        return self._simulator.receive(data)
+
+
+class SimulatedEndpointIn:
+    r"""
+        Simulated USB IN endpoint
+    """
+
+    def __init__(self, simulator):
+        self._simulator = simulator
+        self.device = None
+
+    def read(self, size_or_buffer, timeout=None):
+        if timeout is None:
+            timeout = 1000
+        if isinstance(size_or_buffer, array):
+            # Same as pyusb, fill the buffer and return the number of bytes read
+            data = self._simulator.transmit(len(size_or_buffer), timeout)
+            size_or_buffer[0:len(data)] = data
+            return len(data)
+        return self._simulator.transmit(size_or_buffer, timeout)
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+
+import re
+import threading
+import time
+import collections
+from beedriver import logger
+from beedriver import parsers
+from beedriver import printerStore
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+_WORD_RE = re.compile(r'([A-Z])\s*([-+]?[0-9]*\.?[0-9]*)')
+
+
+class ModalState:
+    r"""
+        ModalState Class
+
+        Modal state set by the lines of a G-code file: positioning mode (G90/G91),
+        extruder mode (M82/M83), extruder position and feedrate. It is rebuilt from the
+        lines skipped when a print is resumed from a checkpoint
+
+        update(cmd)                                             Updates the state with a line of the file
+        getCommands()                                           Returns the commands that restore the state
+    """
+
+    def __init__(self):
+        self.absolute = True            # G90/G91
+        self.relativeExtruder = False   # M83
+        self.extruder = 0.0             # extruder position
+        self.feedrate = None            # last F word, as written in the file
+
+    # *************************************************************************
+    #                        update Method
+    # *************************************************************************
+    def update(self, cmd):
+        r"""
+        Updates the state with a line of the file, without its comment
+        """
+        words = _WORD_RE.findall(cmd.split('*')[0].upper())
+        if len(words) > 0 and words[0][0] == 'N':
+            words = words[1:]
+        if len(words) == 0:
+            return
+
+        code = words[0][0] + words[0][1]
+        if code in ('G90', 'G91'):
+            self.absolute = code == 'G90'
+        elif code in ('M82', 'M83'):
+            self.relativeExtruder = code == 'M83'
+        elif code == 'G92':
+            axes = dict(words[1:])
+            if len(axes) == 0:
+                self.extruder = 0.0
+            elif 'E' in axes:
+                self.extruder = float(axes['E'] or 0)
+        elif code in ('G0', 'G1', 'G2', 'G3'):
+            for word, value in words[1:]:
+                if value == '':
+                    continue
+                if word == 'F':
+                    self.feedrate = value
+                elif word == 'E':
+                    # As Marlin, G91 also makes the extruder relative
+                    if self.relativeExtruder or not self.absolute:
+                        self.extruder += float(value)
+                    else:
+                        self.extruder = float(value)
+
+        return
+
+    # *************************************************************************
+    #                        getCommands Method
+    # *************************************************************************
+    def getCommands(self):
+        r"""
+        Returns the list of commands that set the state in the printer
+        """
+        commands = [
+            'G90' if self.absolute else 'G91',
+            'M83' if self.relativeExtruder else 'M82',
+            'G92 E%.5f' % self.extruder,
+        ]
+        if self.feedrate is not None:
+            commands.append('G1 F%s' % self.feedrate)
+
+        return commands
+
+
+class HostStreamThread(threading.Thread):
+    r"""
+        HostStreamThread Class
+
+        Prints a local G-code file by sending its lines over USB, without storing it in
+        the SD card. Lines are sent ahead of the firmware acknowledgements, up to window
+        lines or the free slots of the firmware queue ("ok Q:n"), whichever is lower.
+        The number of lines executed by the printer is stored in a
+        printerStore.StreamCheckpoint so an interrupted print can be streamed again from
+        that line, the modal state set by the skipped lines (ModalState) is sent before it
+
+        __init__(connection, filePath, temperature, startLine, window)  Initializes current class
+        pause(wait, timeout)                                    Stops sending lines
+        resume()                                                Continues a paused print
+        cancel(keepCheckpoint)                                  Cancels the print
+        getState()                                              Returns the state of the print
+        getProgress()                                           Returns the line counters of the print
+        waitFinished(timeout)                                   Waits until the print ends
+    """
+
+    WINDOW = 4                  # lines sent ahead of the firmware acknowledgements
+    CHECKPOINT_INTERVAL = 2     # seconds between checkpoint updates
+    STATUS_POLL = 0.5           # seconds between status polls while heating or draining the queue
+    HEATING_MARGIN = 5          # degrees the setpoint is above the print temperature
+
+    # Print states
+    STATE_STARTING = 'Starting'
+    STATE_HEATING = 'Heating'
+    STATE_PRINTING = 'Printing'
+    STATE_PAUSED = 'Paused'
+    STATE_FINISHED = 'Finished'
+    STATE_CANCELLED = 'Cancelled'
+    STATE_ERROR = 'Error'
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, connection, filePath, temperature=None, startLine=0, window=WINDOW):
+        r"""
+        __init__ Method
+
+        arguments:
+            connection - Conn object
+            filePath - local G-code file
+            temperature - optional nozzle temperature reached before the first line is sent
+            startLine - number of lines of the file skipped (checkpoint of a previous print)
+            window - maximum number of lines waiting for their acknowledgement
+        """
+        super(HostStreamThread, self).__init__(name="bee_stream._stream_thread")
+        self.daemon = True
+
+        self._beeCon = connection
+        self._filePath = filePath
+        self._temperature = temperature
+        self._startLine = startLine
+        self._window = max(1, int(window))
+
+        self._state = HostStreamThread.STATE_STARTING
+        self._pauseRequested = False
+        self._cancelRequested = False
+        self._keepCheckpoint = False
+        self._cond = threading.Condition()
+
+        self._totalLines = None
+        self._sentLines = startLine
+        # Line counts of the last acknowledged commands, the firmware queue depth tells
+        # how many of them are not executed yet
+        self._acknowledged = collections.deque([startLine], maxlen=self._beeCon.MAX_QUEUE_DEPTH + 1)
+        self._checkpoint = None
+        self._checkpointTime = 0
+
+        return
+
+    # *************************************************************************
+    #                        run Method
+    # *************************************************************************
+    def run(self):
+
+        try:
+            self._checkpoint = printerStore.StreamCheckpoint(self._beeCon.getConnectedPrinterSN())
+            self._checkpoint.start(self._filePath, self._startLine)
+
+            with open(self._filePath, 'r') as f:
+                self._totalLines = sum(1 for _ in f)
+
+            if self._heat():
+                self._setState(HostStreamThread.STATE_PRINTING)
+                logger.info('Streaming %s from line %d', self._filePath, self._startLine)
+                self._stream()
+        except Exception as ex:
+            logger.error("Host streaming error: %s", str(ex))
+            if self._checkpoint is not None:
+                self._saveCheckpoint()
+            self._setState(HostStreamThread.STATE_ERROR)
+            return
+
+        if self._cancelRequested:
+            logger.info('Streamed print cancelled at line %d', self.getExecutedLines())
+            # Saved before M112 clears the firmware queue
+            if self._keepCheckpoint:
+                self._saveCheckpoint()
+            self._beeCon.sendCmd("M112\n", "3", 20, True)
+            if not self._keepCheckpoint:
+                self._checkpoint.finish()
+            self._setState(HostStreamThread.STATE_CANCELLED)
+        elif not self._beeCon.isConnected():
+            # The checkpoint is kept to resume the print
+            logger.error('Streamed print interrupted at line %d', self.getExecutedLines())
+            self._saveCheckpoint()
+            self._setState(HostStreamThread.STATE_ERROR)
+        else:
+            logger.info('Streamed print finished')
+            self._checkpoint.finish()
+            self._setState(HostStreamThread.STATE_FINISHED)
+
+        return
+
+    # *************************************************************************
+    #                        _heat Method
+    # *************************************************************************
+    def _heat(self):
+        r"""
+        Sets the nozzle temperature and waits until it is reached. Returns False if the
+        print was cancelled meanwhile
+        """
+        if self._temperature is None:
+            return not self._cancelRequested
+
+        # As printFile, the setpoint is above the print temperature so it is reached
+        self._setState(HostStreamThread.STATE_HEATING)
+        self._beeCon.sendCmd("M104 S%.2f\n" % (self._temperature + HostStreamThread.HEATING_MARGIN))
+        while not self._cancelRequested and self._beeCon.isConnected():
+            try:
+                if parsers.parseNozzleTemperature(self._beeCon.sendCmd("M105\n")) >= self._temperature:
+                    return True
+            except (ValueError, IndexError) as ex:
+                logger.debug("Host streaming: invalid temperature reply: %s", str(ex))
+            with self._cond:
+                self._cond.wait(HostStreamThread.STATUS_POLL)
+
+        return False
+
+    # *************************************************************************
+    #                        _stream Method
+    # *************************************************************************
+    def _stream(self):
+        r"""
+        Sends the lines of the file from the start line, comments and blank lines
+        are not sent. The modal state of the skipped lines is sent before the first line
+        """
+        inflight = collections.deque()      # (line count, reply request)
+        modalState = ModalState() if self._startLine > 0 else None
+
+        with open(self._filePath, 'r') as f:
+            for lineNumber, line in enumerate(f):
+                cmd = line.split(';')[0].strip()
+                if lineNumber < self._startLine:
+                    modalState.update(cmd)
+                    continue
+                if modalState is not None:
+                    if not self._restoreState(modalState):
+                        return
+                    modalState = None
+                if cmd == '':
+                    continue
+
+                if (self._pauseRequested or self._cancelRequested) and not self._waitResume(inflight):
+                    return
+                if not self._beeCon.isConnected():
+                    return
+
+                # Keep the lines in flight within the window and the free firmware queue slots
+                while len(inflight) >= self._limit():
+                    self._collect(inflight)
+
+                inflight.append((lineNumber + 1, self._beeCon.requestCmd(cmd + "\n")))
+                self._sentLines = lineNumber + 1
+
+        while len(inflight) > 0:
+            self._collect(inflight)
+        self._sentLines = self._totalLines
+
+        # Wait for the printer to execute the queued moves
+        while not self._cancelRequested and self._beeCon.isConnected():
+            if 'S:3' in self._beeCon.sendCmd("M625\n"):
+                self._acknowledged.append(self._totalLines)
+                break
+            with self._cond:
+                self._cond.wait(HostStreamThread.STATUS_POLL)
+
+        return
+
+    def _restoreState(self, modalState):
+        r"""
+        Sends the modal state of the skipped lines. Returns False if a command was not
+        acknowledged
+        """
+        logger.info('Host streaming: restoring %s', ', '.join(modalState.getCommands()))
+        for cmd in modalState.getCommands():
+            if self._beeCon.sendCmd(cmd + "\n") in (None, "No response"):
+                logger.error('Host streaming: could not restore the print state (%s)', cmd)
+                return False
+
+        return True
+
+    def _limit(self):
+        free = self._beeCon.MAX_QUEUE_DEPTH - self._beeCon.getQueueDepth()
+
+        return max(1, min(self._window, free))
+
+    def _collect(self, inflight):
+        r"""
+        Waits for the reply to the oldest line in flight and updates the checkpoint
+        """
+        lineCount, req = inflight.popleft()
+        resp = self._beeCon.waitCmdReply(req)
+        if resp == "No response":
+            logger.warning("Host streaming: no acknowledgement of line %d", lineCount)
+        self._acknowledged.append(lineCount)
+
+        if time.time() - self._checkpointTime >= HostStreamThread.CHECKPOINT_INTERVAL:
+            self._saveCheckpoint()
+
+        return
+
+    def _saveCheckpoint(self):
+        self._checkpointTime = time.time()
+        self._checkpoint.update(self.getExecutedLines())
+
+    # *************************************************************************
+    #                        _waitResume Method
+    # *************************************************************************
+    def _waitResume(self, inflight):
+        r"""
+        Collects the lines in flight and waits while the print is paused. Returns False
+        if the print was cancelled
+        """
+        while len(inflight) > 0:
+            self._collect(inflight)
+
+        if self._cancelRequested:
+            return False
+
+        self._saveCheckpoint()
+        self._setState(HostStreamThread.STATE_PAUSED)
+        logger.info('Streamed print paused at line %d', self._sentLines)
+        with self._cond:
+            while self._pauseRequested and not self._cancelRequested:
+                self._cond.wait(1)
+        if self._cancelRequested:
+            return False
+
+        # The printer may have cooled down (shutdown) while paused
+        if not self._heat():
+            return False
+        self._setState(HostStreamThread.STATE_PRINTING)
+
+        return True
+
+    def _setState(self, state):
+        with self._cond:
+            self._state = state
+            self._cond.notify_all()
+
+    # *************************************************************************
+    #                        pause Method
+    # *************************************************************************
+    def pause(self, wait=True, timeout=None):
+        r"""
+        pause method
+
+        Stops sending lines, the printer stops once it executes the lines already sent
+
+        arguments:
+            wait - if True waits until the lines in flight are acknowledged
+            timeout - optional timeout of the wait in seconds
+
+        returns:
+            True if the print is paused
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._pauseRequested = True
+            self._cond.notify_all()
+            while wait and self._state in (HostStreamThread.STATE_STARTING, HostStreamThread.STATE_HEATING,
+                                           HostStreamThread.STATE_PRINTING) and self.isAlive():
+                remaining = 1 if deadline is None else deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            return self._state == HostStreamThread.STATE_PAUSED
+
+    # *************************************************************************
+    #                        resume Method
+    # *************************************************************************
+    def resume(self):
+        r"""
+        Continues sending lines, after heating the nozzle again if needed
+        """
+        with self._cond:
+            self._pauseRequested = False
+            self._cond.notify_all()
+
+        return
+
+    # *************************************************************************
+    #                        cancel Method
+    # *************************************************************************
+    def cancel(self, keepCheckpoint=False):
+        r"""
+        Stops sending lines and cancels the print (M112)
+
+        arguments:
+            keepCheckpoint - if True the checkpoint is saved so the print can be resumed
+        """
+        with self._cond:
+            self._cancelRequested = True
+            self._keepCheckpoint = keepCheckpoint
+            self._cond.notify_all()
+
+        return
+
+    # *************************************************************************
+    #                        getState Method
+    # *************************************************************************
+    def getState(self):
+        r"""
+        Returns the state of the print (HostStreamThread.STATE_*)
+        """
+        return self._state
+
+    def isPaused(self):
+        return self._state == HostStreamThread.STATE_PAUSED
+
+    # *************************************************************************
+    #                        getProgress Method
+    # *************************************************************************
+    def getProgress(self):
+        r"""
+        Returns a dict with the lines of the file ('Lines'), the lines sent ('Sent Lines')
+        and the lines known to be executed by the printer ('Executed Lines')
+        """
+        return {
+            'Lines': self._totalLines,
+            'Sent Lines': self._sentLines,
+            'Executed Lines': self.getExecutedLines(),
+        }
+
+    def getExecutedLines(self):
+        r"""
+        Returns the number of lines of the file executed by the printer: the lines
+        acknowledged except the ones still in the firmware queue
+        """
+        acknowledged = list(self._acknowledged)
+        depth = self._beeCon.getQueueDepth()
+        if depth >= len(acknowledged):
+            return acknowledged[0]
+
+        return acknowledged[-1 - depth]
+
+    # *************************************************************************
+    #                        waitFinished Method
+    # *************************************************************************
+    def waitFinished(self, timeout=None):
+        r"""
+        Waits until the print finishes, is cancelled or fails
+
+        returns:
+            the final state or None on timeout
+        """
+        self.join(timeout)
+        if self.isAlive():
+            return None
+
+        return self._state
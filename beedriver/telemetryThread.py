@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+import re
+import threading
+import time
+import collections
+from beedriver import logger
+from beedriver import parsers
+from beedriver import queryCache
+
+_COMMAND_RE = re.compile(r'^[GMT]\d+$')
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class TelemetrySnapshot(collections.namedtuple('TelemetrySnapshot', [
+        'sequence', 'timestamp', 'mode', 'status', 'nozzleTemperature', 'temperatureReply',
+        'printVariables', 'logReply', 'pollTimes'])):
+    r"""
+        TelemetrySnapshot Class
+
+        Immutable state of a printer collected by the TelemetryThread. A new snapshot is
+        published after every poll, consumers keep a reference to the one they read.
+        Values that were never polled are None
+
+        sequence                                                Number of the snapshot, starting at 1
+        timestamp                                               Time of the last poll
+        mode                                                    Printer mode (Bootloader/Firmware)
+        status                                                  Printer status, as returned by BeeCmd.getStatus
+        nozzleTemperature                                       Nozzle temperature (M105)
+        temperatureReply                                        Reply to M105
+        printVariables                                          Print variables (M32), must not be modified
+        logReply                                                Reply to M1029, only polled if enabled
+        pollTimes                                               Time of the last poll of each value, must not be modified
+    """
+    __slots__ = ()
+
+
+class TelemetryThread(threading.Thread):
+    r"""
+        TelemetryThread Class
+
+        Per printer poller of the printer telemetry. Status (M625), temperature (M105),
+        print variables (M32) and the status log (M1029) are polled at their own
+        intervals and published in a TelemetrySnapshot, so any number of consumers can
+        watch the printer with a single stream of USB requests. Commands that change the
+        printer state make the snapshot stale until the next poll. During G-code transfers
+        the polls are sent between two blocks (Conn.queryBetweenBlocks), during firmware
+        transfers polling is suspended
+
+        __init__(connection, statusInterval, ...)               Initializes current class
+        getSnapshot(timeout)                                    Returns the latest snapshot
+        setInterval(name, interval)                             Changes the polling interval of a value
+        getIntervals()                                          Returns the polling intervals
+        refresh()                                               Polls all values now
+        commandSent(cmd)                                        Makes the snapshot stale if cmd changes the printer state
+        addListener(callback)                                   Calls callback with every new snapshot
+        removeListener(callback)                                Removes a listener
+        stop()                                                  Stops the thread
+    """
+
+    # Polled values, in poll order: name -> command
+    COMMANDS = collections.OrderedDict([
+        ('status', 'M625\n'),
+        ('temperature', 'M105\n'),
+        ('printVariables', 'M32\n'),
+        ('log', 'M1029\n'),
+    ])
+
+    # *************************************************************************
+    #                        __init__ Method
+    # *************************************************************************
+    def __init__(self, connection, statusInterval=1, temperatureInterval=1, printInterval=5, logInterval=None):
+        r"""
+        __init__ Method
+
+        arguments:
+            connection - Conn object
+            statusInterval - seconds between status polls
+            temperatureInterval - seconds between temperature polls
+            printInterval - seconds between print variables polls
+            logInterval - seconds between status log polls (None disables them)
+        """
+        super(TelemetryThread, self).__init__(name="bee_telemetry._poller_thread")
+        self.daemon = True
+
+        self._beeCon = connection
+        self._intervals = {
+            'status': statusInterval,
+            'temperature': temperatureInterval,
+            'printVariables': printInterval,
+            'log': logInterval,
+        }
+        self._nextPoll = dict((name, 0) for name in TelemetryThread.COMMANDS)
+        self._cond = threading.Condition()
+        self._running = True
+        self._listeners = []
+        self._snapshot = TelemetrySnapshot(0, None, None, None, None, None, None, None, {})
+        self._stateChanges = 0          # state changing commands sent
+        self._snapshotChanges = 0       # state changing commands sent before the snapshot poll started
+
+        return
+
+    # *************************************************************************
+    #                        run Method
+    # *************************************************************************
+    def run(self):
+
+        while self._running and self._beeCon.isConnected():
+            with self._cond:
+                now = time.time()
+                due = [name for name in TelemetryThread.COMMANDS
+                       if self._intervals[name] is not None and now >= self._nextPoll[name]]
+                if len(due) == 0 or self._suspended():
+                    self._cond.wait(self._timeToNextPoll(now))
+                    continue
+                for name in due:
+                    self._nextPoll[name] = now + self._intervals[name]
+
+            try:
+                self._poll(due)
+            except Exception as ex:
+                logger.error("Telemetry poll error: %s", str(ex))
+
+        return
+
+    def _suspended(self):
+        return self._beeCon.transferring and not self._beeCon.transferWindows
+
+    def _timeToNextPoll(self, now):
+        if self._suspended():
+            return 0.5
+        pending = [self._nextPoll[name] for name in self._intervals if self._intervals[name] is not None]
+        if len(pending) == 0:
+            return 1
+
+        return min(1, max(0.01, min(pending) - now))
+
+    # *************************************************************************
+    #                        _poll Method
+    # *************************************************************************
+    def _poll(self, names):
+        r"""
+        Sends the commands of the given values and publishes a new snapshot
+        """
+        stateChanges = self._stateChanges
+        values = self._snapshot._asdict()
+        pollTimes = dict(values['pollTimes'])
+
+        if 'status' in names:
+            resp = self._beeCon.queryBetweenBlocks(TelemetryThread.COMMANDS['status'])
+            mode = parsers.parsePrinterMode(resp)
+            if mode is not None:
+                values['mode'] = mode
+                values['status'] = 'Bootloader' if mode == 'Bootloader' else parsers.parseStatusReply(resp)
+                pollTimes['status'] = time.time()
+
+        # The other values are only available in firmware
+        if values['mode'] == 'Firmware':
+            if 'temperature' in names:
+                resp = self._beeCon.queryBetweenBlocks(TelemetryThread.COMMANDS['temperature'])
+                try:
+                    values['nozzleTemperature'] = parsers.parseNozzleTemperature(resp)
+                    values['temperatureReply'] = resp
+                    pollTimes['temperature'] = time.time()
+                except Exception as ex:
+                    logger.debug("Telemetry: invalid temperature reply: %s", str(ex))
+            if 'printVariables' in names:
+                resp = self._beeCon.queryBetweenBlocks(TelemetryThread.COMMANDS['printVariables'])
+                if resp is not None:
+                    values['printVariables'] = parsers.parsePrintVariables(resp)
+                    pollTimes['printVariables'] = time.time()
+            if 'log' in names:
+                resp = self._beeCon.queryBetweenBlocks(TelemetryThread.COMMANDS['log'])
+                if resp is not None:
+                    values['logReply'] = resp
+                    pollTimes['log'] = time.time()
+
+        values['sequence'] = self._snapshot.sequence + 1
+        values['timestamp'] = time.time()
+        values['pollTimes'] = pollTimes
+        snapshot = TelemetrySnapshot(**values)
+
+        with self._cond:
+            self._snapshot = snapshot
+            self._snapshotChanges = stateChanges
+            listeners = list(self._listeners)
+            self._cond.notify_all()
+
+        for callback in listeners:
+            try:
+                callback(snapshot)
+            except Exception as ex:
+                logger.error("Telemetry listener error: %s", str(ex))
+
+        return
+
+    # *************************************************************************
+    #                        getSnapshot Method
+    # *************************************************************************
+    def getSnapshot(self, timeout=None):
+        r"""
+        getSnapshot method
+
+        Returns the latest TelemetrySnapshot. If nothing was polled yet waits up to
+        timeout seconds for the first poll and returns None if it does not complete.
+        Returns None if a state changing command was sent after the snapshot was polled
+        """
+        with self._cond:
+            if self._snapshot.sequence == 0 and timeout is not None:
+                deadline = time.time() + timeout
+                while self._snapshot.sequence == 0 and self.isAlive() and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+            if self._snapshot.sequence == 0 or self._snapshotChanges != self._stateChanges:
+                return None
+
+            return self._snapshot
+
+    # *************************************************************************
+    #                        setInterval Method
+    # *************************************************************************
+    def setInterval(self, name, interval):
+        r"""
+        setInterval method
+
+        Changes the polling interval of a value ('status', 'temperature',
+        'printVariables' or 'log'). None stops polling it
+        """
+        if name not in TelemetryThread.COMMANDS:
+            raise ValueError("Unknown telemetry value: %s" % name)
+
+        with self._cond:
+            self._intervals[name] = interval
+            self._nextPoll[name] = 0
+            self._cond.notify_all()
+
+        return
+
+    def getInterval(self, name):
+        return self._intervals[name]
+
+    def getIntervals(self):
+        r"""
+        Returns the polling intervals as keyword arguments of __init__
+        """
+        return {
+            'statusInterval': self._intervals['status'],
+            'temperatureInterval': self._intervals['temperature'],
+            'printInterval': self._intervals['printVariables'],
+            'logInterval': self._intervals['log'],
+        }
+
+    # *************************************************************************
+    #                        refresh Method
+    # *************************************************************************
+    def refresh(self):
+        r"""
+        Polls all the enabled values without waiting for their interval
+        """
+        with self._cond:
+            for name in self._nextPoll:
+                self._nextPoll[name] = 0
+            self._cond.notify_all()
+
+        return
+
+    # *************************************************************************
+    #                        commandSent Method
+    # *************************************************************************
+    def commandSent(self, cmd):
+        r"""
+        Called for every command written to the printer. As in the QueryCache, a
+        command that is not in queryCache.READ_ONLY_COMMANDS makes the snapshot stale
+        until the next poll. Except for moves, which are sent in streams, the next poll
+        is done immediately. SD file transfer commands (queryCache.TRANSFER_COMMANDS) do not
+        change the state
+        """
+        code = queryCache.commandCode(cmd)
+        if code in queryCache.READ_ONLY_COMMANDS or code in queryCache.TRANSFER_COMMANDS or \
+                not _COMMAND_RE.match(code):
+            # Queries and transfer headers
+            return
+
+        with self._cond:
+            self._stateChanges += 1
+            if code not in ('G0', 'G1'):
+                for name in self._nextPoll:
+                    self._nextPoll[name] = 0
+                self._cond.notify_all()
+
+        return
+
+    # *************************************************************************
+    #                        addListener Method
+    # *************************************************************************
+    def addListener(self, callback):
+        r"""
+        Calls callback(snapshot) from the telemetry thread with every new snapshot
+        """
+        with self._cond:
+            self._listeners.append(callback)
+
+        return
+
+    # *************************************************************************
+    #                        removeListener Method
+    # *************************************************************************
+    def removeListener(self, callback):
+        with self._cond:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+        return
+
+    # *************************************************************************
+    #                        stop Method
+    # *************************************************************************
+    def stop(self):
+        r"""
+        Stops the telemetry thread
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        return
@@ -3,10 +3,14 @@
 import threading
 import time
 import os
-import usb
 import math
 import re
+import itertools
 from beedriver import logger
+from beedriver import parsers
+from beedriver import gcodeMinifier
+from beedriver import blockReader
+from beedriver import printerStore
 
 """
 * Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
@@ -30,14 +34,22 @@ class FileTransferThread(threading.Thread):
 
         This class provides the methods to transfer files, flash firmware and start print
 
-        __init__(connection, filePath, transferType, optionalString, temperature)        Initializes current class
-        getTransferCompletionState()                                                     Returns current file transfer state 
+        __init__(connection, filePath, transferType, optionalString, temperature, ...)   Initializes current class
+        getTransferCompletionState(details)                                              Returns current file transfer state 
+        getResumedBytes()                                                                Returns the number of bytes not sent thanks to resuming
+        getSkippedBytes()                                                                Returns the number of bytes not sent because the SD card already had them
+        getSDFileName()                                                                  Returns the SD file name used by the transfer
         cancelFileTransfer()                                                             Cancels current file transfer
+        isRunning()                                                                      Returns True while the transfer is executing
+        addDoneCallback(fn)                                                              Calls fn(thread) when the transfer ends
         transferFirmwareFile()                                                           Transfers Firmware File to printer
+        windowedFirmwareTransfer()                                                       Transfers Firmware File with several chunks in flight
         multiBlockFileTransfer()                                                         Transfers Gcode File using multi blok transfers
+        resumeTransfer(beeCmd, sdFileName)                                               Reconnects and reopens the SD file of an interrupted transfer
         sendBlock(startPos, fileObj)                                                     Writes a block of messages
         sendBlockMsg(msg)                                                                Sends a block message to the printer
         waitForHeatingAndPrint(temperature)                                              Waits for setpoint temperature and starts printing the transferred file
+        isPrintStarted()                                                                 Returns True if a streaming print started before the transfer ended
     """
 
     transferring = False
@@ -55,18 +67,45 @@ class FileTransferThread(threading.Thread):
     
     MESSAGE_SIZE = 512
     BLOCK_SIZE = 64
+    RESUME_ATTEMPTS = 3             # reconnections tried before a resumable transfer is aborted
+    BLOCK_MSG_TIMEOUT = 2           # seconds to wait for the 'tog' reply of a block message
+    FLASH_CHUNK_SIZE = 64           # bytes written to the bootloader at a time
+    FLASH_WINDOW = 16               # firmware chunks sent ahead of the echo in windowed flashing
+    FLASH_ATTEMPTS = 3              # times the image is sent in windowed flashing if the echo does not match
+    FLASH_ECHO_TIMEOUT = 5          # seconds without echo before a windowed flash is aborted
+    STREAM_MARGIN = 131072          # bytes in the SD card before a streaming print starts
+    STREAM_LOW_WATER = 0.25         # fraction of the start margin (lines) below which a streaming print is paused
     
     beeCon = None
     
     # *************************************************************************
     #                        __init__ Method
     # *************************************************************************
-    def __init__(self, connection, filePath, transferType, optionalString=None, temperature=None):
+    def __init__(self, connection, filePath, transferType, optionalString=None, temperature=None, resume=False,
+                 delta=False, cache=False, minify=False, windowed=False, streaming=False, streamMargin=None,
+                 firmwareRecord=None):
         r"""
         __init__ Method
 
         Initializes this class
 
+        arguments:
+            resume - if True the acknowledged position of G-code transfers is recorded so
+                     an interrupted transfer continues from the last acknowledged block
+            delta - if True only the blocks that differ from the content last written to
+                    the SD file are sent
+            cache - if True the transfer is skipped when a file with the same content is
+                    already in the SD card. Print transfers then print that file
+            minify - if True G-code files are minified (gcodeMinifier) while they are sent
+            windowed - if True firmware is flashed with several chunks in flight and the
+                       bootloader echo is checked as it arrives (windowedFirmwareTransfer)
+            streaming - if True print transfers start printing once streamMargin bytes are
+                        in the SD card and the nozzle is hot, and the rest of the file is
+                        uploaded while printing (print-while-uploading)
+            streamMargin - optional bytes uploaded before a streaming print starts
+                           (default = STREAM_MARGIN)
+            firmwareRecord - optional printerStore.FirmwareRecord of a firmware transfer,
+                             marked as flashed when the image is verified
         """
         
         super(FileTransferThread, self).__init__()
@@ -77,6 +116,36 @@ class FileTransferThread(threading.Thread):
         self.optionalString = optionalString
         self.cancelTransfer = False
         self.temperature = temperature
+        self.resume = resume
+        self.delta = delta
+        self.cache = cache
+        self.windowed = windowed
+        self.firmwareRecord = firmwareRecord
+        self.minify = minify and gcodeMinifier.isAvailable()
+        if minify and not self.minify:
+            logger.warning("G-code minifier not available (utils.gcoder not found), sending file unchanged")
+        self.bytesResumed = 0
+        self.bytesSkipped = 0
+        self.progressStartTime = None
+        self.progressStartBytes = 0
+
+        self.streaming = streaming and transferType.lower() == 'print' and filePath is not None
+        self.streamMargin = streamMargin if streamMargin is not None else self.STREAM_MARGIN
+        if self.streaming and (resume or delta):
+            # The print follows the upload, blocks must be written in order from the start
+            logger.warning("Streaming print: resume and delta transfers are not used")
+            self.resume = False
+            self.delta = False
+        self.printStarted = False
+        self.streamPaused = False
+        self.streamMarginLines = 0
+        self.linesTransferred = 0
+        self.linesExecuted = 0
+
+        self.running = False
+        self.finished = False
+        self._doneCallbacks = []
+        self._doneLock = threading.Lock()
 
         if temperature is not None:
             self.heating = True
@@ -89,11 +158,46 @@ class FileTransferThread(threading.Thread):
     def run(self):
         
         super(FileTransferThread, self).run()
+
+        self.running = True
+        # Background users of the connection (telemetry) wait until the transfer ends,
+        # or for the windows between the blocks of G-code transfers
+        self.beeCon.transferOwner = threading.current_thread()
+        self.beeCon.transferring = True
+        try:
+            self._runTransfer()
+        finally:
+            self.beeCon.transferWindows = False
+            self.beeCon.transferring = False
+            self.beeCon.transferOwner = None
+            self.running = False
+            self._runDoneCallbacks()
+
+        return
+
+    def _runDoneCallbacks(self):
+        with self._doneLock:
+            self.finished = True
+            callbacks = self._doneCallbacks
+            self._doneCallbacks = []
+
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as ex:
+                logger.error("Exception in transfer callback: %s", str(ex))
+
+    def _runTransfer(self):
         
         if self.transferType.lower() == 'firmware':
             self.transferring = True
             logger.info('Starting Firmware Transfer')
-            self.transferFirmwareFile()
+            if self.windowed:
+                flashed = self.windowedFirmwareTransfer()
+            else:
+                flashed = self.transferFirmwareFile()
+            if flashed and self.firmwareRecord is not None:
+                self.firmwareRecord.finish()
 
             # Update Firmware String
             self.beeCon.sendCmd('M114 A%s' % self.optionalString, 'ok')
@@ -114,12 +218,17 @@ class FileTransferThread(threading.Thread):
 
                 logger.info('Starting GCode Transfer')
                 self.multiBlockFileTransfer()
-                logger.info('File Transfer Finished... Heating...\n')
+                if self.printStarted:
+                    logger.info('File Transfer Finished... Printing\n')
+                else:
+                    logger.info('File Transfer Finished... Heating...\n')
 
                 self.beeCon.setMonitorConnection(True)
                 self.transferring = False
 
-            if not self.cancelTransfer:
+            # Other users of the connection can send commands while heating
+            self.beeCon.transferring = False
+            if not self.cancelTransfer and not self.printStarted:
                 self.waitForHeatingAndPrint(self.temperature)
             self.heating = False
         else:
@@ -132,18 +241,64 @@ class FileTransferThread(threading.Thread):
     # *************************************************************************
     #                        getTransferCompletionState Method
     # *************************************************************************
-    def getTransferCompletionState(self):
+    def getTransferCompletionState(self, details=False):
         r"""
         getTransferCompletionState method
         
         Returns current file transfer state
+
+        arguments:
+            details - if True returns a dict with the completion percentage ('percent'),
+                      the transfer speed in bytes/second ('bytesPerSecond') and the
+                      estimated seconds to finish ('eta', None while unknown)
         """
         if self.fileSize > 0:
             percent = (100 * self.bytesTransferred / self.fileSize)
-            return "%.2f" % percent
+            if not details:
+                return "%.2f" % percent
+
+            bytesPerSecond = 0.0
+            eta = None
+            if self.progressStartTime is not None:
+                elapsed = time.time() - self.progressStartTime
+                if elapsed > 0:
+                    bytesPerSecond = (self.bytesTransferred - self.progressStartBytes) / elapsed
+                if bytesPerSecond > 0:
+                    eta = max(0, self.fileSize - self.bytesTransferred) / bytesPerSecond
+
+            return {'percent': "%.2f" % percent, 'bytesPerSecond': bytesPerSecond, 'eta': eta}
         else:
             return None
 
+    def _startProgress(self):
+        # Transfer speed and ETA are measured from here
+        self.progressStartTime = time.time()
+        self.progressStartBytes = self.bytesTransferred
+
+    # *************************************************************************
+    #                        getResumedBytes Method
+    # *************************************************************************
+    def getResumedBytes(self):
+        r"""
+        getResumedBytes method
+
+        Returns the number of bytes that did not have to be sent again because the
+        transfer was resumed
+        """
+        return self.bytesResumed
+
+    # *************************************************************************
+    #                        getSkippedBytes Method
+    # *************************************************************************
+    def getSkippedBytes(self):
+        r"""
+        getSkippedBytes method
+
+        Returns the number of bytes a delta or cached transfer did not send because the
+        SD card already had the same content
+        """
+        return self.bytesSkipped
+
     # *************************************************************************
     #                        cancelFileTransfer Method
     # *************************************************************************
@@ -168,6 +323,36 @@ class FileTransferThread(threading.Thread):
 
         return self.transferring
 
+    # *************************************************************************
+    #                        isRunning Method
+    # *************************************************************************
+    def isRunning(self):
+        r"""
+        isRunning method
+
+        Returns True while the transfer is executing, either in this thread or
+        inline in the caller thread
+        """
+
+        return self.running or self.isAlive()
+
+    # *************************************************************************
+    #                        addDoneCallback Method
+    # *************************************************************************
+    def addDoneCallback(self, fn):
+        r"""
+        addDoneCallback method
+
+        Calls fn with this object when the transfer ends, in the transfer thread. If
+        the transfer already ended fn is called immediately
+        """
+        with self._doneLock:
+            if not self.finished:
+                self._doneCallbacks.append(fn)
+                return
+
+        fn(self)
+
     # *************************************************************************
     #                        isHeating Method
     # *************************************************************************
@@ -193,14 +378,12 @@ class FileTransferThread(threading.Thread):
         cTime = time.time()                                         # Get current time
 
         message = "M650 A" + str(self.fileSize) + "\n"                      # Prepare Start Transfer Command string
-        self.beeCon.write(message)                                         # Send Start Transfer Command
 
-        # Before continue wait for the reply from the Start Command transfer
-        resp = ''
-        while 'ok' not in resp:                                    # Once the printer is ready it replies 'ok'
-            resp += self.beeCon.read()
+        # Send Start Transfer Command and before continue wait for the reply
+        self.beeCon.waitFor(message, 'ok')                                 # Once the printer is ready it replies 'ok'
+        self._startProgress()
 
-        resp = ''
+        echo = memoryview(bytearray(64))                                   # Preallocated buffer for the echoed data
         with open(self.filePath, 'rb') as f:                             # Open file to start transfer
 
             while True:                                             # while loop
@@ -209,22 +392,18 @@ class FileTransferThread(threading.Thread):
                 if not buf:
                     break                                   # if nothing left to read, transfer finished
 
-                bytesWriten = self.beeCon.write(buf)                              # Send 64 bytes to the printer
+                bytesWriten = self.beeCon.write(buf, isData=True)                              # Send 64 bytes to the printer
 
                 #time.sleep(0.0000001)                               # Small delay helps remove sporadic errors
                 time.sleep(0.001)
 
                 # The printer will forward the received data
                 # we then collect the received data and compare it to identify transfer errors
-                ret = []
-                while len(ret) != len(buf):                        # wait for the 64 bytes to be received
-                    try:
-                        ret += self.beeCon.ep_in.read(len(buf), 1000)
-                    except usb.core.USBError as e:
-                        if "timed out" in str(e.args):
-                            pass
-
-                bRet = bytearray(ret)                                   # convert the received data to bytes
+                bRet = echo[:len(buf)]
+                nRet = 0
+                while nRet != len(buf):                             # wait for the 64 bytes to be received
+                    nRet += self.beeCon.readInto(bRet[nRet:], 1000)
+
                 if not bRet == buf:                                 # Compare the data received with data sent
                                                                     # If data received/sent are different cancel transfer and reset the printer manually
                     logger.error('Firmware Flash error, please reset the printer')
@@ -245,6 +424,100 @@ class FileTransferThread(threading.Thread):
         self.fileSize = 0
         
         return True
+
+    # *************************************************************************
+    #                        windowedFirmwareTransfer Method
+    # *************************************************************************
+    def windowedFirmwareTransfer(self):
+        r"""
+        windowedFirmwareTransfer method
+
+        Transfers Firmware File to printer keeping FLASH_WINDOW chunks in flight. The
+        bootloader echo is compared with the image as it arrives instead of after each
+        chunk. The bootloader writes the image sequentially, so when the echo does not
+        match the whole image is sent again (up to FLASH_ATTEMPTS times)
+        """
+
+        cTime = time.time()
+
+        with open(self.filePath, 'rb') as f:
+            image = f.read()
+
+        result = False
+        for attempt in range(self.FLASH_ATTEMPTS):
+            if attempt > 0:
+                logger.warning('Firmware echo mismatch, flashing again (attempt %d of %d)',
+                               attempt + 1, self.FLASH_ATTEMPTS)
+            result = self._flashImage(image)
+            if result is not False:
+                break
+
+        if result is not True:
+            logger.error('Firmware Flash error, please reset the printer')
+            return
+
+        eTime = time.time()
+
+        logger.info("Flashing completed in %d seconds", eTime-cTime)
+        logger.info("Average Transfer Speed %.2f bytes/second", self.fileSize/(eTime - cTime))
+
+        self.bytesTransferred = 0
+        self.fileSize = 0
+
+        return True
+
+    # *************************************************************************
+    #                        _flashImage Method
+    # *************************************************************************
+    def _flashImage(self, image):
+        r"""
+        Sends the image once. Returns True if the echo matched, False if it did not
+        and None if the bootloader stopped replying
+        """
+        size = len(image)
+
+        self.beeCon.waitFor("M650 A" + str(size) + "\n", 'ok')
+        self.bytesTransferred = 0
+        self._startProgress()
+
+        windowBytes = self.FLASH_WINDOW * self.FLASH_CHUNK_SIZE
+        echo = memoryview(bytearray(windowBytes))                          # Preallocated buffer for the echoed data
+        sent = 0
+        echoed = 0
+        badChunks = set()
+        lastEcho = time.time()
+        while echoed < size:
+            # Keep the window full
+            while sent < size and sent - echoed < windowBytes:
+                n = min(self.FLASH_CHUNK_SIZE, size - sent)
+                self.beeCon.write(blockReader.sliceView(image, sent, sent + n), isData=True)
+                sent += n
+
+            # Check whatever part of the echo is already available
+            nRet = self.beeCon.readInto(echo[:sent - echoed], 10)
+            if nRet == 0:
+                if time.time() - lastEcho > self.FLASH_ECHO_TIMEOUT:
+                    logger.error('Firmware Flash: no echo from the bootloader at byte %d', echoed)
+                    return None
+                continue
+            lastEcho = time.time()
+
+            if echo[:nRet].tobytes() != image[echoed:echoed + nRet]:
+                # The image must still be sent to the end before the bootloader accepts commands
+                chunkStart = echoed - echoed % self.FLASH_CHUNK_SIZE
+                for start in range(chunkStart, echoed + nRet, self.FLASH_CHUNK_SIZE):
+                    lo = max(start, echoed)
+                    hi = min(start + self.FLASH_CHUNK_SIZE, echoed + nRet)
+                    if echo[lo - echoed:hi - echoed].tobytes() != image[lo:hi]:
+                        badChunks.add(start // self.FLASH_CHUNK_SIZE)
+            echoed += nRet
+            self.bytesTransferred = echoed
+
+        if len(badChunks) > 0:
+            logger.warning('Firmware Flash: echo of %d chunks did not match', len(badChunks))
+            return False
+
+        return True
     
     # *************************************************************************
     #                        multiBlockFileTransfer Method
@@ -258,83 +531,197 @@ class FileTransferThread(threading.Thread):
         
         # Get commands interface
         beeCmd = self.beeCon.getCommandIntf()
-        
-        # Create File
-        beeCmd.initSD()
-        sdFileName = "ABCDE"
-        
-        # If a different SD Filename is provided
-        if self.optionalString is not None:
-            sdFileName = self.optionalString
-            # REMOVE SPECIAL CHARS
-            sdFileName = re.sub('[\W_]+', '', sdFileName)
 
-            # CHECK FILENAME
-            if len(sdFileName) > 8:
-                sdFileName = sdFileName[:7]
+        serialNumber = self.beeCon.getConnectedPrinterSN()
+        blockBytes = beeCmd.MESSAGE_SIZE * beeCmd.BLOCK_SIZE
 
-            firstChar = sdFileName[0]
+        # Size of the data written to the SD card, unknown until the end for minified transfers
+        sdSize = None if self.minify else self.fileSize
+        fileHash = None
+        hashes = None
+        if self.cache or self.delta:
+            with self._openSource() as src:
+                fileHash, hashes, sdSize = printerStore.hashStream(src, blockBytes)
+
+        sdCache = printerStore.SDCache(serialNumber)
+        if self.cache:
+            if self.optionalString is None:
+                self.optionalString = sdCache.getContentName(fileHash)
+
+            # Any SD file with the same content can be printed, a plain transfer needs the given name
+            fileList = beeCmd.getFileList()
+            if fileList is not None:
+                requestedName = None if self.transferType.lower() == 'print' else self.getSDFileName()
+                cachedName = sdCache.find(fileHash, fileList['FileNames'], requestedName)
+                if cachedName is not None:
+                    logger.info("multiBlockFileTransfer: %s already in SD card as %s, transfer skipped",
+                                self.filePath, cachedName)
+                    self.optionalString = cachedName
+                    self.bytesSkipped = self.fileSize
+                    self.bytesTransferred = self.fileSize
+                    return
 
-            if firstChar.isdigit():
-                nameChars = list(sdFileName)
-                nameChars[0] = 'a'
-                sdFileName = "".join(nameChars)
+        sdFileName = self.getSDFileName()
 
         # Get Number of blocks to transfer
-        blockBytes = beeCmd.MESSAGE_SIZE * beeCmd.BLOCK_SIZE
-        nBlocks = int(math.ceil(float(self.fileSize)/float(blockBytes)))
-        logger.info("Number of Blocks: %d", nBlocks)
+        if sdSize is not None:
+            nBlocks = int(math.ceil(float(sdSize)/float(blockBytes)))
+            logger.info("Number of Blocks: %d", nBlocks)
+
+        manifest = printerStore.BlockManifest(serialNumber)
+        blocks = None
+        if self.delta:
+            # Only the blocks that differ from the last content written to the SD file are sent
+            blocks = manifest.getChangedBlocks(sdFileName, hashes, blockBytes, sdSize)
+
+        journal = printerStore.TransferJournal(serialNumber)
+        resumable = self.resume and blocks is None
+        startPos = 0
+        if resumable:
+            startPos = journal.getResumePosition(sdFileName, self.filePath, blockBytes, self.minify)
+
+        # Update the existing SD file if only part of it has to be written
+        if blocks is not None and beeCmd.openFile(sdFileName):
+            logger.info("multiBlockFileTransfer: Delta transfer of %d / %d blocks", len(blocks), nBlocks)
+        elif startPos > 0 and self._checkResumePosition(beeCmd, manifest, sdFileName, startPos, blockBytes):
+            logger.info("multiBlockFileTransfer: Resuming transfer at byte %d", startPos)
+        else:
+            blocks = None
+            startPos = 0
+            # CREATE SD FILE
+            beeCmd.initSD()
+            resp = beeCmd.createFile(sdFileName)
+            if not resp:
+                manifest.invalidate(sdFileName)
+                sdCache.invalidate(sdFileName)
+                return
 
-        # CREATE SD FILE
-        resp = beeCmd.createFile(sdFileName)
-        if not resp:
-            return
+        if resumable:
+            journal.start(sdFileName, self.filePath, blockBytes, startPos, self.minify)
+        else:
+            # The entry of an earlier interrupted transfer no longer describes the SD file
+            journal.finish(sdFileName)
+            journal = None
+
+        # Until they are acknowledged the content of the blocks being written is unknown
+        if self.delta:
+            if blocks is None:
+                blocks = range(len(hashes))
+            written = list(hashes)
+            for i in blocks:
+                written[i] = None
+            manifest.store(sdFileName, written, blockBytes, sdSize)
+        else:
+            manifest.invalidate(sdFileName)
+        sdCache.invalidate(sdFileName)
 
         # Start transfer
-        blocksTransferred = 0
-        self.bytesTransferred = 0
+        self.bytesResumed = startPos
+        self.bytesSkipped = 0
+        if blocks is not None:
+            self.bytesSkipped = sdSize - sum(min(blockBytes, sdSize - i * blockBytes) for i in blocks)
+            blockIter = iter(blocks)
+        else:
+            # Blocks are sent until the end of the data
+            blockIter = itertools.count(startPos // blockBytes)
+        self.bytesTransferred = startPos + self.bytesSkipped
+        sdPos = startPos
 
         startTime = time.time()
+        self._startProgress()
 
-        # Load local file
-        with open(self.filePath, 'rb') as f:
+        # Queued queries (telemetry) are sent between the blocks
+        self.beeCon.transferWindows = True
 
-            beeCmd.transmissionErrors = 0
+        # Load local file, the next block is read while the current one is sent
+        with blockReader.BlockReader(self._openSource(), blockBytes) as f:
 
-            while blocksTransferred < nBlocks and not self.cancelTransfer:
+            self.transmissionErrors = 0
 
-                startPos = self.bytesTransferred
-                #endPos = self.bytesTransferred + blockBytes
+            block = next(blockIter, None)
+            upcoming = next(blockIter, None)
+            if block is not None:
+                f.prefetch(block * blockBytes)
+            while block is not None and not self.cancelTransfer:
 
-                #bytes2write = endPos - startPos
+                if upcoming is not None:
+                    f.prefetch(upcoming * blockBytes)
 
-                #if blocksTransferred == (nBlocks-1):
-                #    endPos = self.fileSize
+                blockBytesTransferred = self.sendBlock(block * blockBytes, f)
 
-                blockTransferred = False
-                while blockTransferred is False:
+                if blockBytesTransferred is False:
+                    # Communication was reestablished, send the block again
+                    continue
 
-                    blockBytesTransferred = self.sendBlock(startPos, f)
-                    if blockBytesTransferred is None:
+                if blockBytesTransferred is None:
+                    if not (self.resume or self.delta) or not self.resumeTransfer(beeCmd, sdFileName):
                         logger.info("transferGFile: Transfer aborted")
-                        return False
-                    else:
-                        blockTransferred = True
+                        break
+                    self.bytesResumed += self.bytesTransferred - self.bytesSkipped
+                    continue
+
+                if blockBytesTransferred == 0:
+                    # End of the data
+                    block = None
+                    break
+
+                if self.delta:
+                    written[block] = hashes[block]
+
+                sdPos = block * blockBytes + blockBytesTransferred
+                if self.minify and not self.delta:
+                    self.bytesTransferred = f.getSourcePosition()
+                else:
+                    self.bytesTransferred += blockBytesTransferred
+                if journal is not None:
+                    journal.update(sdFileName, sdPos)
+
+                # The printer accepts commands until the next M28
+                self.beeCon.runTransferWindow()
+                if self.streaming:
+                    self._streamPrint(sdFileName)
 
-                self.bytesTransferred += blockBytesTransferred
-                blocksTransferred += 1
-                #logger.info("transferGFile: Transferred %s / %s blocks %d / %d bytes",
-                #            str(blocksTransferred), str(nBlocks), endPos, self.fileSize)
+                block = upcoming
+                upcoming = next(blockIter, None)
+
+        self.beeCon.transferWindows = False
+
+        if self.delta:
+            manifest.store(sdFileName, written, blockBytes, sdSize)
 
         if self.cancelTransfer:
             logger.info('multiBlockFileTransfer: File Transfer canceled')
             logger.info('multiBlockFileTransfer: %s / %s bytes transferred', str(self.bytesTransferred),str(self.fileSize))
             self.transferring = False
+            if self.printStarted:
+                # Part of the file is being printed
+                beeCmd.cancelPrint()
             beeCmd.cancelHeating()
             #self.cancelTransfer = False
             return
 
-        logger.info("multiBlockFileTransfer: Transfer completed. Errors Resolved: %s", str(beeCmd.transmissionErrors))
+        if block is not None:
+            return False
+
+        if journal is not None:
+            journal.finish(sdFileName)
+        if fileHash is not None:
+            sdCache.store(sdFileName, fileHash, sdSize)
+        if self.streamPaused:
+            logger.info('Streaming print: upload complete, resuming print')
+            self.beeCon.sendCmd('M643\n')
+            self.streamPaused = False
+
+        logger.info("multiBlockFileTransfer: Transfer completed. Errors Resolved: %s", str(self.transmissionErrors))
+        if self.minify:
+            self.bytesTransferred = self.fileSize
+            if sdSize is None:
+                sdSize = sdPos
+            logger.info("multiBlockFileTransfer: Minified %d bytes to %d bytes", self.fileSize, sdSize)
+        if self.bytesResumed > 0:
+            logger.info("multiBlockFileTransfer: Resuming saved %d bytes", self.bytesResumed)
+        if self.bytesSkipped > 0:
+            logger.info("multiBlockFileTransfer: Delta transfer skipped %d unchanged bytes", self.bytesSkipped)
 
         elapsedTime = time.time() - startTime
         avgSpeed = self.fileSize//elapsedTime
@@ -343,6 +730,94 @@ class FileTransferThread(threading.Thread):
 
         return
     
+    # *************************************************************************
+    #                        _openSource Method
+    # *************************************************************************
+    def _openSource(self):
+        r"""
+        Opens the data to transfer, the local file or its minified stream
+        """
+        if self.minify:
+            return gcodeMinifier.MinifiedStream(self.filePath)
+
+        return open(self.filePath, 'rb')
+
+    # *************************************************************************
+    #                        _checkResumePosition Method
+    # *************************************************************************
+    def _checkResumePosition(self, beeCmd, manifest, sdFileName, position, blockBytes):
+        r"""
+        Opens the SD file of an interrupted transfer and checks that it still holds the
+        data of the journal: no other content was recorded for it (BlockManifest) and its
+        size is between the acknowledged position and the end of the next block
+        """
+        size = None
+        if not manifest.contains(sdFileName):
+            size = beeCmd.getSDFileSize(sdFileName)
+        if size is not None and position <= size <= position + blockBytes:
+            return True
+
+        logger.warning("multiBlockFileTransfer: %s was changed after the interrupted transfer (size %s), "
+                       "transferring it again", sdFileName, size)
+
+        return False
+
+    # *************************************************************************
+    #                        resumeTransfer Method
+    # *************************************************************************
+    def resumeTransfer(self, beeCmd, sdFileName):
+        r"""
+        resumeTransfer method
+
+        Reconnects to the printer after a failed block and reopens the SD file so the
+        transfer can continue from the last acknowledged block
+
+        returns:
+            True if the transfer can continue, False otherwise
+        """
+        for attempt in range(self.RESUME_ATTEMPTS):
+            if self.cancelTransfer:
+                return False
+
+            logger.info("multiBlockFileTransfer: Reconnecting to resume transfer at byte %d (attempt %d)",
+                        self.bytesTransferred, attempt + 1)
+            if self.beeCon.reconnect() and beeCmd.openFile(sdFileName):
+                return True
+
+            time.sleep(1)
+
+        return False
+
+    # *************************************************************************
+    #                        getSDFileName Method
+    # *************************************************************************
+    def getSDFileName(self):
+        r"""
+        getSDFileName method
+
+        Returns the SD card file name used by the transfer
+        """
+        sdFileName = "ABCDE"
+
+        # If a different SD Filename is provided
+        if self.optionalString is not None:
+            sdFileName = self.optionalString
+            # REMOVE SPECIAL CHARS
+            sdFileName = re.sub('[\W_]+', '', sdFileName)
+
+            # CHECK FILENAME
+            if len(sdFileName) > 8:
+                sdFileName = sdFileName[:7]
+
+            firstChar = sdFileName[0]
+
+            if firstChar.isdigit():
+                nameChars = list(sdFileName)
+                nameChars[0] = 'a'
+                sdFileName = "".join(nameChars)
+
+        return sdFileName
+
     # *************************************************************************
     #                        sendBlock Method
     # *************************************************************************
@@ -357,38 +832,35 @@ class FileTransferThread(threading.Thread):
             fileObj - file object with file to write
 
         returns:
-            True if block transferred successfully
+            number of bytes transferred (0 at the end of the file)
             False if an error occurred and communication was reestablished
             None if an error occurred and could not reestablish communication with printer
         """
 
         fileObj.seek(startPos)
         block2write = fileObj.read(self.MESSAGE_SIZE*self.BLOCK_SIZE)
+        if len(block2write) == 0:
+            return 0
 
         endPos = startPos + len(block2write)
 
-        #self.StartTransfer(endPos,startPos)
-        self.beeCon.write("M28 D" + str(endPos - 1) + " A" + str(startPos) + "\n")
-
+        # Messages are views of the block, not copies
         nMsg = int(math.ceil(float(len(block2write))/float(self.MESSAGE_SIZE)))
         msgBuf = []
         for i in range(nMsg):
-            if i < nMsg:
-                msgBuf.append(block2write[i*self.MESSAGE_SIZE:(i+1)*self.MESSAGE_SIZE])
-            else:
-                msgBuf.append(block2write[i*self.MESSAGE_SIZE:])
+            msgBuf.append(blockReader.sliceView(block2write, i*self.MESSAGE_SIZE,
+                                                min((i+1)*self.MESSAGE_SIZE, len(block2write))))
 
-        resp = self.beeCon.read()
-        while "ok q:0" not in resp.lower():
-            resp += self.beeCon.read()
-        #print(resp)
-        #resp = self.beeCon.read(10) #force clear buffer
+        #self.StartTransfer(endPos,startPos)
+        self.beeCon.waitFor("M28 D" + str(endPos - 1) + " A" + str(startPos) + "\n", "ok Q:0")
 
         for m in msgBuf:
             mResp = self.sendBlockMsg(m)
             if mResp is not True:
                 return mResp
 
+        self.linesTransferred += block2write.count(b'\n')
+
         return len(block2write)
 
     # *************************************************************************
@@ -410,25 +882,11 @@ class FileTransferThread(threading.Thread):
         """
 
         #resp = self.beeCon.dispatch(msg)
-        msgLen = len(msg)
-        bWriten = self.beeCon.write(msg)
-        if msgLen != bWriten:
-            logger.info("Bytes lost")
-            return False
-
-        time.sleep(0.001)
+        # The reply is matched against the 'tog' token in the receive buffer. The message
+        # is file data, it does not change the printer state (query cache, telemetry)
+        resp = self.beeCon.waitFor(msg, "tog", self.BLOCK_MSG_TIMEOUT, isData=True)
 
-        tries = 10
-        resp = ""
-        while (tries > 0) and ("tog" not in resp):
-            try:
-                resp += self.beeCon.read()
-                tries -= 1
-            except Exception as ex:
-                logger.error(str(ex))
-                tries = -1
-
-        if tries > 0:
+        if resp is not None and "tog" in resp:
             return True
         else:
             cleaningTries = 5
@@ -450,6 +908,63 @@ class FileTransferThread(threading.Thread):
 
             return False
 
+    # *************************************************************************
+    #                        _streamPrint Method
+    # *************************************************************************
+    def _streamPrint(self, sdFileName):
+        r"""
+        _streamPrint method
+
+        Print-while-uploading step, called between two blocks of a streaming print
+        transfer. Starts printing the SD file once streamMargin bytes were uploaded and the
+        nozzle reached the print temperature. Afterwards the lines uploaded are compared
+        with the printer 'Executed Lines' and, if the upload falls behind the print, the
+        print is paused until the start margin is recovered
+        """
+        if not self.printStarted:
+            if self.bytesTransferred < self.streamMargin:
+                return
+            if self.temperature is not None:
+                try:
+                    if parsers.parseNozzleTemperature(self.beeCon.sendCmd("M105\n")) < self.temperature:
+                        return
+                except Exception as ex:
+                    logger.debug("Streaming print: invalid temperature reply: %s", str(ex))
+                    return
+
+            logger.info('Streaming print: %d bytes uploaded, beginning print\n', self.bytesTransferred)
+            self.beeCon.sendCmd('M33 %s\n' % sdFileName)
+            self.printStarted = True
+            self.streamMarginLines = max(1, self.linesTransferred)
+            return
+
+        printVars = parsers.parsePrintVariables(self.beeCon.sendCmd('M32\n'))
+        if 'Executed Lines' not in printVars:
+            return
+        self.linesExecuted = printVars['Executed Lines']
+
+        ahead = self.linesTransferred - self.linesExecuted
+        if not self.streamPaused and ahead < self.streamMarginLines * self.STREAM_LOW_WATER:
+            logger.warning('Streaming print: upload only %d lines ahead of the print, pausing', ahead)
+            self.beeCon.sendCmd('M640\n')
+            self.streamPaused = True
+        elif self.streamPaused and ahead >= self.streamMarginLines:
+            logger.info('Streaming print: %d lines buffered, resuming print', ahead)
+            self.beeCon.sendCmd('M643\n')
+            self.streamPaused = False
+
+        return
+
+    # *************************************************************************
+    #                        isPrintStarted Method
+    # *************************************************************************
+    def isPrintStarted(self):
+        r"""
+        Returns True if the print of a streaming print transfer started before the
+        transfer ended
+        """
+        return self.printStarted
+
     # *************************************************************************
     #                        waitForHeatingAndPrint Method
     # *************************************************************************
@@ -470,23 +985,7 @@ class FileTransferThread(threading.Thread):
                 self.cancelTransfer = False
                 return
 
-        sdFileName = 'ABCDE'
-        # If a different SD Filename is provided
-        if self.optionalString is not None:
-            sdFileName = self.optionalString
-            # REMOVE SPECIAL CHARS
-            sdFileName = re.sub('[\W_]+', '', sdFileName)
-    
-            # CHECK FILENAME
-            if len(sdFileName) > 8:
-                sdFileName = sdFileName[:7]
-    
-            firstChar = sdFileName[0]
-    
-            if firstChar.isdigit():
-                nameChars = list(sdFileName)
-                nameChars[0] = 'a'
-                sdFileName = "".join(nameChars)
+        sdFileName = self.getSDFileName()
         
         logger.info('Heating Done... Beginning print\n')
         self.beeCon.sendCmd('M33 %s\n' % sdFileName)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from beedriver import connection
+from beedriver import logger
+from beedriver import printerStore
+from beedriver import simulator
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class SimulatorTestCase(unittest.TestCase):
+    r"""
+        Base class of the tests run against a PrinterSimulator. Every command line
+        received by the simulator is recorded in self.received
+    """
+
+    LATENCY = 0.001
+    TIME_SCALE = 50.0
+    LINES_PER_SECOND = 4000
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.tmpDir = tempfile.mkdtemp()
+        printerStore.setStoreDir(os.path.join(self.tmpDir, 'store'))
+
+        self.sim = simulator.PrinterSimulator(latency=self.LATENCY, timeScale=self.TIME_SCALE,
+                                              linesPerSecond=self.LINES_PER_SECOND)
+        self.received = []
+        self._receivedLock = threading.Lock()
+        receive = self.sim.receive
+
+        def record(data):
+            with self._receivedLock:
+                self.received.extend(line for line in bytes(data).split(b'\n') if line.strip())
+            return receive(data)
+
+        self.sim.receive = record
+
+        self.conn = connection.Conn(dummyPlug=True, printerSimulator=self.sim)
+        self.conn.connectToFirstPrinter()
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def makeGcode(self, name, lines):
+        path = os.path.join(self.tmpDir, name)
+        with open(path, 'w') as f:
+            for i in range(lines):
+                f.write('G1 X%d Y%d E%d\n' % (i % 100, i % 77, i))
+
+        return path
+
+    def readFile(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def receivedCommands(self, code):
+        with self._receivedLock:
+            return [line for line in self.received if line.split()[0] == code]
+
+    def waitUntil(self, condition, timeout=20):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail('Timeout waiting for the simulator')
+            time.sleep(0.02)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class AsyncCancelTest(SimulatorTestCase):
+    r"""
+        Cancellation of the operations of AsyncBeeCmd
+    """
+
+    def setUp(self):
+        super(AsyncCancelTest, self).setUp()
+        self.path = self.makeGcode('async.gcode', 120000)
+        self.asyncCmd = self.conn.getAsyncIntf()
+
+    def test_cancel_running_transfer(self):
+        future = self.asyncCmd.transferSDFile(self.path, 'ASYNC')
+        self.waitUntil(lambda: self.conn.transferring)
+
+        self.assertTrue(self.asyncCmd.cancel(future))
+        self.assertFalse(future.result(20))
+        self.waitUntil(lambda: not self.conn.transferring)
+
+    def test_cancel_queued_operation(self):
+        transfer = self.asyncCmd.transferSDFile(self.path, 'ASYNC')
+        status = self.asyncCmd.getStatus()
+        home = self.asyncCmd.home()
+
+        self.assertTrue(self.asyncCmd.cancel(home))
+        self.assertTrue(home.cancelled())
+        self.assertIsNotNone(status.result(20))
+        self.assertTrue(self.asyncCmd.cancel(transfer))
+        self.assertFalse(transfer.result(20))
+        self.assertEqual(self.receivedCommands(b'G28'), [])
+
+    def test_executor_kept_after_reconnect(self):
+        executor = self.conn.getExecutor()
+
+        self.assertTrue(self.conn.reconnect())
+
+        self.assertIs(self.conn.getExecutor(), executor)
+        self.assertIsNotNone(self.conn.getAsyncIntf().getStatus().result(20))
+
+
+class AsyncEmergencyTest(SimulatorTestCase):
+    r"""
+        Emergency commands of AsyncBeeCmd while the executor is busy
+    """
+
+    def setUp(self):
+        super(AsyncEmergencyTest, self).setUp()
+        self.asyncCmd = self.conn.getAsyncIntf()
+        self.release = threading.Event()
+        self.busy = self.conn.getExecutor().submit(self.conn, self.release.wait, 30)
+
+    def tearDown(self):
+        self.release.set()
+        self.busy.result(30)
+        super(AsyncEmergencyTest, self).tearDown()
+
+    def test_cancel_print_not_queued(self):
+        status = self.asyncCmd.getStatus()
+        cancel = self.asyncCmd.cancelPrint()
+
+        self.assertTrue(cancel.result(10))
+        self.assertFalse(status.done())
+        self.assertEqual(len(self.receivedCommands(b'M112')), 1)
+
+    def test_cancel_transfer_not_queued(self):
+        self.assertFalse(self.asyncCmd.cancelTransfer().result(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import unittest
+
+from beedriver import commandScheduler
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class PriorityOfTest(unittest.TestCase):
+    r"""
+        Priority class of the commands
+    """
+
+    def test_classes(self):
+        self.assertEqual(commandScheduler.priorityOf('M112\n'), commandScheduler.EMERGENCY)
+        self.assertEqual(commandScheduler.priorityOf('m640;pause\n'), commandScheduler.EMERGENCY)
+        self.assertEqual(commandScheduler.priorityOf('M625\n'), commandScheduler.TELEMETRY)
+        self.assertEqual(commandScheduler.priorityOf('G28\n'), commandScheduler.NORMAL)
+        self.assertEqual(commandScheduler.priorityOf(''), commandScheduler.NORMAL)
+
+
+class SlotTest(unittest.TestCase):
+    r"""
+        Order in which the waiting writes get the write slot
+    """
+
+    def test_priority_order(self):
+        scheduler = commandScheduler.CommandScheduler()
+        order = []
+
+        def write(priority):
+            with scheduler.slot(priority):
+                order.append(priority)
+
+        with scheduler.slot():
+            threads = []
+            for priority in (commandScheduler.TELEMETRY, commandScheduler.NORMAL, commandScheduler.EMERGENCY):
+                t = threading.Thread(target=write, args=(priority,))
+                t.start()
+                threads.append(t)
+                while sum(scheduler.getWaiting().values()) < len(threads):
+                    time.sleep(0.01)
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(order, [commandScheduler.EMERGENCY, commandScheduler.NORMAL, commandScheduler.TELEMETRY])
+
+
+class EmergencyDuringTransferTest(SimulatorTestCase):
+    r"""
+        Emergency command sent while a G-code transfer runs in another thread
+    """
+
+    def setUp(self):
+        super(EmergencyDuringTransferTest, self).setUp()
+        self.path = self.makeGcode('transfer.gcode', 60000)
+        self.conn.getCommandIntf().transferSDFile(self.path, 'TRANSF', background=True)
+        self.waitUntil(lambda: self.conn.transferring)
+
+    def test_emergency_command(self):
+        resp = self.conn.sendCmd('M640\n')
+
+        self.assertIsNotNone(resp)
+        self.waitUntil(lambda: not self.conn.transferring, 60)
+        self.assertEqual(bytes(self.sim.sdFiles['TRANSF']), self.readFile(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import unittest
+
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class PipelinedDispatchTest(SimulatorTestCase):
+    r"""
+        Commands kept in flight by dispatchPipelined and the pipelined sendCmd
+    """
+
+    LATENCY = 0.05
+
+    def setUp(self):
+        super(PipelinedDispatchTest, self).setUp()
+        self.commands = ['M105' if i % 2 else 'G1 X%d F3000' % i for i in range(16)]
+
+    def test_replies_in_order(self):
+        replies = self.conn.dispatchPipelined(self.commands)
+
+        self.assertEqual(len(replies), len(self.commands))
+        for command, reply in zip(self.commands, replies):
+            self.assertEqual('T:' in reply, command == 'M105', reply)
+            self.assertIn('ok', reply)
+
+    def test_commands_in_flight(self):
+        start = time.time()
+        self.conn.dispatchPipelined(self.commands, window=4)
+
+        # One command at a time takes at least one round trip per command
+        self.assertLess(time.time() - start, len(self.commands) * self.LATENCY / 2)
+        self.assertLessEqual(self.conn.getQueueDepth(), self.conn.MAX_QUEUE_DEPTH)
+
+    def test_concurrent_send_cmd(self):
+        self.conn.enablePipelining()
+        replies = {}
+
+        def query(n):
+            replies[n] = self.conn.sendCmd('M105\n')
+
+        threads = [threading.Thread(target=query, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+
+        self.assertEqual(len(replies), 4)
+        for reply in replies.values():
+            self.assertIn('T:', reply)
+
+
+class SendBatchTest(SimulatorTestCase):
+    r"""
+        Commands packed in few USB writes by sendBatch
+    """
+
+    def setUp(self):
+        super(SendBatchTest, self).setUp()
+        self.writes = []
+        receive = self.sim.receive
+
+        def record(data):
+            self.writes.append(bytes(data))
+            return receive(data)
+
+        self.sim.receive = record
+
+    def test_packed_writes(self):
+        replies = self.conn.sendBatch(['G1 X%d' % i for i in range(100)])
+
+        self.assertEqual(len(replies), 100)
+        for reply in replies:
+            self.assertIn('ok', reply)
+        self.assertLess(len(self.writes), 20)
+        for write in self.writes:
+            self.assertLessEqual(len(write), self.conn.BATCH_WRITE_SIZE)
+            self.assertLessEqual(write.count(b'\n'), self.conn.MAX_QUEUE_DEPTH)
+
+    def test_wait_status(self):
+        replies = self.conn.getCommandIntf().sendBatch(['M105', 'M625'], '3')
+
+        self.assertEqual(len(replies), 2)
+        self.assertIn('T:', replies[0])
+        self.assertIn('S:3', replies[1])
+
+    def test_macro_in_one_write(self):
+        self.conn.getCommandIntf().goToHeatPos()
+
+        self.assertEqual(self.writes[0].count(b'\n'), 4)
+        self.assertEqual(set(self.writes[1:]), set([b'M625\n']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class FirmwareTestCase(SimulatorTestCase):
+    r"""
+        Base class of the firmware flashing tests, run in bootloader mode
+    """
+
+    FIRMWARE = 'BEEVC-BEETHEFIRST-10.6.0'
+
+    def setUp(self):
+        super(FirmwareTestCase, self).setUp()
+        self.beeCmd = self.conn.getCommandIntf()
+        self.beeCmd.goToBootloader()
+        self.path = os.path.join(self.tmpDir, 'firmware.bin')
+        self.writeImage(200000)
+
+    def writeImage(self, size):
+        self.image = os.urandom(size)
+        with open(self.path, 'wb') as f:
+            f.write(self.image)
+
+    def flash(self, **kwargs):
+        self.beeCmd.flashFirmware(self.path, self.FIRMWARE, background=False, **kwargs)
+
+
+class WindowedFlashTest(FirmwareTestCase):
+    r"""
+        Firmware images flashed with several hash verified chunks in flight (windowed=True)
+    """
+
+    def test_windowed(self):
+        self.flash(windowed=True)
+
+        self.assertEqual(self.sim.firmwareImage, self.image)
+        self.assertEqual(self.sim.firmwareString, self.FIRMWARE)
+
+    def test_windowed_with_errors(self):
+        self.sim.errorRate = 0.0005
+
+        self.flash(windowed=True)
+
+        self.assertEqual(self.sim.firmwareImage, self.image)
+
+    def test_not_windowed(self):
+        self.flash()
+
+        self.assertEqual(self.sim.firmwareImage, self.image)
+        self.assertEqual(self.sim.firmwareString, self.FIRMWARE)
+
+
+class SkipFlashTest(FirmwareTestCase):
+    r"""
+        Flashes skipped when the printer already has the image (skipIfCurrent=True)
+    """
+
+    def setUp(self):
+        super(SkipFlashTest, self).setUp()
+        self.flash(windowed=True)
+        del self.received[:]
+
+    def test_current_firmware_skipped(self):
+        self.assertTrue(self.beeCmd.isFirmwareCurrent(self.path, self.FIRMWARE))
+
+        self.flash(skipIfCurrent=True)
+
+        self.assertEqual(self.receivedCommands(b'M650'), [])
+
+    def test_only_firmware_string_set(self):
+        self.beeCmd.setFirmwareString('0.0.0')
+
+        self.flash(skipIfCurrent=True)
+
+        self.assertEqual(self.receivedCommands(b'M650'), [])
+        self.assertEqual(self.sim.firmwareString, self.FIRMWARE)
+
+    def test_changed_image_flashed(self):
+        self.writeImage(20000)
+        self.assertFalse(self.beeCmd.isFirmwareCurrent(self.path, self.FIRMWARE))
+
+        self.flash(skipIfCurrent=True)
+
+        self.assertEqual(self.sim.firmwareImage, self.image)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+
+from beedriver import gcodeMinifier
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+@unittest.skipUnless(gcodeMinifier.isAvailable(), 'gcoder is not installed')
+class GCodeMinifierTest(unittest.TestCase):
+    r"""
+        Lines minified by GCodeMinifier
+    """
+
+    def setUp(self):
+        self.minifier = gcodeMinifier.GCodeMinifier()
+
+    def minify(self, lines):
+        return [self.minifier.minifyLine(line) for line in lines]
+
+    def test_comments_and_blank_lines(self):
+        self.assertEqual(self.minify(['; generated\n', '\n', 'G28 (home)\n', 'G90 ; absolute\n']),
+                         ['', '', 'G28\n', 'G90\n'])
+
+    def test_repeated_modal_values(self):
+        self.assertEqual(self.minify(['G1 X1.1234567 Y2 E0.1 F1800\n', 'G1 X1.1234567 Y3 E0.2 F1800\n']),
+                         ['G1 X1.123 Y2 E0.1 F1800\n', 'G1 Y3 E0.2\n'])
+
+    def test_lines_kept(self):
+        lines = ['M117 Layer (1) ; top\n', 'N3 G1 X1*55\n', 'G1 X5 F1800.5\n']
+
+        self.assertEqual(self.minify(lines), ['M117 Layer (1) ; top\n', 'N3 G1 X1*55\n', 'G1 X5 F1800.5\n'])
+
+
+@unittest.skipUnless(gcodeMinifier.isAvailable(), 'gcoder is not installed')
+class MinifiedTransferTest(SimulatorTestCase):
+    r"""
+        G-code minified while it is transferred (minify=True)
+    """
+
+    def setUp(self):
+        super(MinifiedTransferTest, self).setUp()
+        self.path = os.path.join(self.tmpDir, 'minify.gcode')
+        with open(self.path, 'w') as f:
+            f.write('; generated by slicer\nG21\nG90\nM82\n')
+            for i in range(30000):
+                f.write('G1 X%.6f Y%.6f E%.6f F1800 ; perimeter\n' % (i % 100 / 3.0, i % 77 / 7.0, i * 0.05))
+                if i % 10 == 0:
+                    f.write(';TYPE:WALL-OUTER\n\n')
+
+        minifier = gcodeMinifier.GCodeMinifier()
+        with open(self.path) as f:
+            self.minified = ''.join(minifier.minifyLine(line) for line in f)
+        self.beeCmd = self.conn.getCommandIntf()
+
+    def test_stream_seek_back(self):
+        stream = gcodeMinifier.MinifiedStream(self.path)
+        data = []
+        try:
+            while True:
+                pos = stream.tell()
+                chunk = stream.read(32768)
+                if not chunk:
+                    break
+                stream.seek(pos)
+                self.assertEqual(stream.read(32768), chunk)
+                data.append(chunk)
+        finally:
+            stream.close()
+
+        self.assertEqual(''.join(data), self.minified)
+
+    def test_transfer(self):
+        self.beeCmd.transferSDFile(self.path, 'MIN', background=False, minify=True)
+
+        self.assertEqual(bytes(self.sim.sdFiles['MIN']), self.minified)
+        self.assertLess(len(self.minified), os.path.getsize(self.path) / 2)
+
+    def test_transfer_with_errors(self):
+        self.sim.errorRate = 0.002
+
+        self.beeCmd.transferSDFile(self.path, 'MIN', background=False, minify=True)
+
+        self.assertEqual(bytes(self.sim.sdFiles['MIN']), self.minified)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import unittest
+
+from beedriver import jobQueueThread
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class ReconnectJobQueueTest(SimulatorTestCase):
+    r"""
+        Job queue of a connection that is reconnected or closed
+    """
+
+    def setUp(self):
+        super(ReconnectJobQueueTest, self).setUp()
+        self.paths = [self.makeGcode('job%d.gcode' % i, 20000) for i in range(3)]
+
+    def test_next_job_heated_after_print(self):
+        jobQueue = self.conn.getJobQueue()
+        jobs = []
+        heated = []
+        receive = self.sim.receive
+
+        def record(data):
+            if bytes(data).startswith(b'M104 S225'):
+                heated.append((jobs[0].state, jobs[1].state))
+            return receive(data)
+
+        self.sim.receive = record
+        jobs.extend(jobQueue.addJob(path, temperature) for path, temperature in zip(self.paths, (210, 220)))
+
+        self.assertTrue(jobQueue.waitIdle(120))
+        self.assertEqual(heated, [(jobQueueThread.PrintJob.DONE, jobQueueThread.PrintJob.UPLOADED)])
+        self.assertEqual(bytes(self.sim.sdFiles[jobs[1].sdFileName]), self.readFile(self.paths[1]))
+
+    def test_reconnect_keeps_jobs(self):
+        jobQueue = self.conn.getJobQueue()
+        jobs = [jobQueue.addJob(path, None) for path in self.paths]
+        self.waitUntil(lambda: jobs[0].state == jobQueueThread.PrintJob.PRINTING)
+
+        self.assertTrue(self.conn.reconnect())
+
+        restored = self.conn.getJobQueue()
+        self.assertIsNot(restored, jobQueue)
+        self.assertTrue(restored.waitIdle(120))
+        self.assertEqual([job.state for job in jobs], [jobQueueThread.PrintJob.DONE] * 3)
+        for path, job in zip(self.paths, jobs):
+            self.assertEqual(bytes(self.sim.sdFiles[job.sdFileName]), self.readFile(path))
+
+    def test_reconnect_keeps_jog(self):
+        jog = self.conn.startJog(feedrate=1200)
+
+        self.assertTrue(self.conn.reconnect())
+
+        restored = self.conn.getJog()
+        self.assertIsNotNone(restored)
+        self.assertIsNot(restored, jog)
+        self.assertEqual(restored.getSettings()['feedrate'], 1200)
+
+    def test_close_fails_jobs(self):
+        job = self.conn.getJobQueue().addJob(self.paths[0], None)
+
+        self.conn.close()
+
+        self.assertEqual(job.state, jobQueueThread.PrintJob.FAILED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+
+from beedriver import commands
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class PrintControlTest(SimulatorTestCase):
+    r"""
+        Pause, shutdown and cancel of an SD print
+    """
+
+    TIME_SCALE = 20.0
+    LINES_PER_SECOND = 5
+
+    def setUp(self):
+        super(PrintControlTest, self).setUp()
+        self.sim.sdFiles['PRINT'] = bytearray(b'G1 X1\n' * 10000)
+        self.beeCmd = self.conn.getCommandIntf()
+        self.beeCmd.startSDPrint('PRINT')
+        self.waitUntil(lambda: self.beeCmd.getStatus() == 'SD_Print')
+
+    def test_pause_resume(self):
+        self.beeCmd.pausePrint()
+
+        self.assertTrue(self.beeCmd.waitForPause())
+        self.assertEqual(self.beeCmd.getPrintState(), commands.BeeCmd.PRINT_PAUSED)
+        self.beeCmd.resumePrint()
+        self.assertEqual(self.beeCmd.getPrintState(), commands.BeeCmd.PRINT_RUNNING)
+
+    def test_shutdown_state_shared(self):
+        self.assertTrue(self.beeCmd.enterShutdown())
+
+        self.assertEqual(self.conn.getCommandIntf().getPrintState(), commands.BeeCmd.PRINT_SHUTDOWN)
+        self.assertEqual(len(self.receivedCommands(b'M36')), 1)
+
+
+class EmergencyCommandTest(SimulatorTestCase):
+    r"""
+        Emergency commands are not delayed by the commands in progress
+    """
+
+    TIME_SCALE = 1.0
+
+    def test_not_blocked_by_command_lock(self):
+        beeCmd = self.conn.getCommandIntf()
+
+        # Held as by a long command (home, move, waitForStatus) of another thread
+        with beeCmd._commandLock:
+            pause = threading.Thread(target=beeCmd.pausePrint)
+            pause.start()
+            self.waitUntil(lambda: len(self.receivedCommands(b'M640')) > 0, 5)
+            cancel = threading.Thread(target=beeCmd.cancelPrint)
+            cancel.start()
+            self.waitUntil(lambda: len(self.receivedCommands(b'M112')) > 0, 5)
+
+        pause.join(20)
+        cancel.join(20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import unittest
+
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class QueryCacheTest(SimulatorTestCase):
+    r"""
+        TTL cache of the read only BeeCmd queries
+    """
+
+    def setUp(self):
+        super(QueryCacheTest, self).setUp()
+        self.conn.setQueryCacheTTL(5)
+        self.beeCmd = self.conn.getCommandIntf()
+
+    def test_cached_until_state_change(self):
+        for _ in range(5):
+            self.assertIsNotNone(self.beeCmd.getNozzleTemperature())
+        self.assertEqual(len(self.receivedCommands(b'M105')), 1)
+
+        self.beeCmd.setNozzleTemperature(180)
+        self.beeCmd.getNozzleTemperature()
+
+        self.assertEqual(len(self.receivedCommands(b'M105')), 2)
+
+    def test_expires_after_ttl(self):
+        self.conn.setQueryCacheTTL(0.2)
+
+        self.beeCmd.getNozzleTemperature()
+        self.beeCmd.getNozzleTemperature()
+        time.sleep(0.3)
+        self.beeCmd.getNozzleTemperature()
+
+        self.assertEqual(len(self.receivedCommands(b'M105')), 2)
+
+    def test_query_ttl(self):
+        self.conn.setQueryCacheTTL(0, 'getNozzleTemperature')
+
+        for _ in range(3):
+            self.beeCmd.getNozzleTemperature()
+            self.beeCmd.getStatus()
+
+        self.assertEqual(len(self.receivedCommands(b'M105')), 3)
+        self.assertEqual(len(self.receivedCommands(b'M625')), 1)
+
+    def test_returns_copies(self):
+        variables = self.beeCmd.getPrintVariables()
+        variables['Lines'] = -1
+
+        self.assertNotEqual(self.beeCmd.getPrintVariables()['Lines'], -1)
+
+    def test_cached_queries_survive_transfer(self):
+        path = self.makeGcode('cache.gcode', 40000)
+        self.assertIsNotNone(self.beeCmd.getNozzleTemperature())
+
+        self.conn.getCommandIntf().transferSDFile(path, 'CACHE', background=True)
+        self.waitUntil(lambda: self.conn.transferring)
+        deadline = time.time() + 2
+        while time.time() < deadline and self.conn.transferring:
+            self.assertIsNotNone(self.beeCmd.getNozzleTemperature())
+            time.sleep(0.1)
+
+        self.assertEqual(len(self.receivedCommands(b'M105')), 1)
+        self.waitUntil(lambda: not self.conn.transferring, 60)
+        self.assertEqual(bytes(self.sim.sdFiles['CACHE']), self.readFile(path))
+
+
+class SingleFlightTest(SimulatorTestCase):
+    r"""
+        Concurrent calls of the same query coalesced without caching (TTL 0)
+    """
+
+    LATENCY = 0.1
+
+    def concurrentQueries(self, count):
+        start = threading.Event()
+        results = []
+
+        def query():
+            start.wait()
+            results.append(self.conn.getCommandIntf().getNozzleTemperature())
+
+        threads = [threading.Thread(target=query) for _ in range(count)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join(10)
+
+        return results
+
+    def test_concurrent_queries_share_one_read(self):
+        results = self.concurrentQueries(8)
+
+        self.assertEqual(len(results), 8)
+        self.assertNotIn(None, results)
+        self.assertLess(len(self.receivedCommands(b'M105')), 8)
+
+    def test_not_shared_across_commands(self):
+        self.concurrentQueries(4)
+        self.conn.getCommandIntf().setNozzleTemperature(180)
+        self.concurrentQueries(4)
+
+        self.assertGreaterEqual(len(self.receivedCommands(b'M105')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import unittest
+
+from beedriver import streamThread
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class StreamPrintTest(SimulatorTestCase):
+    r"""
+        Host-streamed prints
+    """
+
+    def setUp(self):
+        super(StreamPrintTest, self).setUp()
+        self.path = self.makeGcode('stream.gcode', 2000)
+        self.beeCmd = self.conn.getCommandIntf()
+
+    def test_lines_sent_in_order(self):
+        self.assertTrue(self.beeCmd.streamPrint(self.path, None))
+
+        stream = self.conn.getStream()
+        self.assertEqual(stream.waitFinished(60), streamThread.HostStreamThread.STATE_FINISHED)
+        self.assertEqual(b'\n'.join(self.receivedCommands(b'G1')) + b'\n', self.readFile(self.path))
+        self.assertEqual(self.sim.sdFiles, {})
+
+
+class ModalStateTest(unittest.TestCase):
+    r"""
+        Modal state rebuilt from the lines skipped by a resumed streamed print
+    """
+
+    def test_commands(self):
+        state = streamThread.ModalState()
+        for line in ['G90', 'M83', 'G1 F1500 E2', 'G1 X1 E1.5', 'G92 E0', 'G1 E1',
+                     'N5 G1 X2 F900.5*33', 'G91', 'M82', 'G1 E2']:
+            state.update(line)
+
+        self.assertEqual(state.getCommands(), ['G91', 'M82', 'G92 E3.00000', 'G1 F900.5'])
+
+    def test_absolute_extruder(self):
+        state = streamThread.ModalState()
+        for line in ['G1 X1 E5 F600', 'G1 E7.25', 'G92']:
+            state.update(line)
+
+        self.assertEqual(state.getCommands(), ['G90', 'M82', 'G92 E0.00000', 'G1 F600'])
+
+
+if __name__ == '__main__':
+    unittest.main()
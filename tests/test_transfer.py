@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+import unittest
+
+from simulatorTestCase import SimulatorTestCase
+
+"""
+* Copyright (c) 2015 BEEVC - Electronic Systems This file is part of BEESOFT
+* software: you can redistribute it and/or modify it under the terms of the GNU
+* General Public License as published by the Free Software Foundation, either
+* version 3 of the License, or (at your option) any later version. BEESOFT is
+* distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+* without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+* PARTICULAR PURPOSE. See the GNU General Public License for more details. You
+* should have received a copy of the GNU General Public License along with
+* BEESOFT. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "BVC Electronic Systems"
+__license__ = ""
+
+
+class TransferTestCase(SimulatorTestCase):
+    r"""
+        Base class of the SD file transfer tests
+    """
+
+    def setUp(self):
+        super(TransferTestCase, self).setUp()
+        self.beeCmd = self.conn.getCommandIntf()
+
+    def transfer(self, path, sdFileName, **kwargs):
+        self.beeCmd.transferSDFile(path, sdFileName, background=False, **kwargs)
+
+        return self.beeCmd.getTransferThread()
+
+    def interruptedTransfer(self, path, sdFileName, position, **kwargs):
+        self.beeCmd.transferSDFile(path, sdFileName, background=True, **kwargs)
+        thread = self.beeCmd.getTransferThread()
+        self.waitUntil(lambda: thread.bytesTransferred >= position or not thread.isRunning(), 60)
+        self.beeCmd.cancelTransfer()
+        thread.join(20)
+        self.assertLess(thread.bytesTransferred, thread.fileSize)
+
+        return thread
+
+    def assertSDFile(self, sdFileName, path):
+        self.assertEqual(bytes(self.sim.sdFiles[sdFileName]), self.readFile(path))
+
+
+class ResumeTransferTest(TransferTestCase):
+    r"""
+        Interrupted transfers continued from the TransferJournal (resume=True)
+    """
+
+    def setUp(self):
+        super(ResumeTransferTest, self).setUp()
+        self.pathA = self.makeGcode('a.gcode', 60000)
+        self.pathB = self.makeGcode('b.gcode', 50000)
+
+    def test_resume(self):
+        interrupted = self.interruptedTransfer(self.pathA, 'JOB', 262144, resume=True)
+
+        thread = self.transfer(self.pathA, 'JOB', resume=True)
+
+        self.assertGreater(thread.bytesResumed, 0)
+        self.assertLessEqual(thread.bytesResumed, interrupted.bytesTransferred)
+        self.assertSDFile('JOB', self.pathA)
+
+    def test_journal_discarded_by_other_transfer(self):
+        self.interruptedTransfer(self.pathA, 'JOB', 262144, resume=True)
+        self.transfer(self.pathB, 'JOB')
+        self.assertSDFile('JOB', self.pathB)
+
+        thread = self.transfer(self.pathA, 'JOB', resume=True)
+
+        self.assertEqual(thread.bytesResumed, 0)
+        self.assertSDFile('JOB', self.pathA)
+
+    def test_sd_file_changed_outside(self):
+        self.interruptedTransfer(self.pathA, 'JOB', 262144, resume=True)
+        self.sim.sdFiles['JOB'] = bytearray(self.readFile(self.pathB))
+
+        thread = self.transfer(self.pathA, 'JOB', resume=True)
+
+        self.assertEqual(thread.bytesResumed, 0)
+        self.assertSDFile('JOB', self.pathA)
+
+
+class DeltaTransferTest(TransferTestCase):
+    r"""
+        Transfers that only send the blocks changed since the last upload (delta=True)
+    """
+
+    def setUp(self):
+        super(DeltaTransferTest, self).setUp()
+        self.path = self.makeGcode('part.gcode', 30000)
+        self.transfer(self.path, 'PART', delta=True)
+
+    def rewrite(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def test_first_transfer_sends_everything(self):
+        self.assertEqual(self.beeCmd.getTransferSkippedBytes(), 0)
+        self.assertSDFile('PART', self.path)
+
+    def test_changed_block(self):
+        data = bytearray(self.readFile(self.path))
+        data[400000] = ord('7') if data[400000] != ord('7') else ord('8')
+        self.rewrite(bytes(data) + b'M104 S0\n')
+
+        self.transfer(self.path, 'PART', delta=True)
+
+        self.assertGreater(self.beeCmd.getTransferSkippedBytes(), len(data) / 2)
+        self.assertSDFile('PART', self.path)
+
+    def test_shrunk_file(self):
+        self.rewrite(self.readFile(self.path)[:3000])
+
+        self.transfer(self.path, 'PART', delta=True)
+
+        self.assertSDFile('PART', self.path)
+
+
+class SDCacheTest(TransferTestCase):
+    r"""
+        Transfers skipped when the SD card already holds the same content (cache=True)
+    """
+
+    def setUp(self):
+        super(SDCacheTest, self).setUp()
+        self.path = self.makeGcode('cached.gcode', 20000)
+        self.transfer(self.path, 'CACHED', cache=True)
+
+    def test_same_file_skipped(self):
+        self.transfer(self.path, 'CACHED', cache=True)
+
+        self.assertEqual(self.beeCmd.getTransferSkippedBytes(), len(self.readFile(self.path)))
+        self.assertEqual(len(self.receivedCommands(b'M30')), 1)
+        self.assertSDFile('CACHED', self.path)
+
+    def test_other_name_uploaded(self):
+        self.transfer(self.path, 'COPY', cache=True)
+
+        self.assertEqual(self.beeCmd.getTransferSkippedBytes(), 0)
+        self.assertSDFile('COPY', self.path)
+
+    def test_print_reuses_sd_file(self):
+        self.assertTrue(self.beeCmd.printFile(self.path, None, background=False, cache=True))
+
+        self.assertEqual(len(self.receivedCommands(b'M30')), 1)
+        self.assertEqual(self.receivedCommands(b'M33'), [b'M33 CACHED'])
+
+    def test_sd_file_deleted(self):
+        del self.sim.sdFiles['CACHED']
+
+        self.transfer(self.path, 'CACHED', cache=True)
+
+        self.assertEqual(self.beeCmd.getTransferSkippedBytes(), 0)
+        self.assertSDFile('CACHED', self.path)
+
+
+class TransferWithCommandsTest(SimulatorTestCase):
+    r"""
+        Commands sent while a G-code transfer runs in another thread
+    """
+
+    def setUp(self):
+        super(TransferWithCommandsTest, self).setUp()
+        self.path = self.makeGcode('transfer.gcode', 60000)
+        self.owner = self.conn.getCommandIntf()
+        self.owner.transferSDFile(self.path, 'TRANSF', background=True)
+        self.waitUntil(lambda: self.conn.transferring)
+
+    def test_commands_between_blocks(self):
+        other = self.conn.getCommandIntf()
+
+        self.assertTrue(other.isTransferring())
+        self.assertIsNone(other.setBlowerSpeed(100))
+        self.assertIn('ok', self.conn.sendCmd('M106 S50\n'))
+        self.assertIsNotNone(other.getStatus())
+
+        self.waitUntil(lambda: not self.conn.transferring, 60)
+        self.assertEqual(bytes(self.sim.sdFiles['TRANSF']), self.readFile(self.path))
+        self.assertEqual(len(self.receivedCommands(b'M106')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()